@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compares the cost of :py:class:`is_client` against the equivalent
+``All(is_subject(...), is_issuer(...))``.
+
+Usage: python benchmarks/bench_client.py [number of evaluations]
+"""
+
+from repoze.what.predicates import All
+import sys
+import timeit
+
+from repoze.what.plugins.x509 import is_client, is_subject, is_issuer
+
+
+ENVIRON = {
+    'SSL_CLIENT_VERIFY': 'SUCCESS',
+    'SSL_CLIENT_V_START': 'Jan  1 00:00:00 2012 GMT',
+    'SSL_CLIENT_V_END': 'Jan  1 00:00:00 2100 GMT',
+    'SSL_CLIENT_S_DN': '/C=US/ST=California/L=San Diego/O=Example'
+                       '/OU=Engineering/CN=John Smith',
+    'SSL_CLIENT_I_DN': '/C=US/O=Example/CN=Example Intermediate CA',
+}
+
+SUBJECT = {'common_name': 'John Smith', 'organization': 'Example'}
+ISSUER = {'common_name': 'Example Intermediate CA', 'country': 'US'}
+
+
+def bench(predicate, number):
+    # A new environ per evaluation, as every request has its own.
+    def run():
+        predicate.is_met(dict(ENVIRON))
+    return min(timeit.repeat(run, number=number, repeat=3)) / number
+
+
+def main(argv=None):
+    argv = argv or sys.argv
+    number = int(argv[1]) if len(argv) > 1 else 20000
+    compound = bench(All(is_subject(**SUBJECT), is_issuer(**ISSUER)), number)
+    fused = bench(is_client(subject=SUBJECT, issuer=ISSUER), number)
+    print 'All(is_subject, is_issuer): %8.2f us' % (compound * 1e6)
+    print 'is_client:                  %8.2f us' % (fused * 1e6)
+    print 'ratio:                      %8.2f' % (fused / compound)
+
+
+if __name__ == '__main__':
+    main()
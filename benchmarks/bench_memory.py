@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Reports the memory used per :py:class:`is_subject` rule for large rule sets.
+The values of the rules are built at run time, as if they were read from a
+configuration file, so equal values are different strings.
+
+Usage: python benchmarks/bench_memory.py [number of rules ...]
+"""
+
+import gc
+import sys
+import types
+
+from repoze.what.plugins.x509 import is_subject, any_of
+
+
+COUNTRIES = ('US', 'MX', 'CA', 'DE')
+UNITS = ('Engineering', 'Operations', 'Sales', 'Support', 'Finance')
+
+# Shared by every rule of the process, not part of the cost of a rule.
+_SKIPPED = (type, types.ModuleType, types.FunctionType,
+            types.BuiltinFunctionType, types.MethodType)
+
+
+def _fresh(value):
+    # A copy of a string that is not the same object.
+    return value[:1] + value[1:]
+
+
+def make_rules(count):
+    rules = []
+    for n in xrange(count):
+        kwargs = {
+            'organization': _fresh('Example'),
+            'country': _fresh(COUNTRIES[n % len(COUNTRIES)]),
+            'organizational_unit': _fresh(UNITS[n % len(UNITS)]),
+        }
+        if n % 3 == 0:
+            kwargs['common_name'] = 'User %d' % (n % 1000)
+        if n % 7 == 0:
+            kwargs['organizational_unit'] = any_of(
+                _fresh(UNITS[n % len(UNITS)]),
+                _fresh(UNITS[(n + 1) % len(UNITS)])
+            )
+        rules.append(is_subject(**kwargs))
+    return rules
+
+
+def deep_size(root):
+    """
+    Gets the bytes of every object reachable from ``root``, counting every
+    object only once.
+    """
+    seen = set()
+    pending = [root]
+    size = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, _SKIPPED):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return size
+
+
+def main(argv=None):
+    argv = argv or sys.argv
+    counts = [int(count) for count in argv[1:]] or [10000, 100000]
+    for count in counts:
+        rules = make_rules(count)
+        size = deep_size(rules) - sys.getsizeof(rules)
+        print '%7d rules: %8.1f bytes per rule' % (count, float(size) / count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measures the overhead of :py:class:`x509_rate_limited` over the validation of
+the certificate alone, and the cost of a bucket update in the shared table
+with several processes updating it at once.
+
+Usage: python benchmarks/bench_ratelimit.py [number of evaluations]
+       [number of processes]
+"""
+
+import os
+import sys
+import time
+import timeit
+
+from repoze.what.plugins.x509 import X509Predicate, x509_rate_limited, \
+     RateLimitTable
+
+
+ENVIRON = {
+    'SSL_CLIENT_VERIFY': 'SUCCESS',
+    'SSL_CLIENT_V_START': 'Jan  1 00:00:00 2012 GMT',
+    'SSL_CLIENT_V_END': 'Jan  1 00:00:00 2100 GMT',
+    'SSL_CLIENT_S_DN': '/C=US/ST=California/L=San Diego/O=Example'
+                       '/OU=Engineering/CN=John Smith',
+}
+
+
+def bench(function, number):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number
+
+
+def bench_predicate(predicate, number):
+    # A new environ per evaluation, as every request has its own.
+    def run():
+        predicate.is_met(dict(ENVIRON))
+    return bench(run, number)
+
+
+def bench_processes(table, processes, number):
+    # Every process updates its own buckets in the same table at once. The
+    # result is the wall time per update of all of them.
+    start = time.time()
+    pids = []
+    for n in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                key = n + 1
+                for _ in xrange(number):
+                    table.consume(key, 1e9, 1e9)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    return (time.time() - start) / (processes * number)
+
+
+def main(argv=None):
+    argv = argv or sys.argv
+    number = int(argv[1]) if len(argv) > 1 else 100000
+    processes = int(argv[2]) if len(argv) > 2 else 4
+    table = RateLimitTable()
+    # Never exceeded, so every evaluation goes all the way.
+    limited = x509_rate_limited(1e9, table=table)
+    baseline = bench_predicate(X509Predicate(), number)
+    rate_limited = bench_predicate(limited, number)
+    key = limited._bucket_key(ENVIRON)
+    consume = bench(lambda: table.consume(key, 1e9, 1e9), number)
+    shared = bench_processes(table, processes, number)
+    print 'X509Predicate:               %8.3f us' % (baseline * 1e6)
+    print 'x509_rate_limited:           %8.3f us' % (rate_limited * 1e6)
+    print 'overhead per check:          %8.3f us' % (
+        (rate_limited - baseline) * 1e6
+    )
+    print 'bucket update:               %8.3f us' % (consume * 1e6)
+    print 'bucket update, %2d processes: %8.3f us' % (processes,
+                                                      shared * 1e6)
+
+
+if __name__ == '__main__':
+    main()
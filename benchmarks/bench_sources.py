@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measures the cost of evaluating an :py:class:`is_client` rule through the
+source of every front end, each with the variables as sent by such front end.
+
+Usage: python benchmarks/bench_sources.py [source ...]
+"""
+
+from urllib import quote
+import sys
+import timeit
+
+from repoze.what.plugins.x509 import is_client, EnvironSource, ModSSLSource, \
+     NginxSource, HAProxySource, EnvoySource
+
+
+SUBJECT = {'common_name': 'John Smith', 'organization': 'Example'}
+ISSUER = {'common_name': 'Example Intermediate CA', 'country': 'US'}
+
+SUBJECT_OPENSSL = '/C=US/ST=California/L=San Diego/O=Example' \
+                  '/OU=Engineering/CN=John Smith'
+ISSUER_OPENSSL = '/C=US/O=Example/CN=Example Intermediate CA'
+SUBJECT_RFC2253 = 'CN=John Smith,OU=Engineering,O=Example,L=San Diego,' \
+                  'ST=California,C=US'
+ISSUER_RFC2253 = 'CN=Example Intermediate CA,O=Example,C=US'
+
+MOD_SSL = {
+    'SSL_CLIENT_VERIFY': 'SUCCESS',
+    'SSL_CLIENT_V_START': 'Jan  1 00:00:00 2012 GMT',
+    'SSL_CLIENT_V_END': 'Jan  1 00:00:00 2100 GMT',
+    'SSL_CLIENT_S_DN': SUBJECT_OPENSSL,
+    'SSL_CLIENT_I_DN': ISSUER_OPENSSL,
+}
+
+NGINX = dict(MOD_SSL, SSL_CLIENT_S_DN=SUBJECT_RFC2253,
+             SSL_CLIENT_I_DN=ISSUER_RFC2253)
+
+HAPROXY = {
+    'HTTP_X_SSL_CLIENT_VERIFY': '0',
+    'HTTP_X_SSL_CLIENT_NOTBEFORE': '120101000000Z',
+    'HTTP_X_SSL_CLIENT_NOTAFTER': '491231235959Z',
+    'HTTP_X_SSL_CLIENT_S_DN': SUBJECT_OPENSSL,
+    'HTTP_X_SSL_CLIENT_I_DN': ISSUER_OPENSSL,
+}
+
+
+def _envoy_environ():
+    # The issuer and the validity are read from the certificate.
+    import os
+    path = os.path.join(os.path.dirname(__file__), os.pardir, 'tests', 'data',
+                        'client.pem')
+    return {'HTTP_X_FORWARDED_CLIENT_CERT':
+            'Hash=00;Subject="%s";Cert=%s' % (SUBJECT_RFC2253,
+                                              quote(open(path).read()))}
+
+
+BENCHMARKS = (
+    ('environ', EnvironSource, lambda: MOD_SSL),
+    ('mod_ssl', ModSSLSource, lambda: MOD_SSL),
+    ('nginx', NginxSource, lambda: NGINX),
+    ('haproxy', HAProxySource, lambda: HAPROXY),
+    ('envoy', EnvoySource, _envoy_environ),
+)
+
+
+def bench(source, environ, number):
+    predicate = is_client(subject=SUBJECT, issuer=ISSUER, source=source)
+    assert predicate.is_met(dict(environ))
+
+    # A new environ per evaluation, as every request has its own.
+    def run():
+        predicate.is_met(dict(environ))
+    return min(timeit.repeat(run, number=number, repeat=3)) / number
+
+
+def main(argv=None):
+    argv = argv or sys.argv
+    names = argv[1:]
+    for name, source, environ in BENCHMARKS:
+        if names and name not in names:
+            continue
+        elapsed = bench(source(), environ(), 10000)
+        print '%-8s %8.2f us' % (name, elapsed * 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measures the time to build a subject table of exact distinguished names, its
+size, and the cost of a lookup, against a set of the canonical names in memory.
+
+Usage: python benchmarks/bench_subjects.py [number of names]
+       [number of lookups]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+from repoze.what.plugins.x509 import SubjectTable, write_subject_table
+from repoze.what.plugins.x509.subjects import canonical_dn
+
+
+def make_subjects(count):
+    for n in xrange(count):
+        yield '/C=US/ST=California/O=Example %d/OU=Engineering/CN=User %d' % (
+            n % 1000, n
+        )
+
+
+def bench(function, number):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number
+
+
+def main(argv=None):
+    argv = argv or sys.argv
+    count = int(argv[1]) if len(argv) > 1 else 1000000
+    number = int(argv[2]) if len(argv) > 2 else 100000
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'subjects.bin')
+        start = time.time()
+        write_subject_table(path, make_subjects(count))
+        build = time.time() - start
+        size = os.path.getsize(path)
+        table = SubjectTable.load(path)
+
+        key = canonical_dn('/C=US/ST=California/O=Example 7/OU=Engineering'
+                           '/CN=User 7')
+        missing = canonical_dn('/C=US/CN=Nobody')
+        found = bench(lambda: table._contains_key(key), number)
+        not_found = bench(lambda: table._contains_key(missing), number)
+
+        start = time.time()
+        names = set([canonical_dn(subject)
+                     for subject in make_subjects(count)])
+        baseline = time.time() - start
+        in_set = bench(lambda: key in names, number)
+        table.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print 'names:                     %8d' % count
+    print 'build table:               %8.3f s' % build
+    print 'build set (baseline):      %8.3f s' % baseline
+    print 'table file:                %8.3f MB (%.1f bytes per name)' % (
+        size / 1048576.0, float(size) / max(count, 1)
+    )
+    print 'lookup, found:             %8.3f us' % (found * 1e6)
+    print 'lookup, not found:         %8.3f us' % (not_found * 1e6)
+    print 'set lookup (baseline):     %8.3f us' % (in_set * 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Load test of the authorization of client certificates through a real local
+WSGI stack, to see how latency and throughput scale with the concurrency.
+
+The application is served by ``wsgiref`` either from one process with a thread
+per connection (``threads``), or from several forked processes sharing the
+listening socket (``prefork``). The clients run in their own processes and
+send the client certificate variables as headers, which a middleware turns
+into the ``mod_ssl`` WSGI environment. Every client sends its requests one
+after another, so the concurrency is the number of clients.
+
+Usage: python benchmarks/loadtest.py [options]
+"""
+
+from SocketServer import ThreadingMixIn
+from multiprocessing import Pool
+from optparse import OptionParser
+from repoze.what.predicates import All, Any
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, \
+     make_server
+import httplib
+import os
+import signal
+import sys
+import time
+
+from repoze.what.plugins.x509 import is_subject, is_issuer, NegativeCache
+
+
+# Headers of the clients, by the mod_ssl variable.
+VARIABLES = ('SSL_CLIENT_VERIFY', 'SSL_CLIENT_V_START', 'SSL_CLIENT_V_END',
+             'SSL_CLIENT_S_DN', 'SSL_CLIENT_I_DN')
+
+UNITS = ('Engineering', 'Operations', 'Sales', 'Support')
+
+LEVELS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _PreforkWSGIServer(WSGIServer):
+
+    request_queue_size = 128
+
+
+def make_predicate(negative_cache=False):
+    """
+    Gets the authorization rule of the application: a tree of
+    :py:class:`is_subject` and :py:class:`is_issuer` predicates.
+    """
+    options = {}
+    if negative_cache:
+        options['negative_cache'] = NegativeCache()
+    return All(
+        is_issuer(organization='Example', common_name='Example CA',
+                  **options),
+        Any(is_subject(organizational_unit='Engineering', **options),
+            is_subject(organizational_unit='Operations', country='US',
+                       **options)),
+    )
+
+
+def make_app(predicate):
+    """
+    Gets a WSGI application that answers 200 if the client certificate is
+    authorized and 403 otherwise.
+    """
+    def app(environ, start_response):
+        # What mod_ssl would have set.
+        for variable in VARIABLES:
+            value = environ.get('HTTP_' + variable)
+            if value is not None:
+                environ[variable] = value
+        if predicate.is_met(environ):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return ['authorized']
+        start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+        return ['denied']
+    return app
+
+
+def serve(mode, workers, app):
+    """
+    Starts the server in the background.
+
+    :return: The port and the ids of the forked processes.
+    """
+    if mode == 'threads':
+        server = make_server('127.0.0.1', 0, app,
+                             server_class=_ThreadingWSGIServer,
+                             handler_class=_QuietHandler)
+        workers = 1
+    else:
+        server = make_server('127.0.0.1', 0, app,
+                             server_class=_PreforkWSGIServer,
+                             handler_class=_QuietHandler)
+    port = server.server_address[1]
+
+    pids = []
+    for n in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, lambda *args: os._exit(0))
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    server.socket.close()
+    return port, pids
+
+
+def stop(pids):
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+def _headers(n):
+    unit = UNITS[n % len(UNITS)]
+    return {
+        'SSL_CLIENT_VERIFY': 'SUCCESS',
+        'SSL_CLIENT_V_START': 'Jan  1 00:00:00 2012 GMT',
+        'SSL_CLIENT_V_END': 'Jan  1 00:00:00 2100 GMT',
+        'SSL_CLIENT_S_DN': '/C=US/O=Example/OU=%s/CN=User %d' % (unit, n),
+        'SSL_CLIENT_I_DN': '/C=US/O=Example/CN=Example CA',
+    }
+
+
+def _client(args):
+    # Runs in a client process: the latencies of its requests, in seconds.
+    port, client, requests = args
+    latencies = []
+    for n in xrange(requests):
+        headers = _headers(client * requests + n)
+        start = time.time()
+        connection = httplib.HTTPConnection('127.0.0.1', port)
+        connection.request('GET', '/', headers=headers)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        latencies.append(time.time() - start)
+        if response.status not in (200, 403):
+            raise RuntimeError('Unexpected status %d' % response.status)
+    return latencies
+
+
+def percentile(values, fraction):
+    """
+    Gets the given percentile of the sorted values.
+    """
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(mode, concurrency, requests, negative_cache=False):
+    """
+    Runs one level of the load test.
+
+    :param mode: ``threads`` or ``prefork``.
+    :param concurrency: The number of clients, and of server processes in
+        the ``prefork`` mode.
+    :param requests: The number of requests of every client.
+
+    :return: A tuple with the 50th and 99th percentile of the latency in
+        seconds, and the throughput in requests per second.
+    """
+    app = make_app(make_predicate(negative_cache))
+    port, pids = serve(mode, concurrency, app)
+    pool = Pool(concurrency)
+    try:
+        start = time.time()
+        results = pool.map(_client, [(port, client, requests)
+                                     for client in range(concurrency)])
+        elapsed = time.time() - start
+    finally:
+        pool.terminate()
+        stop(pids)
+
+    latencies = sorted([l for latency in results for l in latency])
+    return (percentile(latencies, 0.5), percentile(latencies, 0.99),
+            len(latencies) / elapsed)
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-m', '--mode', dest='modes', action='append',
+                      choices=('threads', 'prefork'),
+                      help='threads or prefork (default: both)')
+    parser.add_option('-c', '--concurrency', dest='levels', type='int',
+                      action='append',
+                      help='number of clients (default: 1 to 64)')
+    parser.add_option('-n', '--requests', dest='requests', type='int',
+                      default=200, help='requests per client (default: 200)')
+    parser.add_option('--negative-cache', dest='negative_cache',
+                      action='store_true', default=False,
+                      help='construct the predicates with a negative cache')
+    options, args = parser.parse_args(argv)
+
+    print '%-8s %6s %10s %10s %12s' % ('mode', 'conc', 'p50 (ms)',
+                                       'p99 (ms)', 'requests/s')
+    for mode in options.modes or ('threads', 'prefork'):
+        for level in options.levels or LEVELS:
+            p50, p99, throughput = run(mode, level, options.requests,
+                                       options.negative_cache)
+            print '%-8s %6d %10.2f %10.2f %12.1f' % (
+                mode, level, p50 * 1000, p99 * 1000, throughput
+            )
+            sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -24,8 +24,43 @@ Repoze what x509 plugin. It contains support for client certificate predicates.
 from zope.interface import implements as zope_implements
 
 from .predicates import *
+from .attributes import *
+from .sources import *
+from .tracing import *
+from .pinning import *
+from .chain import *
+from .tenants import *
+from .adapters import ModSSLSource, NginxSource, HAProxySource, \
+     EnvoySource
+from .cache import NegativeCache
+from .clock import Validity
+from .schedule import Schedule
+from .ratelimit import x509_rate_limited, RateLimitTable
+from .groups import X509GroupAdapter
+from .permissions import X509PermissionAdapter, X509AuthorizationMetadata, \
+     setup_x509_auth
+from .usage import has_extended_key_usage, has_key_usage, has_policy
+from .serials import is_serial_in, SerialRanges, write_serial_file
+from .subjects import is_subject_in, SubjectTable, write_subject_table
+from .distributed import DecisionCache, LocalBackend, MemcachedBackend, \
+     LoopbackMemcachedServer
+from .expiry import ExpiryHeaderMiddleware, expiry_headers
 
 
-__all__ = ['is_issuer', 'is_subject']
+__all__ = ['is_issuer', 'is_subject', 'is_client', 'any_of', 'all_of',
+           'exactly', 'none_of', 'X509AttributePredicate',
+           'AttributeDirectory', 'SQLiteAttributeBackend', 'EnvironSource',
+           'HeaderSource', 'Tracer', 'RingBufferSink', 'JSONLinesSink',
+           'is_pinned', 'PinSet', 'write_pin_file', 'NegativeCache',
+           'is_signed_by', 'ModSSLSource', 'NginxSource', 'HAProxySource',
+           'EnvoySource', 'Validity', 'ExpiryHeaderMiddleware',
+           'expiry_headers', 'TenantIndex', 'in_tenant', 'Schedule',
+           'x509_rate_limited', 'RateLimitTable', 'X509GroupAdapter',
+           'X509PermissionAdapter', 'has_extended_key_usage', 'has_key_usage',
+           'has_policy', 'is_serial_in', 'SerialRanges', 'write_serial_file',
+           'DecisionCache', 'LocalBackend', 'MemcachedBackend',
+           'LoopbackMemcachedServer', 'is_subject_in', 'SubjectTable',
+           'write_subject_table', 'X509AuthorizationMetadata',
+           'setup_x509_auth']
 
 
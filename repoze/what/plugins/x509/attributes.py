@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+This module contains the predicate that authorizes according to attributes
+of the client certificate subject that are stored in a local directory (for
+example a team, a clearance or a tenant), and the directory backends.
+"""
+from contextlib import contextmanager
+from Queue import Queue, Empty, Full
+import re
+import sqlite3
+
+from .cache import TTLCache
+from .predicates import X509Predicate, PREDICATE_OPTIONS
+
+
+__all__ = ['X509AttributePredicate', 'AttributeDirectory', 'AttributeBackend',
+           'SQLiteAttributeBackend']
+
+
+# The environ key where the attributes resolved during a request are kept so
+# every predicate evaluated within such request can reuse them.
+ENVIRON_ATTRIBUTES_KEY = 'repoze.what.x509.attributes'
+
+_IDENTIFIER_REGEX = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Sentinel for the subjects that are not present in the directory.
+_NOT_FOUND = object()
+
+
+class AttributeBackend(object):
+    """
+    Represents a storage of the attributes of the certificate subjects. The
+    attributes are returned as dictionaries where the keys are the attribute
+    names and the values are lists (multiple values for such name).
+
+    Users must use a subclass or inherit from it.
+    """
+
+    def lookup_many(self, subjects):
+        """
+        Gets the attributes of several subjects at once.
+
+        :param subjects: The distinguished names of the subjects.
+
+        :return: A dictionary keyed by subject. Subjects that are not present
+            in the directory are not included.
+        """
+        raise NotImplementedError()
+
+    def load_all(self):
+        """
+        Gets the attributes of every subject known by the backend.
+
+        :return: A dictionary keyed by subject.
+        """
+        raise NotImplementedError()
+
+
+class SQLiteAttributeBackend(AttributeBackend):
+    """
+    An attribute backend stored in a SQLite table that has (at least) three
+    columns: the subject distinguished name, the attribute name and the
+    attribute value. A subject has one row per attribute value.
+    """
+
+    # SQLite has a limit on the number of parameters of a statement.
+    CHUNK_SIZE = 500
+
+    def __init__(self, database, table='x509_attributes',
+                 subject_column='subject', name_column='name',
+                 value_column='value', pool_size=5, timeout=5.0):
+        """
+        :param database: The path of the SQLite database.
+        :param table: The name of the table with the attributes.
+        :param subject_column: The column with the subject distinguished name.
+        :param name_column: The column with the attribute name.
+        :param value_column: The column with the attribute value.
+        :param pool_size: The maximum number of open connections.
+        :param timeout: The number of seconds to wait for a connection of the
+            pool, and for the database locks.
+
+        :raise ValueError: When a table or column name is not a valid
+            identifier, or when the pool size is not positive.
+        """
+        for identifier in (table, subject_column, name_column, value_column):
+            if not _IDENTIFIER_REGEX.match(identifier):
+                raise ValueError('Invalid SQL identifier: %r' % identifier)
+        if pool_size <= 0:
+            raise ValueError('The pool size must be positive')
+
+        self.database = database
+        self.timeout = timeout
+        self._pool = Queue(pool_size)
+        for n in range(pool_size):
+            # Connections are opened lazily.
+            self._pool.put(None)
+
+        # The statements are always the same text, so the statement cache of
+        # each connection keeps them prepared.
+        select = 'SELECT %s, %s, %s FROM %s' % (subject_column, name_column,
+                                                 value_column, table)
+        self._select_all = select
+        self._select_in = [None] + [
+            '%s WHERE %s IN (%s)' % (select, subject_column,
+                                     ', '.join(['?'] * n))
+            for n in range(1, self.CHUNK_SIZE + 1)
+        ]
+
+    def lookup_many(self, subjects):
+        subjects = list(subjects)
+        result = {}
+        with self.connection() as conn:
+            for i in range(0, len(subjects), self.CHUNK_SIZE):
+                chunk = subjects[i:i + self.CHUNK_SIZE]
+                cursor = conn.execute(self._select_in[len(chunk)], chunk)
+                _collect(cursor, result)
+        return result
+
+    def load_all(self):
+        result = {}
+        with self.connection() as conn:
+            _collect(conn.execute(self._select_all), result)
+        return result
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection from the pool, and returns it when done.
+
+        :raise RuntimeError: When no connection is available after waiting
+            ``timeout`` seconds.
+        """
+        try:
+            conn = self._pool.get(timeout=self.timeout)
+        except Empty:
+            raise RuntimeError('No SQLite connection available')
+
+        try:
+            if conn is None:
+                conn = sqlite3.connect(self.database, timeout=self.timeout,
+                                       check_same_thread=False,
+                                       cached_statements=self.CHUNK_SIZE + 1)
+            yield conn
+        except sqlite3.Error:
+            # Do not return a connection that may be broken.
+            if conn is not None:
+                conn.close()
+            conn = None
+            raise
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except Full:
+                pass
+
+
+def _collect(rows, result):
+    for subject, name, value in rows:
+        attributes = result.get(subject)
+        if attributes is None:
+            attributes = result[subject] = {}
+        attributes.setdefault(name, []).append(value)
+
+
+class AttributeDirectory(object):
+    """
+    Resolves the attributes of certificate subjects through a backend, keeping
+    a per process cache so that the backend is not queried on every request.
+    Subjects that are not present in the backend are cached too (negative
+    caching).
+    """
+
+    def __init__(self, backend, ttl=300, negative_ttl=60, max_size=100000):
+        """
+        :param backend: The :py:class:`AttributeBackend` to query.
+        :param ttl: The number of seconds the attributes of a subject are
+            cached.
+        :param negative_ttl: The number of seconds that a subject that is not
+            in the backend is cached as such.
+        :param max_size: The maximum number of subjects that will be cached.
+        """
+        self.backend = backend
+        self.negative_ttl = negative_ttl
+        self.cache = TTLCache(ttl=ttl, max_size=max_size)
+
+    def warm_up(self):
+        """
+        Preloads the attributes of every subject known by the backend with a
+        single query.
+
+        :return: The number of subjects that were loaded.
+        """
+        attributes = self.backend.load_all()
+        self.cache.set_many(attributes)
+        return len(attributes)
+
+    def attributes_for(self, subject):
+        """
+        Gets the attributes of a subject.
+
+        :param subject: The distinguished name of the subject.
+
+        :return: The attributes dictionary, or ``None`` if the subject is not in
+            the directory.
+        """
+        attributes = self.cache.get(subject)
+        if attributes is None:
+            attributes = self.backend.lookup_many([subject]).get(subject)
+            if attributes is None:
+                self.cache.set(subject, _NOT_FOUND, self.negative_ttl)
+            else:
+                self.cache.set(subject, attributes)
+        elif attributes is _NOT_FOUND:
+            attributes = None
+        return attributes
+
+
+class X509AttributePredicate(X509Predicate):
+    """
+    Represents a predicate that evaluates the attributes of the client
+    certificate subject, as stored in an :py:class:`AttributeDirectory`.
+    """
+
+    SUBJECT_KEY_DN = 'SSL_CLIENT_S_DN'
+
+    message = 'Invalid SSL client attributes.'
+
+    def __init__(self, directory, subject_key=None, **kwargs):
+        """
+        :param directory: The :py:class:`AttributeDirectory` that resolves the
+            attributes of the subject.
+        :param subject_key: The WSGI environment key of the subject
+            distinguished name. By default it is ``SSL_CLIENT_S_DN``.
+        :param kwargs: The attributes to check. The name of the key is the
+            attribute name and the value is what is going to be checked
+            against; a tuple or a list means that all of its values must be
+            present.
+
+        :raise ValueError: When you don't specify at least one attribute.
+        """
+        options = {}
+        for option in PREDICATE_OPTIONS:
+            if option in kwargs:
+                options[option] = kwargs.pop(option)
+        if len(kwargs) == 0:
+            raise ValueError('At least one attribute must be specified')
+
+        super(X509AttributePredicate, self).__init__(**options)
+        self.directory = directory
+        self.subject_key = subject_key or self.SUBJECT_KEY_DN
+        self.log = options.get('log')
+        self.attribute_params = kwargs.items()
+
+    def _certificate_identity(self, environ):
+        subject = self.source.get(environ, self.subject_key)
+        if subject is None:
+            return None
+        return self._validity_identity(environ) + (subject,)
+
+    def evaluate(self, environ, credentials):
+        """
+        Evaluates the attributes of the subject of the client certificate.
+
+        :param environ: The WSGI environment.
+        :param credentials: The user credentials. This parameter is not used.
+
+        :raise NotAuthorizedError: When the evaluation fails.
+        """
+        super(X509AttributePredicate, self).evaluate(environ, credentials)
+
+        subject = self.source.get(environ, self.subject_key)
+        if subject is None:
+            self.unmet()
+
+        # Every predicate evaluated in the same request with the same
+        # directory and source shares the resolution.
+        resolved = environ.setdefault(ENVIRON_ATTRIBUTES_KEY, {})
+        source = self.source
+        key = (self.directory, source.__class__, source._config, subject)
+        try:
+            attributes = resolved[key]
+        except KeyError:
+            try:
+                attributes = self.directory.attributes_for(subject)
+            except Exception, error:
+                self.log and self.log.error(
+                    'Cannot resolve attributes: %s' % error
+                )
+                self.unmet()
+            resolved[key] = attributes
+
+        if attributes is None:
+            self.unmet()
+
+        for name, value in self.attribute_params:
+            values = attributes.get(name, ())
+            if isinstance(value, list) or isinstance(value, tuple):
+                for v in value:
+                    if v not in values:
+                        self.unmet()
+            elif value not in values:
+                self.unmet()
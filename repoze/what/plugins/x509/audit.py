@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+This module contains the ``x509-audit`` command, which replays access logs
+(or JSON lines with the certificate variables) against a set of
+:py:class:`is_subject` and :py:class:`is_issuer` rules, and reports how many
+records each rule allows and which identities it denies.
+
+The validity of the certificates is checked at the time of every record,
+as the requests were authorized then, not when the log is audited.
+
+The rules file is a JSON object whose keys are the rule names, and whose
+values have the name of the predicate and its arguments::
+
+    {
+        "operations": {"predicate": "is_subject",
+                       "organizational_unit": "Operations"},
+        "our-ca": {"predicate": "is_issuer", "organization": "Example"}
+    }
+"""
+from collections import Counter, deque
+from dateutil.parser import parse as date_parse
+from dateutil.tz import tzutc
+from heapq import heapify, heappop, heappush, nlargest
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+from optparse import OptionParser
+from repoze.who.plugins.x509.utils import VERIFY_KEY
+import calendar
+import json
+import re
+import sys
+
+from .clock import CoarseClock
+from .predicates import is_subject, is_issuer
+
+
+__all__ = ['main', 'load_rules', 'audit']
+
+
+PREDICATES = {
+    'is_subject': is_subject,
+    'is_issuer': is_issuer,
+}
+
+# Identities are reported by their subject distinguished name.
+IDENTITY_KEY = 'SSL_CLIENT_S_DN'
+
+# The key (or named group) of the time of every record.
+TIME_KEY = 'time'
+
+# The time of the access logs of Apache and nginx, e.g.
+# 10/Oct/2000:13:55:36 -0700.
+_CLF_TIME_REGEX = re.compile(r'^(\d{1,2}/\w{3}/\d{4}):(\d{2}:\d{2}:\d{2})')
+
+_TZ_UTC = tzutc()
+
+_rules = None
+_time_key = TIME_KEY
+# The validity keys of every rule.
+_validity_keys = ()
+
+
+def load_rules(rules):
+    """
+    Constructs the predicates of the rules.
+
+    :param rules: The dictionary of rules, as read from the rules file.
+
+    :return: A list of tuples with the rule name and its predicate.
+
+    :raise ValueError: When a rule is invalid.
+    """
+    predicates = []
+    for name, rule in sorted(rules.iteritems()):
+        arguments = dict([(str(k), v) for k, v in rule.iteritems()])
+        predicate = PREDICATES.get(arguments.pop('predicate', None))
+        if predicate is None:
+            raise ValueError('Rule %s: unknown predicate' % name)
+        for key, value in arguments.items():
+            if isinstance(value, unicode):
+                arguments[key] = value.encode('utf-8')
+            elif isinstance(value, list):
+                arguments[key] = tuple([v.encode('utf-8') for v in value])
+        predicates.append((name, predicate(**arguments)))
+    return predicates
+
+
+def _parse_jsonl(line):
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError('Line is not a JSON object')
+    return dict([(str(k), v.encode('utf-8') if isinstance(v, unicode) else v)
+                 for k, v in record.iteritems()])
+
+
+def _make_log_parser(pattern):
+    regex = re.compile(pattern)
+
+    def parse(line):
+        match = regex.search(line)
+        if match is None:
+            raise ValueError('Line does not match the pattern')
+        return dict([(k, v) for k, v in match.groupdict().iteritems()
+                     if v is not None and v != '-'])
+    return parse
+
+
+def _parse_time(value):
+    # The time of a record in seconds since the epoch: a number, or a date
+    # (in UTC if it has no time zone).
+    if isinstance(value, (int, long, float)):
+        return int(value)
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    try:
+        date = date_parse(_CLF_TIME_REGEX.sub(r'\1 \2', value.strip('[]')))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('Invalid time: %r' % value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=_TZ_UTC)
+    return calendar.timegm(date.utctimetuple())
+
+
+def _init_worker(rules, pattern, time_key=TIME_KEY):
+    global _rules, _parse, _time_key, _validity_keys
+    _rules = load_rules(rules)
+    _parse = _parse_jsonl if pattern is None else _make_log_parser(pattern)
+    _time_key = time_key
+    keys = set()
+    for name, predicate in _rules:
+        # Validity is checked by the clock of the record.
+        predicate.strict_validity = False
+        keys.update([predicate.validity_start_key,
+                     predicate.validity_end_key])
+    _validity_keys = tuple(keys)
+
+
+def _evaluate_chunk(lines):
+    # Returns the number of records, the invalid ones, and for every rule the
+    # number of hits and the denied identities.
+    records = invalid = 0
+    hits = Counter()
+    denied = dict([(name, Counter()) for name, predicate in _rules])
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            environ = _parse(line)
+            timestamp = environ.pop(_time_key, None)
+            if timestamp is not None:
+                timestamp = _parse_time(timestamp)
+        except ValueError:
+            invalid += 1
+            continue
+        records += 1
+        # The logged requests went through the TLS handshake.
+        environ.setdefault(VERIFY_KEY, 'SUCCESS')
+        if timestamp is None:
+            # It is unknown whether the certificate was valid then.
+            for key in _validity_keys:
+                environ.pop(key, None)
+        else:
+            clock = CoarseClock(timer=lambda: timestamp)
+            for name, predicate in _rules:
+                predicate.clock = clock
+        for name, predicate in _rules:
+            if predicate.is_met(environ):
+                hits[name] += 1
+            else:
+                denied[name][environ.get(IDENTITY_KEY, '-')] += 1
+    return records, invalid, hits, denied
+
+
+class _TopCounter(object):
+    # Counts the most frequent keys keeping at most `capacity` of them, with
+    # the Space-Saving algorithm: a new key replaces the least frequent one
+    # and takes over its count, so the counts of the keys that were replaced
+    # are upper bounds, and the keys more frequent than 1 / capacity of the
+    # total are always kept.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        # The counts by key, including outdated ones, which are skipped.
+        self._heap = []
+
+    def update(self, counts):
+        for key, count in counts.iteritems():
+            self.add(key, count)
+
+    def add(self, key, count=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+        elif len(counts) < self.capacity:
+            counts[key] = count
+        elif self.capacity > 0:
+            counts[key] = counts.pop(self._least()) + count
+        else:
+            return
+        heap = self._heap
+        heappush(heap, (counts[key], key))
+        if len(heap) > 4 * self.capacity:
+            heap[:] = [(c, k) for k, c in counts.iteritems()]
+            heapify(heap)
+
+    def most_common(self, n):
+        return nlargest(n, self.counts.iteritems(), key=lambda item: item[1])
+
+    def _least(self):
+        heap = self._heap
+        counts = self.counts
+        while True:
+            count, key = heappop(heap)
+            if counts.get(key) == count:
+                return key
+
+
+def _chunks(lines, size):
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def audit(lines, rules, pattern=None, processes=None, chunk_size=1000,
+          max_identities=10000, time_key=TIME_KEY):
+    """
+    Evaluates every record against every rule. The records are read and
+    distributed among the processes in chunks, with a bounded number of
+    chunks in flight, so the memory does not depend on the size of the
+    input.
+
+    :param lines: An iterable of the lines of the input.
+    :param rules: The dictionary of rules.
+    :param pattern: A regular expression whose named groups are the WSGI
+        environment keys of each line of an access log (e.g.
+        ``(?P<SSL_CLIENT_S_DN>...)``). If it is not specified, every line is a
+        JSON object with such keys.
+    :param processes: The number of processes. By default it is the number of
+        CPUs. With one process the records are evaluated in this process.
+    :param chunk_size: The number of lines of each chunk.
+    :param max_identities: The maximum number of denied identities kept and
+        reported per rule, the most denied first. When more identities are
+        denied, the least denied ones are replaced and the counts of the
+        identities that replaced them may be overestimated.
+    :param time_key: The key (or named group of the pattern) of the time of
+        every record, when its validity range is checked: either seconds
+        since the epoch, or a date (e.g. ``2019-05-01T10:00:00Z`` or
+        ``01/May/2019:10:00:00 +0000``). The validity range of the records
+        without it is not checked, and the records with an invalid time are
+        invalid.
+
+    :return: The report as a dictionary.
+    """
+    # Fail early if the rules are invalid.
+    load_rules(rules)
+    processes = processes or cpu_count()
+
+    records = invalid = 0
+    hits = Counter()
+    denied = Counter()
+    identities = dict([(name, _TopCounter(max_identities)) for name in rules])
+
+    def merge(result):
+        chunk_records, chunk_invalid, chunk_hits, chunk_denied = result
+        hits.update(chunk_hits)
+        for name, chunk_identities in chunk_denied.iteritems():
+            denied[name] += sum(chunk_identities.itervalues())
+            identities[name].update(chunk_identities)
+        return chunk_records, chunk_invalid
+
+    if processes == 1:
+        _init_worker(rules, pattern, time_key)
+        for chunk in _chunks(lines, chunk_size):
+            chunk_records, chunk_invalid = merge(_evaluate_chunk(chunk))
+            records += chunk_records
+            invalid += chunk_invalid
+    else:
+        pool = Pool(processes, _init_worker, (rules, pattern, time_key))
+        try:
+            pending = deque()
+            for chunk in _chunks(lines, chunk_size):
+                if len(pending) >= processes * 2:
+                    result = pending.popleft().get()
+                    chunk_records, chunk_invalid = merge(result)
+                    records += chunk_records
+                    invalid += chunk_invalid
+                pending.append(pool.apply_async(_evaluate_chunk, (chunk,)))
+            while pending:
+                chunk_records, chunk_invalid = merge(pending.popleft().get())
+                records += chunk_records
+                invalid += chunk_invalid
+        finally:
+            pool.terminate()
+
+    report = {'records': records, 'invalid': invalid, 'rules': {}}
+    for name in rules:
+        report['rules'][name] = {
+            'hits': hits[name],
+            'denied': denied[name],
+            'denied_identities': dict(
+                identities[name].most_common(max_identities)
+            )
+        }
+    return report
+
+
+def main(argv=None):
+    """
+    Entry point of the ``x509-audit`` command.
+    """
+    parser = OptionParser(usage='%prog [options] RULES_FILE [INPUT_FILE]')
+    parser.add_option('-p', '--pattern', dest='pattern',
+                      help=('regular expression with named groups to parse '
+                            'an access log (the input is JSON lines by '
+                            'default)'))
+    parser.add_option('-j', '--processes', dest='processes', type='int',
+                      help='number of processes (default: number of CPUs)')
+    parser.add_option('-c', '--chunk-size', dest='chunk_size', type='int',
+                      default=1000, help='lines per chunk (default: 1000)')
+    parser.add_option('-m', '--max-identities', dest='max_identities',
+                      type='int', default=10000,
+                      help='denied identities reported per rule')
+    parser.add_option('-t', '--time-key', dest='time_key', default=TIME_KEY,
+                      help=('key (or named group) of the time of every '
+                            'record, when its validity is checked '
+                            '(default: %s)' % TIME_KEY))
+    options, args = parser.parse_args(argv)
+    if len(args) not in (1, 2):
+        parser.error('Invalid number of arguments')
+
+    try:
+        with open(args[0]) as f:
+            rules = json.load(f)
+        load_rules(rules)
+    except (IOError, ValueError, TypeError), error:
+        parser.error('Invalid rules file: %s' % error)
+
+    lines = sys.stdin if len(args) == 1 else open(args[1])
+    try:
+        report = audit(lines, rules, options.pattern, options.processes,
+                       options.chunk_size, options.max_identities,
+                       options.time_key)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    return 0
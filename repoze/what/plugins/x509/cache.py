@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+This module contains the in-process caches used by the predicates to avoid
+doing the same (expensive) work on every request.
+"""
+from collections import OrderedDict
+from threading import Lock
+import time
+
+from repoze.what.predicates import NotAuthorizedError
+
+
+__all__ = ['TTLCache', 'NegativeCache']
+
+
+class TTLCache(object):
+    """
+    A bounded and thread safe dictionary whose entries expire after a given
+    time to live. When the cache is full the oldest entry is discarded.
+    """
+
+    def __init__(self, ttl=300, max_size=10000, timer=None):
+        """
+        :param ttl: The default time to live, in seconds, of every entry.
+        :param max_size: The maximum number of entries that the cache will
+            hold.
+        :param timer: A callable that returns the current time in seconds. By
+            default it is :py:func:`time.time`.
+
+        :raise ValueError: When ``max_size`` is not a positive number.
+        """
+        if max_size <= 0:
+            raise ValueError('The size of the cache must be positive')
+        self.ttl = ttl
+        self.max_size = max_size
+        self.timer = timer or time.time
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """
+        Gets the value of an entry that has not expired yet.
+
+        :param key: The key of the entry.
+        :param default: The value returned if there is no such entry.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < self.timer():
+            with self._lock:
+                # Another thread may have refreshed it in the meantime.
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores an entry in the cache.
+
+        :param key: The key of the entry.
+        :param value: The value of the entry.
+        :param ttl: The time to live of this entry. If it is not specified the
+            default time to live of the cache is used.
+        """
+        expires = self.timer() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, value, expires)
+
+    def set_many(self, mapping, ttl=None):
+        """
+        Stores several entries in the cache sharing the same time to live.
+
+        :param mapping: A dictionary with the entries to store.
+        :param ttl: The time to live of the entries.
+        """
+        expires = self.timer() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            for key, value in mapping.iteritems():
+                self._store(key, value, expires)
+
+    def delete(self, key):
+        """
+        Removes an entry from the cache, if present.
+
+        :param key: The key of the entry.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        marker = self._entries
+        return self.get(key, marker) is not marker
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _store(self, key, value, expires):
+        # Must be called with the lock acquired.
+        entries = self._entries
+        if key in entries:
+            del entries[key]
+        elif len(entries) >= self.max_size:
+            entries.popitem(last=False)
+        entries[key] = (expires, value)
+
+
+class NegativeCache(object):
+    """
+    Remembers, for a short time, which certificates were rejected by which
+    predicates, so that a client that keeps presenting a certificate that will
+    never be authorized is denied with a single lookup. The rejections are
+    logged at most once per interval, with the number of requests that were
+    denied from the cache.
+
+    A predicate uses it when it is constructed with the ``negative_cache``
+    argument. Only the predicates that can tell the identity of the
+    certificate they evaluate are cached.
+    """
+
+    def __init__(self, ttl=5, max_size=10000, log=None, log_interval=60,
+                 timer=None):
+        """
+        :param ttl: The number of seconds a rejection is remembered.
+        :param max_size: The maximum number of rejections remembered.
+        :param log: The logger where the rejections are reported.
+        :param log_interval: The minimum number of seconds between two
+            reports.
+        :param timer: A callable that returns the current time in seconds. By
+            default it is :py:func:`time.time`.
+        """
+        self.timer = timer or time.time
+        self.cache = TTLCache(ttl=ttl, max_size=max_size, timer=self.timer)
+        self.log = log
+        self.log_interval = log_interval
+        self.evaluated = 0
+        self.saved = 0
+        self.stored = 0
+        self._suppressed = 0
+        self._last_log = None
+
+    def install(self, predicate):
+        """
+        Makes a predicate use this cache.
+
+        :param predicate: The predicate.
+        """
+        evaluate = predicate.evaluate
+        identity = predicate._certificate_identity
+
+        def cached_evaluate(environ, credentials):
+            key = identity(environ)
+            if key is not None:
+                key = (predicate, key)
+                if key in self.cache:
+                    self.saved += 1
+                    self._report(predicate)
+                    predicate.unmet()
+
+            self.evaluated += 1
+            try:
+                evaluate(environ, credentials)
+            except NotAuthorizedError:
+                if key is not None:
+                    self.cache.set(key, True, self._ttl(predicate, environ))
+                    self.stored += 1
+                raise
+
+        predicate.evaluate = cached_evaluate
+
+    def stats(self):
+        """
+        Gets the counters of the cache: the evaluations that were done, the
+        ones that were saved by the cache, and the rejections stored.
+        """
+        return {'evaluated': self.evaluated, 'saved': self.saved,
+                'stored': self.stored, 'size': len(self.cache)}
+
+    def _ttl(self, predicate, environ):
+        # A certificate that is not valid yet must not be rejected once it is.
+        validity = predicate.validity(environ)
+        if validity is None or validity.now >= validity.not_before:
+            return None
+        return validity.ttl(self.cache.ttl)
+
+    def _report(self, predicate):
+        if self.log is None:
+            return
+        self._suppressed += 1
+        now = self.timer()
+        if self._last_log is None or now - self._last_log >= self.log_interval:
+            self.log.warn(
+                '%d requests denied by previously rejected certificates '
+                '(latest by %s)' % (self._suppressed,
+                                    predicate.__class__.__name__)
+            )
+            self._suppressed = 0
+            self._last_log = now
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the predicate that checks the chain of certificates
+presented by the client, e.g. as exported by ``mod_ssl`` in
+``SSL_CLIENT_CERT_CHAIN_0``, ``SSL_CLIENT_CERT_CHAIN_1`` and so on.
+"""
+
+from .cache import TTLCache
+from .pinning import parse_fingerprint
+from .predicates import X509Predicate
+
+
+__all__ = ['is_signed_by']
+
+
+CHAIN_KEY = 'SSL_CLIENT_CERT_CHAIN'
+ISSUER_KEY = 'SSL_CLIENT_I_DN'
+
+# The subject and issuer distinguished names of the certificates of the
+# chains, by their SHA-256 fingerprint. The same few intermediate certificates
+# are presented by every client, so they are decoded only once per process.
+_CHAIN_CACHE = TTLCache(ttl=24 * 3600, max_size=1000)
+
+# The names cached for a certificate that cannot be decoded.
+_INVALID = (None, None)
+
+
+class is_signed_by(X509Predicate):
+    """
+    Represents a predicate that checks that the chain presented by the client
+    leads to a trusted intermediate or root certificate authority, identified
+    by its subject distinguished name or by its SHA-256 fingerprint.
+
+    The chain is followed from the issuer of the client certificate, through
+    the certificates of the chain whose subject is the issuer of the previous
+    one, so a trusted certificate that is merely appended to the chain is not
+    taken into account.
+
+    The chain itself must be verified by the web server; see
+    :py:class:`X509Predicate`.
+    """
+
+    message = 'Invalid SSL client certificate chain.'
+
+    def __init__(self, anchors=(), fingerprints=(), chain_key=None,
+                 issuer_key=None, cache=None, **kwargs):
+        """
+        :param anchors: The subject distinguished names of the trusted
+            certificates, in the OpenSSL format (e.g.
+            ``/C=US/O=Company/CN=Company CA``).
+        :param fingerprints: The SHA-256 fingerprints of the trusted
+            certificates (see :py:func:`parse_fingerprint`).
+        :param chain_key: The prefix of the WSGI environment keys of the PEM
+            encoded certificates of the chain, which are suffixed by their
+            index. By default it is ``SSL_CLIENT_CERT_CHAIN``.
+        :param issuer_key: The WSGI environment key of the issuer
+            distinguished name of the client certificate, where the chain
+            starts. By default it is ``SSL_CLIENT_I_DN``.
+        :param cache: The :py:class:`TTLCache` where the names of the
+            certificates of the chains are kept by their fingerprint. By
+            default it is shared by every predicate of the process.
+
+        :raise ValueError: When there are neither anchors nor fingerprints, or
+            when any of the fingerprints is invalid.
+        """
+        super(is_signed_by, self).__init__(**kwargs)
+        self.anchors = frozenset(anchors)
+        self.fingerprints = frozenset([parse_fingerprint(fingerprint)
+                                       for fingerprint in fingerprints])
+        if not self.anchors and not self.fingerprints:
+            raise ValueError('At least one anchor or fingerprint must be '
+                             'specified')
+        self.chain_key = chain_key or CHAIN_KEY
+        self.issuer_key = issuer_key or ISSUER_KEY
+        self.cache = _CHAIN_CACHE if cache is None else cache
+
+    def evaluate(self, environ, credentials):
+        """
+        Follows the chain of certificates from the issuer of the client
+        certificate until a trusted one is found.
+
+        :param environ: The WSGI environment.
+        :param credentials: The user credentials. This parameter is not used.
+
+        :raise NotAuthorizedError: When the evaluation fails.
+        """
+        super(is_signed_by, self).evaluate(environ, credentials)
+        issuer = self.source.get(environ, self.issuer_key)
+        keys = list(self._chain_keys(environ))
+        names = {}
+        # Every certificate of the chain is used at most once, so the walk
+        # ends even if the chain has a loop.
+        while issuer is not None and keys:
+            for key in keys:
+                if key not in names:
+                    names[key] = self._names(environ, key)
+                fingerprint, subject, next_issuer = names[key]
+                if subject == issuer:
+                    break
+            else:
+                break
+            keys.remove(key)
+            if fingerprint in self.fingerprints or subject in self.anchors:
+                return
+            issuer = next_issuer if next_issuer != subject else None
+        self.unmet()
+
+    def _certificate_identity(self, environ):
+        source = self.source
+        return self._validity_identity(environ) + (
+            source.get(environ, self.issuer_key),
+        ) + tuple([
+            source.get(environ, key) for key in self._chain_keys(environ)
+        ])
+
+    def _chain_keys(self, environ):
+        source = self.source
+        n = 0
+        while True:
+            key = '%s_%d' % (self.chain_key, n)
+            if source.get(environ, key) is None:
+                return
+            yield key
+            n += 1
+
+    def _names(self, environ, key):
+        # The fingerprint, the subject and the issuer of a certificate of the
+        # chain; the names are decoded only once per process.
+        try:
+            fingerprint = self.source.get_fingerprint(environ, key)
+        except ValueError:
+            return (None,) + _INVALID
+        names = self.cache.get(fingerprint)
+        if names is None:
+            try:
+                certificate = self.source.get_certificate(environ, key)
+                names = (certificate.subject_dn, certificate.issuer_dn)
+            except ValueError:
+                names = _INVALID
+            self.cache.set(fingerprint, names)
+        return (fingerprint,) + names
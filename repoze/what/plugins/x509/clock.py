@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+This module contains the coarse clock shared by the predicates that depend on
+the current time, and the conversion of the validity range of a certificate
+into integer timestamps.
+"""
+from dateutil.parser import parse as date_parse
+from dateutil.tz import tzutc
+from threading import Lock
+import calendar
+import time
+
+
+__all__ = ['CoarseClock', 'Validity', 'get_clock', 'validity_window',
+           'DEFAULT_RESOLUTION']
+
+
+# In milliseconds.
+DEFAULT_RESOLUTION = 1000
+
+# The number of different validity ranges whose timestamps are kept.
+VALIDITY_CACHE_SIZE = 10000
+
+_TZ_UTC = tzutc()
+
+_clocks = {}
+_clocks_lock = Lock()
+
+_validity_cache = {}
+
+
+class CoarseClock(object):
+    """
+    A clock that tells the current time as an integer number of seconds since
+    the epoch, that is only refreshed when its resolution has elapsed. It is
+    meant to be shared by every predicate of the process.
+    """
+
+    def __init__(self, resolution=DEFAULT_RESOLUTION, timer=None):
+        """
+        :param resolution: The number of milliseconds between refreshes.
+        :param timer: A callable that returns the current time in seconds. By
+            default it is :py:func:`time.time`.
+
+        :raise ValueError: When the resolution is negative.
+        """
+        if resolution < 0:
+            raise ValueError('The resolution of the clock cannot be negative')
+        self.resolution = resolution / 1000.0
+        self.timer = timer or time.time
+        self._now = 0
+        self._next_tick = 0.0
+
+    def now(self):
+        """
+        Gets the current time in seconds since the epoch, as of the last tick.
+        """
+        current = self.timer()
+        if current >= self._next_tick:
+            # A race between threads only means that both will tick.
+            self._now = int(current)
+            self._next_tick = current + self.resolution
+        return self._now
+
+
+def get_clock(resolution=DEFAULT_RESOLUTION):
+    """
+    Gets the clock of the process that has the given resolution.
+
+    :param resolution: The resolution of the clock in milliseconds.
+    """
+    clock = _clocks.get(resolution)
+    if clock is None:
+        with _clocks_lock:
+            clock = _clocks.setdefault(resolution, CoarseClock(resolution))
+    return clock
+
+
+class Validity(object):
+    """
+    The validity range of a client certificate as of a given time, so caches
+    know for how long a decision about such certificate can be trusted.
+
+    :ivar not_before: The start of the range, in seconds since the epoch.
+    :ivar not_after: The end of the range, in seconds since the epoch.
+    :ivar now: The time of the evaluation, in seconds since the epoch.
+    """
+
+    __slots__ = ('not_before', 'not_after', 'now')
+
+    def __init__(self, not_before, not_after, now):
+        self.not_before = not_before
+        self.not_after = not_after
+        self.now = now
+
+    @property
+    def elapsed(self):
+        """
+        The seconds since the start of the range (negative if the certificate
+        is not valid yet).
+        """
+        return self.now - self.not_before
+
+    @property
+    def remaining(self):
+        """
+        The seconds until the end of the range (negative if the certificate
+        expired).
+        """
+        return self.not_after - self.now
+
+    @property
+    def is_valid(self):
+        """
+        Whether the certificate is valid at the time of the evaluation.
+        """
+        return self.not_before <= self.now <= self.not_after
+
+    def ttl(self, maximum=None):
+        """
+        Gets for how many seconds a decision that depends on the validity of
+        the certificate can be cached: until the certificate expires, or
+        until it becomes valid if it is not yet.
+
+        :param maximum: The maximum time to live.
+        """
+        if self.now < self.not_before:
+            ttl = self.not_before - self.now
+        else:
+            ttl = max(self.remaining, 0)
+        return ttl if maximum is None else min(ttl, maximum)
+
+    def __repr__(self):
+        return 'Validity(not_before=%d, not_after=%d, now=%d)' % (
+            self.not_before, self.not_after, self.now
+        )
+
+
+def validity_window(validity_start, validity_end):
+    """
+    Converts the encoded datetimes of a validity range into seconds since the
+    epoch. The conversion is cached, as the same certificates are presented
+    over and over.
+
+    :param validity_start: The encoded datetime of the start of the range.
+    :param validity_end: The encoded datetime of the end of the range.
+
+    :return: A tuple with the start and the end of the range, or ``None`` if
+        any of the datetimes is invalid or its timezone is not UTC (or GMT).
+    """
+    key = (validity_start, validity_end)
+    try:
+        return _validity_cache[key]
+    except KeyError:
+        pass
+
+    try:
+        start = date_parse(validity_start)
+        end = date_parse(validity_end)
+    except (ValueError, TypeError, OverflowError):
+        window = None
+    else:
+        if start.tzinfo != _TZ_UTC or end.tzinfo != _TZ_UTC:
+            # Can't consider other timezones
+            window = None
+        else:
+            window = (calendar.timegm(start.utctimetuple()),
+                      calendar.timegm(end.utctimetuple()))
+
+    if len(_validity_cache) >= VALIDITY_CACHE_SIZE:
+        _validity_cache.clear()
+    _validity_cache[key] = window
+    return window
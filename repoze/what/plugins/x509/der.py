@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+This module contains a minimal reader of DER encoded X.509 certificates. It
+only decodes what the predicates need: the serial number, the validity, the
+distinguished names, the subject public key info and the extensions.
+"""
+import calendar
+
+
+__all__ = ['Certificate', 'decode_oid', 'decode_time', 'name_to_dn',
+           'ATTRIBUTE_TYPES', 'EXTENDED_KEY_USAGE_OID', 'KEY_USAGE_OID',
+           'CERTIFICATE_POLICIES_OID']
+
+
+# The names of the attribute types, as used by OpenSSL (and therefore mod_ssl)
+# in distinguished names.
+ATTRIBUTE_TYPES = {
+    '2.5.4.3': 'CN',
+    '2.5.4.4': 'SN',
+    '2.5.4.5': 'serialNumber',
+    '2.5.4.6': 'C',
+    '2.5.4.7': 'L',
+    '2.5.4.8': 'ST',
+    '2.5.4.9': 'street',
+    '2.5.4.10': 'O',
+    '2.5.4.11': 'OU',
+    '2.5.4.12': 'title',
+    '2.5.4.13': 'description',
+    '2.5.4.17': 'postalCode',
+    '2.5.4.41': 'name',
+    '2.5.4.42': 'GN',
+    '2.5.4.43': 'initials',
+    '2.5.4.44': 'generationQualifier',
+    '2.5.4.46': 'dnQualifier',
+    '2.5.4.65': 'pseudonym',
+    '1.2.840.113549.1.9.1': 'emailAddress',
+    '0.9.2342.19200300.100.1.1': 'UID',
+    '0.9.2342.19200300.100.1.25': 'DC',
+}
+
+EXTENDED_KEY_USAGE_OID = '2.5.29.37'
+KEY_USAGE_OID = '2.5.29.15'
+CERTIFICATE_POLICIES_OID = '2.5.29.32'
+
+_SEQUENCE = 0x30
+_SET = 0x31
+_INTEGER = 0x02
+_BOOLEAN = 0x01
+_OCTET_STRING = 0x04
+_OID = 0x06
+_BIT_STRING = 0x03
+_UTC_TIME = 0x17
+_GENERALIZED_TIME = 0x18
+
+_STRING_DECODERS = {
+    0x0c: lambda v: v.decode('utf-8'),     # UTF8String
+    0x13: lambda v: v.decode('ascii'),     # PrintableString
+    0x14: lambda v: v.decode('latin-1'),   # T61String
+    0x16: lambda v: v.decode('ascii'),     # IA5String
+    0x1c: lambda v: v.decode('utf-32-be'), # UniversalString
+    0x1e: lambda v: v.decode('utf-16-be'), # BMPString
+}
+
+
+def _read(data, offset, expected=None):
+    # Returns the tag, and the start and end of the value of the TLV at offset.
+    try:
+        tag = ord(data[offset])
+        length = ord(data[offset + 1])
+    except IndexError:
+        raise ValueError('Invalid DER: truncated')
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7f
+        if count == 0 or count > 4 or offset + count > len(data):
+            raise ValueError('Invalid DER: invalid length')
+        length = 0
+        for c in data[offset:offset + count]:
+            length = (length << 8) | ord(c)
+        offset += count
+    end = offset + length
+    if end > len(data):
+        raise ValueError('Invalid DER: truncated')
+    if expected is not None and tag != expected:
+        raise ValueError('Invalid DER: unexpected tag 0x%02x' % tag)
+    return tag, offset, end
+
+
+def _children(data, start, end):
+    # Yields the tag, the start and end of the value, and the start of the
+    # complete TLV of every element within the given bounds.
+    while start < end:
+        tag, value_start, value_end = _read(data, start)
+        yield tag, value_start, value_end, start
+        start = value_end
+
+
+def decode_oid(value):
+    """
+    Decodes the value of a DER encoded object identifier into its dotted
+    representation.
+
+    :param value: The encoded value (without tag and length).
+    """
+    if len(value) == 0:
+        raise ValueError('Invalid DER: empty OID')
+    first = ord(value[0])
+    arcs = [str(min(first // 40, 2)), str(first - min(first // 40, 2) * 40)]
+    n = 0
+    for c in value[1:]:
+        c = ord(c)
+        n = (n << 7) | (c & 0x7f)
+        if not c & 0x80:
+            arcs.append(str(n))
+            n = 0
+    return '.'.join(arcs)
+
+
+def decode_time(value):
+    """
+    Decodes a DER encoded UTCTime (``YYMMDDhhmmssZ``) or GeneralizedTime
+    (``YYYYMMDDhhmmssZ``) into seconds since the epoch.
+
+    :param value: The encoded value (without tag and length).
+
+    :raise ValueError: When it is not a valid time in UTC.
+    """
+    if not value.endswith('Z') or not value[:-1].isdigit():
+        raise ValueError('Invalid DER: invalid time')
+    if len(value) == 13:
+        year = int(value[:2])
+        # RFC 5280: UTCTime years from 50 belong to the 20th century.
+        year += 1900 if year >= 50 else 2000
+        value = value[2:]
+    elif len(value) == 15:
+        year = int(value[:4])
+        value = value[4:]
+    else:
+        raise ValueError('Invalid DER: invalid time')
+    month, day, hour, minute, second = [int(value[i:i + 2])
+                                        for i in range(0, 10, 2)]
+    if not (1 <= month <= 12 and 1 <= day <= 31 and hour < 24 and
+            minute < 60 and second < 61):
+        raise ValueError('Invalid DER: invalid time')
+    return calendar.timegm((year, month, day, hour, minute, second))
+
+
+def _decode_integer(value):
+    n = 0
+    for c in value:
+        n = (n << 8) | ord(c)
+    if value and ord(value[0]) & 0x80:
+        n -= 1 << (8 * len(value))
+    return n
+
+
+class Certificate(object):
+    """
+    Represents a DER encoded X.509 certificate.
+
+    :ivar der: The DER encoded certificate.
+    :ivar serial: The serial number.
+    :ivar not_before: The start of the validity, in seconds since the epoch.
+    :ivar not_after: The end of the validity, in seconds since the epoch.
+    :ivar issuer: The DER encoded issuer distinguished name.
+    :ivar subject: The DER encoded subject distinguished name.
+    :ivar spki: The DER encoded subject public key info.
+    :ivar extensions: A dictionary keyed by the OID of every extension, with
+        a tuple of its criticality and its DER encoded value.
+    """
+
+    def __init__(self, der):
+        """
+        :param der: The DER encoded certificate.
+
+        :raise ValueError: When the certificate cannot be decoded.
+        """
+        self.der = der
+        tag, start, end = _read(der, 0, _SEQUENCE)
+        tag, start, end = _read(der, start, _SEQUENCE)
+        fields = list(_children(der, start, end))
+        if fields and fields[0][0] == 0xa0:
+            # Explicit version
+            fields.pop(0)
+        if len(fields) < 6:
+            raise ValueError('Invalid certificate: incomplete')
+
+        serial, algorithm, issuer, validity, subject, spki = fields[:6]
+        if serial[0] != _INTEGER or issuer[0] != _SEQUENCE or \
+           validity[0] != _SEQUENCE or subject[0] != _SEQUENCE or \
+           spki[0] != _SEQUENCE:
+            raise ValueError('Invalid certificate: unexpected field')
+
+        self.serial = _decode_integer(der[serial[1]:serial[2]])
+        times = list(_children(der, validity[1], validity[2]))
+        if len(times) != 2 or \
+           [t for t in times if t[0] not in (_UTC_TIME, _GENERALIZED_TIME)]:
+            raise ValueError('Invalid certificate: invalid validity')
+        self.not_before, self.not_after = [decode_time(der[t[1]:t[2]])
+                                           for t in times]
+        self.issuer = self._tlv(issuer)
+        self.subject = self._tlv(subject)
+        self.spki = self._tlv(spki)
+
+        self.extensions = {}
+        for tag, start, end, header in fields[6:]:
+            if tag == 0xa3:
+                self._read_extensions(start, end)
+
+    def _tlv(self, field):
+        tag, start, end, header = field
+        return self.der[header:end]
+
+    def _read_extensions(self, start, end):
+        der = self.der
+        tag, start, end = _read(der, start, _SEQUENCE)
+        for tag, ext_start, ext_end, header in _children(der, start, end):
+            parts = list(_children(der, ext_start, ext_end))
+            if len(parts) < 2 or parts[0][0] != _OID:
+                raise ValueError('Invalid certificate: invalid extension')
+            oid = decode_oid(der[parts[0][1]:parts[0][2]])
+            critical = False
+            if parts[1][0] == _BOOLEAN:
+                critical = der[parts[1][1]:parts[1][2]] != '\x00'
+                parts.pop(1)
+            if parts[1][0] != _OCTET_STRING:
+                raise ValueError('Invalid certificate: invalid extension')
+            self.extensions[oid] = (critical, der[parts[1][1]:parts[1][2]])
+
+    _issuer_dn = None
+    _subject_dn = None
+
+    @property
+    def issuer_dn(self):
+        """
+        The issuer distinguished name in the OpenSSL format, e.g.
+        ``/C=US/O=Company/CN=Name``. It is converted only once.
+        """
+        if self._issuer_dn is None:
+            self._issuer_dn = name_to_dn(self.issuer)
+        return self._issuer_dn
+
+    @property
+    def subject_dn(self):
+        """
+        The subject distinguished name in the OpenSSL format. It is converted
+        only once.
+        """
+        if self._subject_dn is None:
+            self._subject_dn = name_to_dn(self.subject)
+        return self._subject_dn
+
+    @property
+    def extended_key_usage(self):
+        """
+        The OIDs of the extended key usage extension, or ``None`` if the
+        certificate does not have such extension.
+
+        :raise ValueError: When the extension cannot be decoded.
+        """
+        extension = self.extensions.get(EXTENDED_KEY_USAGE_OID)
+        if extension is None:
+            return None
+        value = extension[1]
+        tag, start, end = _read(value, 0, _SEQUENCE)
+        oids = []
+        for tag, oid_start, oid_end, header in _children(value, start, end):
+            if tag != _OID:
+                raise ValueError('Invalid certificate: invalid key usage')
+            oids.append(decode_oid(value[oid_start:oid_end]))
+        return tuple(oids)
+
+    @property
+    def key_usage(self):
+        """
+        The bits of the key usage extension as an integer, where the bit ``n``
+        is the named bit ``n`` (e.g. ``1 << 0`` is ``digitalSignature``), or
+        ``None`` if the certificate does not have such extension.
+
+        :raise ValueError: When the extension cannot be decoded.
+        """
+        extension = self.extensions.get(KEY_USAGE_OID)
+        if extension is None:
+            return None
+        value = extension[1]
+        tag, start, end = _read(value, 0, _BIT_STRING)
+        if start == end:
+            raise ValueError('Invalid certificate: invalid key usage')
+        bits = 0
+        # The first octet is the number of unused bits, and the named bit 0
+        # is the most significant bit of the next one.
+        for n, c in enumerate(value[start + 1:end]):
+            c = ord(c)
+            for bit in range(8):
+                if c & (0x80 >> bit):
+                    bits |= 1 << (n * 8 + bit)
+        return bits
+
+    @property
+    def policies(self):
+        """
+        The OIDs of the certificate policies extension (empty if the
+        certificate does not have such extension).
+
+        :raise ValueError: When the extension cannot be decoded.
+        """
+        extension = self.extensions.get(CERTIFICATE_POLICIES_OID)
+        if extension is None:
+            return ()
+        value = extension[1]
+        tag, start, end = _read(value, 0, _SEQUENCE)
+        oids = []
+        for tag, info_start, info_end, header in _children(value, start, end):
+            tag, oid_start, oid_end = _read(value, info_start, _OID)
+            oids.append(decode_oid(value[oid_start:oid_end]))
+        return tuple(oids)
+
+
+def name_to_dn(name):
+    """
+    Converts a DER encoded distinguished name into the OpenSSL format, e.g.
+    ``/C=US/O=Company/CN=Name``. Values are UTF-8 encoded.
+
+    :param name: The DER encoded name.
+
+    :raise ValueError: When the name cannot be decoded.
+    """
+    tag, start, end = _read(name, 0, _SEQUENCE)
+    parts = []
+    for tag, rdn_start, rdn_end, header in _children(name, start, end):
+        if tag != _SET:
+            raise ValueError('Invalid DER: invalid RDN')
+        for tag, atv_start, atv_end, header in _children(name, rdn_start,
+                                                         rdn_end):
+            atv = list(_children(name, atv_start, atv_end))
+            if len(atv) != 2 or atv[0][0] != _OID:
+                raise ValueError('Invalid DER: invalid attribute')
+            oid = decode_oid(name[atv[0][1]:atv[0][2]])
+            value_tag, value_start, value_end, header = atv[1]
+            value = name[value_start:value_end]
+            decoder = _STRING_DECODERS.get(value_tag)
+            if decoder is not None:
+                value = decoder(value).encode('utf-8')
+            parts.append('/%s=%s' % (ATTRIBUTE_TYPES.get(oid, oid), value))
+    return ''.join(parts)
@@ -0,0 +1,672 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the optional second-tier cache of the decisions of the
+predicates, shared by every node of a cluster through a backend such as
+memcached, so that a certificate is evaluated once per cluster and time to
+live instead of once per process.
+
+The cache always fails open: if the backend is slow or unavailable, the
+predicates are evaluated locally.
+"""
+from hashlib import sha1
+from Queue import Queue, LifoQueue, Empty, Full
+from thread import LockType
+from threading import Thread
+import SocketServer
+import logging
+import mmap
+import socket
+import time
+import types
+import zlib
+
+from repoze.what.predicates import NotAuthorizedError
+
+from .cache import TTLCache
+from .clock import CoarseClock
+
+
+__all__ = ['DecisionCache', 'CacheBackend', 'LocalBackend',
+           'MemcachedBackend', 'LoopbackMemcachedServer', 'BackendError',
+           'predicate_name']
+
+
+# The environ key where the decisions fetched from the backend during a
+# request are kept.
+ENVIRON_DECISIONS_KEY = 'repoze.what.x509.decisions'
+
+_MET = '1'
+_UNMET = '0'
+
+# The longest relative expiration time understood by memcached (30 days).
+MAX_EXPIRATION = 30 * 24 * 3600
+
+
+class BackendError(Exception):
+    """
+    Raised by a :py:class:`CacheBackend` when the operation failed, including
+    when it did not finish within its time budget.
+    """
+
+
+class CacheBackend(object):
+    """
+    Represents the storage of the decisions shared by the nodes. Keys are
+    strings of at most 250 printable characters, and values are strings.
+
+    Users must use a subclass or inherit from it.
+    """
+
+    def get_multi(self, keys):
+        """
+        Gets several entries at once.
+
+        :param keys: The keys of the entries.
+
+        :return: A dictionary with the entries found.
+
+        :raise BackendError: When the entries cannot be fetched.
+        """
+        raise NotImplementedError()
+
+    def set_multi(self, mapping, ttl):
+        """
+        Stores several entries at once.
+
+        :param mapping: A dictionary with the entries to store.
+        :param ttl: The time to live of the entries, in seconds.
+
+        :raise BackendError: When the entries cannot be stored.
+        """
+        raise NotImplementedError()
+
+
+class LocalBackend(CacheBackend):
+    """
+    A backend in the memory of the process, for tests and for single node
+    deployments.
+    """
+
+    def __init__(self, max_size=100000, timer=None):
+        """
+        :param max_size: The maximum number of entries.
+        :param timer: A callable that returns the current time in seconds. By
+            default it is :py:func:`time.time`.
+        """
+        self.cache = TTLCache(max_size=max_size, timer=timer)
+
+    def get_multi(self, keys):
+        result = {}
+        for key in keys:
+            value = self.cache.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set_multi(self, mapping, ttl):
+        self.cache.set_many(mapping, ttl)
+
+
+class _Connection(object):
+    # A socket with a read buffer, whose operations must finish before a
+    # deadline.
+
+    def __init__(self, address, timeout):
+        self.socket = socket.create_connection(address, timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = ''
+
+    def send(self, data, deadline):
+        self._set_timeout(deadline)
+        self.socket.sendall(data)
+
+    def readline(self, deadline):
+        while True:
+            end = self.buffer.find('\r\n')
+            if end >= 0:
+                line = self.buffer[:end]
+                self.buffer = self.buffer[end + 2:]
+                return line
+            self._recv(deadline)
+
+    def read(self, size, deadline):
+        # The data and its trailing CRLF.
+        while len(self.buffer) < size + 2:
+            self._recv(deadline)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size + 2:]
+        return data
+
+    def close(self):
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+
+    def _recv(self, deadline):
+        self._set_timeout(deadline)
+        data = self.socket.recv(65536)
+        if not data:
+            raise BackendError('Connection closed by the server')
+        self.buffer += data
+
+    def _set_timeout(self, deadline):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise BackendError('Timeout')
+        self.socket.settimeout(remaining)
+
+
+class MemcachedBackend(CacheBackend):
+    """
+    A client of the memcached text protocol. The keys are distributed among
+    the servers by their CRC-32, the requests to every server are pipelined,
+    and the connections are pooled.
+    """
+
+    def __init__(self, servers=(('127.0.0.1', 11211),), timeout=0.05,
+                 pool_size=8):
+        """
+        :param servers: The ``(host, port)`` addresses of the servers.
+        :param timeout: The number of seconds that every operation may take,
+            including connecting. When it is exceeded the operation fails.
+        :param pool_size: The maximum number of idle connections kept per
+            server.
+
+        :raise ValueError: When there are no servers.
+        """
+        if not servers:
+            raise ValueError('At least one server must be specified')
+        self.servers = [tuple(server) for server in servers]
+        self.timeout = timeout
+        self._pools = [LifoQueue(pool_size) for server in self.servers]
+
+    def get_multi(self, keys):
+        deadline = time.time() + self.timeout
+        by_server = self._by_server(keys)
+        result = {}
+        # Every request is sent before reading any response.
+        with self._connections(by_server.keys(), deadline) as connections:
+            for server, connection in connections.iteritems():
+                connection.send('get %s\r\n' % ' '.join(by_server[server]),
+                                deadline)
+            for connection in connections.itervalues():
+                while True:
+                    line = connection.readline(deadline)
+                    if line == 'END':
+                        break
+                    parts = line.split()
+                    if len(parts) < 4 or parts[0] != 'VALUE':
+                        raise BackendError('Unexpected response: %r' % line)
+                    result[parts[1]] = connection.read(int(parts[3]),
+                                                       deadline)
+        return result
+
+    def set_multi(self, mapping, ttl):
+        deadline = time.time() + self.timeout
+        by_server = self._by_server(mapping.keys())
+        ttl = int(min(max(ttl, 1), MAX_EXPIRATION))
+        with self._connections(by_server.keys(), deadline) as connections:
+            for server, connection in connections.iteritems():
+                # Without replies, so there is no round trip to wait for.
+                commands = ['set %s 0 %d %d noreply\r\n%s\r\n' %
+                            (key, ttl, len(mapping[key]), mapping[key])
+                            for key in by_server[server]]
+                connection.send(''.join(commands), deadline)
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        for pool in self._pools:
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except Empty:
+                    break
+
+    def _by_server(self, keys):
+        count = len(self.servers)
+        by_server = {}
+        for key in keys:
+            server = (zlib.crc32(key) & 0xffffffff) % count if count > 1 \
+                     else 0
+            by_server.setdefault(server, []).append(key)
+        return by_server
+
+    def _connections(self, servers, deadline):
+        return _Checkout(self, servers, deadline)
+
+    def _acquire(self, server, deadline):
+        try:
+            return self._pools[server].get_nowait()
+        except Empty:
+            pass
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise BackendError('Timeout')
+        try:
+            return _Connection(self.servers[server], remaining)
+        except socket.error, e:
+            raise BackendError('Cannot connect to %s:%d: %s' %
+                               (self.servers[server] + (e,)))
+
+    def _release(self, server, connection):
+        try:
+            self._pools[server].put_nowait(connection)
+        except Full:
+            connection.close()
+
+
+class _Checkout(object):
+    # Takes a connection to every server from the pools, and returns them
+    # only if the operation succeeded (otherwise their state is unknown).
+
+    def __init__(self, backend, servers, deadline):
+        self.backend = backend
+        self.servers = servers
+        self.deadline = deadline
+        self.connections = {}
+
+    def __enter__(self):
+        try:
+            for server in self.servers:
+                self.connections[server] = self.backend._acquire(
+                    server,
+                    self.deadline
+                )
+        except:
+            self._close()
+            raise
+        return self.connections
+
+    def __exit__(self, type_, value, traceback):
+        if type_ is None:
+            for server, connection in self.connections.iteritems():
+                self.backend._release(server, connection)
+            return False
+        self._close()
+        if issubclass(type_, (socket.error, socket.timeout)):
+            raise BackendError(str(value))
+        return False
+
+    def _close(self):
+        for connection in self.connections.itervalues():
+            connection.close()
+
+
+class _MemcachedHandler(SocketServer.StreamRequestHandler):
+
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+        self.server.clients.add(self.connection)
+
+    def finish(self):
+        self.server.clients.discard(self.connection)
+        SocketServer.StreamRequestHandler.finish(self)
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            if not parts:
+                continue
+            command = parts[0]
+            if command in ('get', 'gets'):
+                for key in parts[1:]:
+                    value = store.get(key)
+                    if value is not None:
+                        self.wfile.write('VALUE %s 0 %d\r\n%s\r\n' %
+                                         (key, len(value), value))
+                self.wfile.write('END\r\n')
+            elif command == 'set' and len(parts) >= 5:
+                data = self.rfile.read(int(parts[4]) + 2)[:-2]
+                ttl = int(parts[3])
+                store.set(parts[1], data, ttl if ttl > 0 else 10 ** 9)
+                if parts[-1] != 'noreply':
+                    self.wfile.write('STORED\r\n')
+            elif command == 'delete' and len(parts) >= 2:
+                store.delete(parts[1])
+                if parts[-1] != 'noreply':
+                    self.wfile.write('DELETED\r\n')
+            elif command == 'flush_all':
+                store.clear()
+                if parts[-1] != 'noreply':
+                    self.wfile.write('OK\r\n')
+            elif command == 'quit':
+                return
+            else:
+                self.wfile.write('ERROR\r\n')
+            self.wfile.flush()
+
+
+class _ThreadingServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LoopbackMemcachedServer(object):
+    """
+    A stand-in memcached server that runs in a thread of the process, with
+    the subset of the text protocol used by :py:class:`MemcachedBackend`
+    (``get``, ``set``, ``delete`` and ``flush_all``). It is meant for tests
+    and development.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, max_size=100000):
+        """
+        :param host: The address to listen on.
+        :param port: The port to listen on. By default any free port.
+        :param max_size: The maximum number of entries.
+        """
+        self._server = _ThreadingServer((host, port), _MemcachedHandler)
+        self._server.store = TTLCache(max_size=max_size)
+        self._server.clients = set()
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        The ``(host, port)`` address that the server listens on.
+        """
+        return self._server.server_address
+
+    @property
+    def store(self):
+        """
+        The :py:class:`TTLCache` with the entries.
+        """
+        return self._server.store
+
+    def start(self):
+        """
+        Starts serving in a daemon thread.
+        """
+        self._thread = Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and closes the listening socket and the connections of
+        the clients.
+        """
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        for client in list(self._server.clients):
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+# Objects that hold the state of the process rather than constraints of the
+# predicate, so they are only represented by their class.
+_RUNTIME_TYPES = (LockType, Queue, socket.socket, logging.Logger, TTLCache,
+                  CoarseClock)
+
+_FUNCTION_TYPES = (types.FunctionType, types.MethodType,
+                   types.BuiltinFunctionType)
+
+
+def _stable_repr(value, path=()):
+    # A representation of the configuration of a predicate that is the same
+    # in every process, so the nodes agree on the keys. When a value cannot
+    # be represented so, its repr() is used: the nodes then do not share the
+    # decisions, but different predicates never share them either.
+    if isinstance(value, (basestring, int, long, float, bool)) or \
+       value is None:
+        return repr(value)
+    if id(value) in path:
+        return '<cycle>'
+    path += (id(value),)
+    if isinstance(value, (tuple, list)):
+        return '(%s)' % ', '.join([_stable_repr(v, path) for v in value])
+    if isinstance(value, (set, frozenset)):
+        return '{%s}' % ', '.join(sorted([_stable_repr(v, path)
+                                          for v in value]))
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(sorted([
+            '%s: %s' % (_stable_repr(k, path), _stable_repr(v, path))
+            for k, v in value.iteritems()
+        ]))
+    if isinstance(value, (mmap.mmap, bytearray)):
+        return '<%s %s>' % (value.__class__.__name__,
+                            sha1(value[:]).hexdigest())
+    if isinstance(value, _RUNTIME_TYPES):
+        return '<%s>' % value.__class__.__name__
+    if isinstance(value, _FUNCTION_TYPES):
+        name = getattr(value, '__name__', '<lambda>')
+        if name == '<lambda>':
+            return repr(value)
+        return '%s.%s' % (getattr(value, '__module__', None), name)
+    attributes = getattr(value, '__dict__', None)
+    if attributes is None:
+        return repr(value)
+    cls = value.__class__
+    return '%s.%s%s' % (cls.__module__, cls.__name__,
+                        _stable_repr(sorted(attributes.items()), path))
+
+
+def predicate_name(predicate):
+    """
+    Gets a name of a predicate that depends only on its class and its
+    constraints (including the contents of the objects it is constructed
+    with, such as a :py:class:`SerialRanges`), so equal predicates have the
+    same name in every process.
+
+    :param predicate: The predicate, already constructed.
+    """
+    attributes = [(name, value)
+                  for name, value in sorted(predicate.__dict__.iteritems())
+                  if name != 'evaluate']
+    cls = predicate.__class__
+    return '%s.%s%s' % (cls.__module__, cls.__name__,
+                        _stable_repr(attributes))
+
+
+class DecisionCache(object):
+    """
+    Shares the decisions of the predicates among the nodes of a cluster
+    through a :py:class:`CacheBackend`. A decision is kept until the time to
+    live of the cache elapses, and never after the certificate expires.
+
+    A predicate uses it when it is constructed with the ``decision_cache``
+    argument. Only the predicates that can tell the identity of the
+    certificate they evaluate, and that do not depend on the time of the
+    day, are cached.
+
+    When the backend fails (or exceeds its time budget) the predicates are
+    evaluated locally, and the backend is not used again until
+    ``retry_interval`` elapses.
+    """
+
+    def __init__(self, backend, ttl=300, prefix='x509:', log=None,
+                 retry_interval=5, timer=None):
+        """
+        :param backend: The :py:class:`CacheBackend`.
+        :param ttl: The maximum number of seconds a decision is kept.
+        :param prefix: The prefix of the keys in the backend.
+        :param log: The logger where the failures of the backend are
+            reported.
+        :param retry_interval: The number of seconds the backend is not used
+            after a failure.
+        :param timer: A callable that returns the current time in seconds. By
+            default it is :py:func:`time.time`.
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self.log = log
+        self.retry_interval = retry_interval
+        self.timer = timer or time.time
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._down_until = None
+
+    def install(self, predicate, name=None):
+        """
+        Makes a predicate use this cache.
+
+        :param predicate: The predicate.
+        :param name: The name of the predicate in the cache, which must be
+            the same in every node. By default it is derived from its class
+            and its constraints (see :py:func:`predicate_name`).
+        """
+        if not getattr(predicate, 'cacheable', True) or \
+           getattr(predicate, 'schedule', None) is not None:
+            # Its evaluation has effects on the request, or its decisions
+            # depend on the time of the day.
+            return
+        evaluate = predicate.evaluate
+        identity = predicate._certificate_identity
+        # It is installed while the predicate is being constructed, so its
+        # name is only known once it is evaluated.
+        names = [name]
+
+        def get_name():
+            if names[0] is None:
+                names[0] = predicate_name(predicate)
+            return names[0]
+
+        def cached_evaluate(environ, credentials):
+            certificate = identity(environ)
+            if certificate is None:
+                evaluate(environ, credentials)
+                return
+            key = self._key(get_name(), certificate)
+            decision = self._fetch(environ, [key]).get(key)
+            if decision == _MET:
+                self.hits += 1
+                return
+            if decision == _UNMET:
+                self.hits += 1
+                predicate.unmet()
+
+            self.misses += 1
+            try:
+                evaluate(environ, credentials)
+            except NotAuthorizedError:
+                self._store(environ, key, _UNMET, self._ttl(predicate,
+                                                            environ, False))
+                raise
+            self._store(environ, key, _MET, self._ttl(predicate, environ,
+                                                      True))
+
+        cached_evaluate.decision_key = lambda environ: self._predicate_key(
+            get_name, identity, environ
+        )
+        predicate.evaluate = cached_evaluate
+
+    def prefetch(self, environ, predicates):
+        """
+        Fetches at once the decisions of several predicates that use this
+        cache, so their evaluations during the request do not wait for the
+        backend one by one.
+
+        :param environ: The WSGI environment.
+        :param predicates: The predicates.
+        """
+        keys = []
+        for predicate in predicates:
+            decision_key = getattr(predicate.evaluate, 'decision_key', None)
+            key = decision_key and decision_key(environ)
+            if key is not None:
+                keys.append(key)
+        if keys:
+            self._fetch(environ, keys)
+
+    def stats(self):
+        """
+        Gets the counters of the cache: the decisions found in the backend,
+        the ones that had to be evaluated, and the failures of the backend.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'errors': self.errors}
+
+    def _predicate_key(self, get_name, identity, environ):
+        certificate = identity(environ)
+        if certificate is None:
+            return None
+        return self._key(get_name(), certificate)
+
+    def _key(self, name, certificate):
+        return self.prefix + sha1(repr((name, certificate))).hexdigest()
+
+    def _fetch(self, environ, keys):
+        # The decisions of the request, fetching the ones that were not asked
+        # yet (a missing decision is remembered as None).
+        decisions = environ.get(ENVIRON_DECISIONS_KEY)
+        if decisions is None:
+            decisions = environ[ENVIRON_DECISIONS_KEY] = {}
+        missing = [key for key in keys if key not in decisions]
+        if missing:
+            for key in missing:
+                decisions[key] = None
+            if self._available():
+                try:
+                    decisions.update(self.backend.get_multi(missing))
+                except BackendError, e:
+                    self._failed(e)
+        return decisions
+
+    def _store(self, environ, key, decision, ttl):
+        environ.setdefault(ENVIRON_DECISIONS_KEY, {})[key] = decision
+        if ttl <= 0 or not self._available():
+            return
+        try:
+            self.backend.set_multi({key: decision}, ttl)
+        except BackendError, e:
+            self._failed(e)
+
+    def _ttl(self, predicate, environ, met):
+        validity = predicate.validity(environ)
+        if validity is None:
+            return self.ttl
+        if met or validity.now < validity.not_before:
+            # Not after the certificate expires, and a rejection of a
+            # certificate that is not valid yet not after it becomes valid.
+            return validity.ttl(self.ttl)
+        return self.ttl
+
+    def _available(self):
+        if self._down_until is None:
+            return True
+        if self.timer() >= self._down_until:
+            self._down_until = None
+            return True
+        return False
+
+    def _failed(self, error):
+        self.errors += 1
+        self._down_until = self.timer() + self.retry_interval
+        if self.log is not None:
+            self.log.warn('Decision cache unavailable for %d seconds: %s' %
+                          (self.retry_interval, error))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the hook that tells the upstream proxies for how long the
+authorization of a client certificate can be cached: until the certificate
+expires.
+"""
+
+from .predicates import X509Predicate
+
+
+__all__ = ['ExpiryHeaderMiddleware', 'expiry_headers', 'EXPIRY_HEADER']
+
+
+EXPIRY_HEADER = 'X-SSL-Client-Cert-TTL'
+
+_PREDICATE = X509Predicate()
+
+
+def expiry_headers(environ, predicate=None, header=EXPIRY_HEADER,
+                   max_ttl=None):
+    """
+    Gets the response headers that tell for how many seconds the client
+    certificate will still be valid.
+
+    :param environ: The WSGI environment.
+    :param predicate: The :py:class:`X509Predicate` whose source, keys and
+        clock are used. By default a predicate with the default options.
+    :param header: The name of the header.
+    :param max_ttl: The maximum number of seconds.
+
+    :return: A list with the header, or an empty list if the certificate is
+        not valid or its validity range is unknown.
+    """
+    validity = (predicate or _PREDICATE).validity(environ)
+    if validity is None or not validity.is_valid:
+        return []
+    ttl = validity.ttl(max_ttl)
+    if ttl <= 0:
+        return []
+    return [(header, str(ttl))]
+
+
+class ExpiryHeaderMiddleware(object):
+    """
+    WSGI middleware that adds the header of :py:func:`expiry_headers` to the
+    successful responses (and redirections), so a proxy in front of the
+    application can cache the authorization of a client certificate no longer
+    than the certificate is valid.
+    """
+
+    def __init__(self, app, predicate=None, header=EXPIRY_HEADER,
+                 max_ttl=None):
+        """
+        :param app: The WSGI application.
+        :param predicate: The :py:class:`X509Predicate` whose source, keys and
+            clock are used.
+        :param header: The name of the header.
+        :param max_ttl: The maximum number of seconds.
+        """
+        self.app = app
+        self.predicate = predicate
+        self.header = header
+        self.max_ttl = max_ttl
+
+    def __call__(self, environ, start_response):
+        def expiry_start_response(status, headers, exc_info=None):
+            if status[:1] in ('2', '3'):
+                headers = headers + expiry_headers(environ, self.predicate,
+                                                   self.header, self.max_ttl)
+            return start_response(status, headers, exc_info)
+
+        return self.app(environ, expiry_start_response)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the :mod:`repoze.what` group source adapter that derives
+the groups of a client from the attributes of its subject distinguished name,
+e.g. every certificate with ``OU=Engineering`` belongs to the ``developers``
+group.
+
+In this adapter a section is a group, and its items are the attributes that
+grant the membership, as ``TYPE=value`` strings (e.g. ``OU=Engineering``).
+"""
+from repoze.what.adapters import BaseSourceAdapter
+from repoze.who.plugins.x509.utils import parse_dn
+
+from .cache import TTLCache
+from .predicates import normalize_dn_value
+
+
+__all__ = ['X509GroupAdapter', 'parse_attribute']
+
+
+_EMPTY = frozenset()
+
+
+def parse_attribute(attribute):
+    """
+    Splits an attribute of a distinguished name.
+
+    :param attribute: Either a ``TYPE=value`` string or a ``(type, value)``
+        tuple.
+
+    :return: The ``(type, value)`` tuple.
+
+    :raise ValueError: When the attribute has no type or no value.
+    """
+    if isinstance(attribute, basestring):
+        type_, _, value = attribute.partition('=')
+    else:
+        type_, value = attribute
+    if not type_ or not value:
+        raise ValueError('Invalid attribute: %r' % (attribute,))
+    return type_.strip(), value
+
+
+class X509GroupAdapter(BaseSourceAdapter):
+    """
+    A read-only group source adapter whose groups are given by the attributes
+    of the subject distinguished name of the client certificate, which the
+    ``repoze.who`` X.509 identifier puts in the credentials. The mapping is
+    compiled into a table from every attribute to its groups, and the groups
+    of every subject are cached.
+    """
+
+    def __init__(self, groups, subject_field='subject', normalize=False,
+                 ttl=300, max_size=10000):
+        """
+        :param groups: A dictionary with the attributes of every group, e.g.
+            ``{'developers': ['OU=Engineering', 'OU=Operations']}``. Any
+            attribute type can be used (see :py:func:`parse_attribute`).
+        :param subject_field: The key of the credentials with the subject
+            distinguished name.
+        :param normalize: If true, values are compared regardless of case,
+            Unicode normalization form and whitespace (see
+            :py:func:`normalize_dn_value`).
+        :param ttl: The time to live, in seconds, of the cached groups of a
+            subject.
+        :param max_size: The maximum number of subjects whose groups are
+            cached.
+
+        :raise ValueError: When any of the attributes is invalid.
+        """
+        super(X509GroupAdapter, self).__init__(writable=False)
+        self.subject_field = subject_field
+        self.normalize = normalize
+        self.cache = TTLCache(ttl=ttl, max_size=max_size)
+        self._groups = {}
+        self._table = {}
+        for group, attributes in groups.iteritems():
+            attributes = [parse_attribute(a) for a in attributes]
+            self._groups[group] = set(['%s=%s' % a for a in attributes])
+            for attribute in attributes:
+                key = self._key(*attribute)
+                self._table[key] = self._table.get(key, _EMPTY) | \
+                                   frozenset([group])
+
+    def groups_of(self, subject):
+        """
+        Gets the groups of a subject.
+
+        :param subject: The subject distinguished name.
+
+        :return: A frozenset with the groups, empty if the distinguished name
+            is invalid.
+        """
+        groups = self.cache.get(subject)
+        if groups is None:
+            groups = _EMPTY
+            try:
+                parsed = parse_dn(subject)
+            except Exception:
+                parsed = {}
+            table = self._table
+            for type_, values in parsed.iteritems():
+                for value in values:
+                    found = table.get(self._key(type_, value))
+                    if found is not None:
+                        groups = groups | found
+            self.cache.set(subject, groups)
+        return groups
+
+    def _key(self, type_, value):
+        if self.normalize:
+            value = normalize_dn_value(value)
+        return (type_, value)
+
+    # BaseSourceAdapter
+
+    def _get_all_sections(self):
+        return dict([(group, set(attributes))
+                     for group, attributes in self._groups.iteritems()])
+
+    def _get_section_items(self, section):
+        return set(self._groups[section])
+
+    def _find_sections(self, hint):
+        # The credentials of the client (there are no groups of groups).
+        if not isinstance(hint, dict):
+            return _EMPTY
+        subject = hint.get(self.subject_field)
+        if subject is None:
+            return _EMPTY
+        return self.groups_of(subject)
+
+    def _item_is_included(self, section, item):
+        try:
+            type_, value = parse_attribute(item)
+        except ValueError:
+            return False
+        return section in self._table.get(self._key(type_, value), _EMPTY)
+
+    def _section_exists(self, section):
+        return section in self._groups
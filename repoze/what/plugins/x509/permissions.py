@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the :mod:`repoze.what` permission source adapter that
+grants permissions to groups and to the attributes of the subject and the
+issuer distinguished names of the client certificate.
+
+In this adapter a section is a permission, and its items are the groups or
+the attributes that are granted such permission. Attributes are ``TYPE=value``
+strings of the subject (e.g. ``OU=Engineering``) or, prefixed by ``issuer:``,
+of the issuer (e.g. ``issuer:O=Example CA``).
+
+:mod:`repoze.what` only asks the permission adapters for the permissions of
+the groups of the client, so the attributes are taken into account through
+:py:class:`X509AuthorizationMetadata` (e.g. with :py:func:`setup_x509_auth`).
+"""
+import os
+
+from repoze.what.adapters import BaseSourceAdapter
+from repoze.what.middleware import AuthorizationMetadata
+from repoze.who.classifiers import default_challenge_decider, \
+     default_request_classifier
+from repoze.who.plugins.testutil import make_middleware
+from repoze.who.plugins.x509.utils import parse_dn
+
+from .cache import TTLCache
+from .groups import parse_attribute
+from .predicates import normalize_dn_value
+
+
+__all__ = ['X509PermissionAdapter', 'X509AuthorizationMetadata',
+           'setup_x509_auth']
+
+
+ISSUER_PREFIX = 'issuer:'
+ISSUER_KEY = 'SSL_CLIENT_I_DN'
+
+_EMPTY = frozenset()
+
+
+class X509PermissionAdapter(BaseSourceAdapter):
+    """
+    A read-only permission source adapter. The permissions are compiled into
+    an inverted index from every group and every attribute to the permissions
+    it is granted, so the permissions of a group are a single lookup, and the
+    ones of a certificate identity a lookup per attribute.
+
+    The permissions of the certificate identities are cached, and identities
+    with the same permissions share the same set, so the memory used is
+    bounded by ``max_size`` identities.
+    """
+
+    def __init__(self, permissions, subject_field='subject',
+                 issuer_field='issuer', normalize=False, ttl=300,
+                 max_size=100000):
+        """
+        :param permissions: A dictionary with the items of every permission,
+            e.g. ``{'deploy': ['admins', 'OU=Operations',
+            'issuer:O=Example CA']}``. Items without ``=`` are groups.
+        :param subject_field: The key of the credentials with the subject
+            distinguished name.
+        :param issuer_field: The key of the credentials with the issuer
+            distinguished name.
+        :param normalize: If true, values are compared regardless of case,
+            Unicode normalization form and whitespace (see
+            :py:func:`normalize_dn_value`).
+        :param ttl: The time to live, in seconds, of the cached permissions
+            of an identity.
+        :param max_size: The maximum number of identities whose permissions
+            are cached.
+
+        :raise ValueError: When any of the attributes is invalid.
+        """
+        super(X509PermissionAdapter, self).__init__(writable=False)
+        self.subject_field = subject_field
+        self.issuer_field = issuer_field
+        self.normalize = normalize
+        self.cache = TTLCache(ttl=ttl, max_size=max_size)
+        self._permissions = {}
+        self._index = {}
+        self._shared = {}
+        for permission, items in permissions.iteritems():
+            self._permissions[permission] = set(items)
+            for item in items:
+                key = self._item_key(item)
+                self._index[key] = self._share(
+                    self._index.get(key, _EMPTY) | frozenset([permission])
+                )
+
+    def permissions_of(self, subject=None, issuer=None, groups=()):
+        """
+        Gets the permissions of a certificate identity.
+
+        :param subject: The subject distinguished name.
+        :param issuer: The issuer distinguished name.
+        :param groups: The groups of the client.
+
+        :return: A frozenset with the permissions.
+        """
+        key = (subject, issuer)
+        permissions = self.cache.get(key)
+        if permissions is None:
+            permissions = self._share(
+                self._attribute_permissions('subject', subject) |
+                self._attribute_permissions('issuer', issuer)
+            )
+            self.cache.set(key, permissions)
+        index = self._index
+        for group in groups:
+            found = index.get(('group', group))
+            if found is not None:
+                permissions = permissions | found
+        return permissions
+
+    def _attribute_permissions(self, side, dn):
+        permissions = _EMPTY
+        if dn is None:
+            return permissions
+        try:
+            parsed = parse_dn(dn)
+        except Exception:
+            return permissions
+        index = self._index
+        for type_, values in parsed.iteritems():
+            for value in values:
+                found = index.get(self._key(side, type_, value))
+                if found is not None:
+                    permissions = permissions | found
+        return permissions
+
+    def _item_key(self, item):
+        if item.startswith(ISSUER_PREFIX):
+            type_, value = parse_attribute(item[len(ISSUER_PREFIX):])
+            return self._key('issuer', type_, value)
+        if '=' in item:
+            type_, value = parse_attribute(item)
+            return self._key('subject', type_, value)
+        return ('group', item)
+
+    def _key(self, side, type_, value):
+        if self.normalize:
+            value = normalize_dn_value(value)
+        return (side, type_, value)
+
+    def _share(self, permissions):
+        # Equal sets of permissions are the same object.
+        return self._shared.setdefault(permissions, permissions)
+
+    # BaseSourceAdapter
+
+    def _get_all_sections(self):
+        return dict([(permission, set(items))
+                     for permission, items in self._permissions.iteritems()])
+
+    def _get_section_items(self, section):
+        return set(self._permissions[section])
+
+    def _find_sections(self, hint):
+        # Either a group, as asked by repoze.what, or the credentials of the
+        # client.
+        if not isinstance(hint, dict):
+            return self._index.get(('group', hint), _EMPTY)
+        return self.permissions_of(hint.get(self.subject_field),
+                                   hint.get(self.issuer_field),
+                                   hint.get('groups') or ())
+
+    def _item_is_included(self, section, item):
+        try:
+            key = self._item_key(item)
+        except ValueError:
+            return False
+        return section in self._index.get(key, _EMPTY)
+
+    def _section_exists(self, section):
+        return section in self._permissions
+
+
+class X509AuthorizationMetadata(AuthorizationMetadata):
+    """
+    A :mod:`repoze.who` metadata provider that loads the groups and the
+    permissions of the client, like the one of :mod:`repoze.what`, except that
+    an :py:class:`X509PermissionAdapter` is asked with the credentials of the
+    client instead of with every group, so the permissions granted to the
+    attributes of its certificate are loaded as well.
+    """
+
+    def __init__(self, group_adapters=None, permission_adapters=None,
+                 issuer_key=None):
+        """
+        :param group_adapters: The group source adapters, by name.
+        :param permission_adapters: The permission source adapters, by name.
+        :param issuer_key: The WSGI environment key of the issuer
+            distinguished name, which is added to the identity as ``issuer``
+            when the identifier did not set it. By default it is
+            ``SSL_CLIENT_I_DN``.
+        """
+        super(X509AuthorizationMetadata, self).__init__(group_adapters,
+                                                        permission_adapters)
+        self.issuer_key = issuer_key or ISSUER_KEY
+
+    def add_metadata(self, environ, identity):
+        """
+        Loads the groups and the permissions of the client.
+
+        :param environ: The WSGI environment.
+        :param identity: The :mod:`repoze.who` identity.
+        """
+        if identity.get('issuer') is None:
+            identity['issuer'] = environ.get(self.issuer_key)
+        super(X509AuthorizationMetadata, self).add_metadata(environ, identity)
+
+    def _find_groups(self, identity):
+        groups = set()
+        if self.group_adapters is not None:
+            credentials = identity.copy()
+            credentials['repoze.what.userid'] = identity['repoze.who.userid']
+            for adapter in self.group_adapters.values():
+                groups |= set(adapter.find_sections(credentials))
+
+        permissions = set()
+        if self.permission_adapters is not None:
+            credentials = dict(identity, groups=tuple(groups))
+            for adapter in self.permission_adapters.values():
+                if isinstance(adapter, X509PermissionAdapter):
+                    permissions |= set(adapter.find_sections(credentials))
+                    continue
+                for group in groups:
+                    permissions |= set(adapter.find_sections(group))
+        return tuple(groups), tuple(permissions)
+
+
+def setup_x509_auth(app, group_adapters=None, permission_adapters=None,
+                    issuer_key=None, **who_args):
+    """
+    Sets up :mod:`repoze.who` with :mod:`repoze.what` support, like
+    :func:`repoze.what.middleware.setup_auth`, but loading the groups and the
+    permissions with an :py:class:`X509AuthorizationMetadata`.
+
+    :param app: The WSGI application.
+    :param group_adapters: The group source adapters, by name.
+    :param permission_adapters: The permission source adapters, by name.
+    :param issuer_key: The WSGI environment key of the issuer distinguished
+        name (see :py:class:`X509AuthorizationMetadata`).
+    :param who_args: The keyword arguments of
+        :func:`repoze.what.middleware.setup_auth`.
+
+    :return: The WSGI application with the authentication and authorization
+        middleware.
+    """
+    authorization = X509AuthorizationMetadata(group_adapters,
+                                              permission_adapters,
+                                              issuer_key)
+    who_args.setdefault('mdproviders', []).append(('authorization_md',
+                                                   authorization))
+    who_args.setdefault('classifier', default_request_classifier)
+    who_args.setdefault('challenge_decider', default_challenge_decider)
+    if os.environ.get('AUTH_LOG', '') == '1':
+        import sys
+        who_args['log_stream'] = sys.stdout
+    skip_authentication = who_args.pop('skip_authentication', False)
+    return make_middleware(skip_authentication, app, **who_args)
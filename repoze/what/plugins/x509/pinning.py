@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+This module contains the predicate that allows specific client certificates,
+by the SHA-256 fingerprint of the certificate or of its public key (SPKI), and
+the compact pin files that hold large sets of such fingerprints.
+
+A pin file has a header, an optional Bloom filter and the sorted
+fingerprints, so it can be memory mapped and shared by every process of the
+host.
+"""
+from binascii import unhexlify
+import mmap
+import os
+import struct
+
+from .predicates import X509Predicate
+from .sources import CERT_KEY
+
+
+__all__ = ['is_pinned', 'PinSet', 'write_pin_file', 'parse_fingerprint']
+
+
+FINGERPRINT_SIZE = 32
+
+_MAGIC = 'X509PIN1'
+# Magic, number of fingerprints, bits of the Bloom filter, number of hashes.
+_HEADER = struct.Struct('>8sQQI')
+_HASHES = struct.Struct('>QQ')
+
+
+def parse_fingerprint(fingerprint):
+    """
+    Converts a fingerprint into its binary form.
+
+    :param fingerprint: The binary SHA-256 digest, or its hexadecimal
+        representation (optionally separated by colons, as printed by
+        OpenSSL).
+
+    :raise ValueError: When it is not a SHA-256 fingerprint.
+    """
+    if len(fingerprint) != FINGERPRINT_SIZE:
+        try:
+            fingerprint = unhexlify(fingerprint.replace(':', ''))
+        except TypeError:
+            raise ValueError('Invalid fingerprint: not hexadecimal')
+    if len(fingerprint) != FINGERPRINT_SIZE:
+        raise ValueError('Invalid fingerprint: not a SHA-256 digest')
+    return fingerprint
+
+
+def _bloom_bits(fingerprint, size, hashes):
+    # The fingerprints are already uniformly distributed, so they are used as
+    # the two base hashes of the double hashing.
+    h1, h2 = _HASHES.unpack_from(fingerprint)
+    h2 |= 1
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+
+def write_pin_file(path, fingerprints, bloom_bits_per_pin=10,
+                   bloom_hashes=7):
+    """
+    Writes a pin file.
+
+    :param path: The path of the file.
+    :param fingerprints: An iterable of fingerprints (see
+        :py:func:`parse_fingerprint`).
+    :param bloom_bits_per_pin: The number of bits of the Bloom filter per
+        fingerprint. The default gives a false positive rate of about 1%. If
+        it is zero, the file will not have a Bloom filter.
+    :param bloom_hashes: The number of hashes of the Bloom filter.
+
+    :return: The number of (distinct) fingerprints written.
+    """
+    pins = sorted(set([parse_fingerprint(f) for f in fingerprints]))
+    size = len(pins) * bloom_bits_per_pin
+    if size:
+        # Keep whole bytes.
+        size = (size + 7) & ~7
+    bloom = bytearray(size // 8)
+    for pin in pins if size else ():
+        for bit in _bloom_bits(pin, size, bloom_hashes):
+            bloom[bit >> 3] |= 1 << (bit & 7)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, len(pins), size, bloom_hashes))
+        f.write(str(bloom))
+        f.write(''.join(pins))
+    os.rename(tmp_path, path)
+    return len(pins)
+
+
+class PinSet(object):
+    """
+    A set of fingerprints that is read from a memory mapped pin file. The
+    Bloom filter, if present, rejects most of the unknown fingerprints before
+    the binary search over the sorted fingerprints.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the pin file, as written by
+            :py:func:`write_pin_file`.
+
+        :raise ValueError: When the file is not a valid pin file.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise ValueError('Invalid pin file: truncated')
+            magic, count, bloom_size, bloom_hashes = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                raise ValueError('Invalid pin file: unknown format')
+            self._offset = _HEADER.size + bloom_size // 8
+            expected = self._offset + count * FINGERPRINT_SIZE
+            if os.fstat(f.fileno()).st_size != expected:
+                raise ValueError('Invalid pin file: truncated')
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                        if count else ''
+
+        self._count = count
+        self._bloom_size = bloom_size
+        self._bloom_hashes = bloom_hashes
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, fingerprint):
+        if len(fingerprint) != FINGERPRINT_SIZE or self._count == 0:
+            return False
+
+        data = self._map
+        if self._bloom_size:
+            offset = _HEADER.size
+            for bit in _bloom_bits(fingerprint, self._bloom_size,
+                                   self._bloom_hashes):
+                if not ord(data[offset + (bit >> 3)]) & (1 << (bit & 7)):
+                    return False
+
+        low, high = 0, self._count
+        offset = self._offset
+        while low < high:
+            middle = (low + high) // 2
+            start = offset + middle * FINGERPRINT_SIZE
+            pin = data[start:start + FINGERPRINT_SIZE]
+            if pin < fingerprint:
+                low = middle + 1
+            elif pin > fingerprint:
+                high = middle
+            else:
+                return True
+        return False
+
+    def close(self):
+        """
+        Unmaps the pin file.
+        """
+        if self._count:
+            self._map.close()
+
+
+class is_pinned(X509Predicate):
+    """
+    Represents a predicate that checks that the client certificate is one of
+    a set of pinned certificates, by its SHA-256 fingerprint or by the SHA-256
+    digest of its subject public key info.
+    """
+
+    message = 'Invalid SSL client certificate pin.'
+
+    def __init__(self, pins, spki=False, cert_key=None, **kwargs):
+        """
+        :param pins: The fingerprints that are allowed. Either a
+            :py:class:`PinSet`, or an iterable of fingerprints (see
+            :py:func:`parse_fingerprint`).
+        :param spki: If true, the fingerprints are of the subject public key
+            info of the certificates instead of the whole certificates.
+        :param cert_key: The WSGI environment key of the PEM encoded client
+            certificate. By default it is ``SSL_CLIENT_CERT``.
+
+        :raise ValueError: When any of the fingerprints is invalid.
+        """
+        super(is_pinned, self).__init__(**kwargs)
+        if not isinstance(pins, PinSet):
+            pins = frozenset([parse_fingerprint(pin) for pin in pins])
+        self.pins = pins
+        self.spki = spki
+        self.cert_key = cert_key or CERT_KEY
+
+    def _certificate_identity(self, environ):
+        certificate = self.source.get(environ, self.cert_key)
+        if certificate is None:
+            return None
+        return self._validity_identity(environ) + (certificate,)
+
+    def evaluate(self, environ, credentials):
+        """
+        Evaluates the fingerprint of the client certificate. It is calculated
+        only once per request.
+
+        :param environ: The WSGI environment.
+        :param credentials: The user credentials. This parameter is not used.
+
+        :raise NotAuthorizedError: When the evaluation fails.
+        """
+        super(is_pinned, self).evaluate(environ, credentials)
+        try:
+            fingerprint = self.source.get_fingerprint(environ, self.cert_key,
+                                                      self.spki)
+        except ValueError:
+            self.unmet()
+
+        if fingerprint is None or fingerprint not in self.pins:
+            self.unmet()
@@ -19,12 +19,188 @@
 """
 This module contains all the predicates related to x.509 authorization.
 """
-from repoze.what.predicates import Predicate
+from repoze.what.predicates import Predicate, NotAuthorizedError
 from repoze.who.plugins.x509.utils import *
 import re
+import time
+import unicodedata
 
+from .clock import get_clock, Validity, DEFAULT_RESOLUTION
+from .sources import EnvironSource
 
-__all__ = ['is_subject', 'is_issuer', 'X509Predicate', 'X509DNPredicate']
+
+__all__ = ['is_subject', 'is_issuer', 'is_client', 'X509Predicate',
+           'X509DNPredicate',
+           'normalize_dn_value', 'any_of', 'all_of', 'exactly', 'none_of']
+
+
+# Keyword arguments that are options of the predicate itself, and therefore
+# must never be considered as custom attribute types of a distinguished name.
+PREDICATE_OPTIONS = ('verify_key', 'validity_start_key', 'validity_end_key',
+                     'clock_resolution', 'strict_validity', 'schedule',
+                     'source', 'tracer', 'decision_cache', 'negative_cache',
+                     'memoize', 'normalize', 'msg', 'log')
+
+# The environ key where the distinguished names parsed during a request are
+# kept, so every predicate evaluated within such request can reuse them.
+ENVIRON_PARSED_KEY = 'repoze.what.x509.parsed'
+
+# The environ key where the results of the memoized predicates evaluated during
+# a request are kept.
+ENVIRON_RESULTS_KEY = 'repoze.what.x509.results'
+
+_ENVIRON_SOURCE = EnvironSource()
+
+_WHITESPACE_REGEX = re.compile(r'\s+', re.UNICODE)
+
+_EMPTY = frozenset()
+
+# The unicode values and the constraint sets of the predicates, shared by every
+# predicate with equal ones (str values are interned instead). They are
+# bounded, so applications that construct predicates per request or per tenant
+# do not keep every one of them; values beyond the limit are not shared.
+_SHARED_VALUES = {}
+_SHARED_PARAMS = {}
+_MAX_SHARED = 10000
+
+
+def normalize_dn_value(value):
+    """
+    Normalizes the value of an attribute of a distinguished name, in the
+    spirit of RFC 4518: NFKC normalization, case folding, and collapse of
+    whitespace.
+
+    :param value: The value, either unicode or an UTF-8 encoded string.
+
+    :return: The normalized unicode value.
+    """
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    value = unicodedata.normalize('NFKC', value).lower()
+    return _WHITESPACE_REGEX.sub(u' ', value).strip()
+
+
+def _share(value):
+    # Gets the instance of a value that is shared by every predicate.
+    if isinstance(value, str):
+        return intern(value)
+    if isinstance(value, unicode):
+        return _shared(_SHARED_VALUES, value)
+    if isinstance(value, MultiValue):
+        return value.map(_share)
+    return value
+
+
+def _share_params(params):
+    params = tuple([(_share(type_), _share(value)) for type_, value in params])
+    return _shared(_SHARED_PARAMS, params)
+
+
+def _shared(table, value):
+    try:
+        return table[value]
+    except KeyError:
+        if len(table) < _MAX_SHARED:
+            table[value] = value
+        return value
+    except TypeError:
+        # Not hashable (e.g. a list of values), so it cannot be shared.
+        return value
+
+
+class MultiValue(object):
+    """
+    Represents a condition on all the values of a multi-valued attribute type
+    of a distinguished name (e.g. several organizational units).
+
+    Users must use a subclass.
+    """
+
+    __slots__ = ('values',)
+
+    def __init__(self, *values):
+        """
+        :param values: The values of the condition.
+
+        :raise ValueError: When there are no values.
+        """
+        if len(values) == 0:
+            raise ValueError('At least one value must be specified')
+        self.values = frozenset(values)
+
+    def matches(self, values):
+        """
+        Checks the condition.
+
+        :param values: The frozenset of the values of the attribute type.
+        """
+        raise NotImplementedError()
+
+    def map(self, function):
+        """
+        Gets the same condition with every value transformed by a function.
+        """
+        return self.__class__(*[function(v) for v in self.values])
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and \
+               self.values == other.values
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.__class__, self.values))
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join([repr(v) for v in sorted(self.values)]))
+
+
+class any_of(MultiValue):
+    """
+    At least one of the values must be present.
+    """
+
+    __slots__ = ()
+
+    def matches(self, values):
+        return not self.values.isdisjoint(values)
+
+
+class all_of(MultiValue):
+    """
+    All of the values must be present, though there may be others. This is
+    the condition of a tuple or a list.
+    """
+
+    __slots__ = ()
+
+    def matches(self, values):
+        return self.values <= values
+
+
+class exactly(MultiValue):
+    """
+    The values must be exactly these, no more and no less.
+    """
+
+    __slots__ = ()
+
+    def matches(self, values):
+        return self.values == values
+
+
+class none_of(MultiValue):
+    """
+    None of the values may be present. It is met if the attribute type is not
+    present at all.
+    """
+
+    __slots__ = ()
+
+    def matches(self, values):
+        return self.values.isdisjoint(values)
 
 
 class X509Predicate(Predicate):
@@ -35,6 +211,22 @@ class X509Predicate(Predicate):
     Users must use a subclass or inherit from it.
     """
 
+    message = 'Invalid SSL client certificate.'
+
+    # The defaults of the options are kept by the class, so a predicate only
+    # stores the options that were specified.
+    verify_key = VERIFY_KEY
+    validity_start_key = VALIDITY_START_KEY
+    validity_end_key = VALIDITY_END_KEY
+    clock = get_clock(DEFAULT_RESOLUTION)
+    strict_validity = False
+    schedule = None
+    source = _ENVIRON_SOURCE
+    # Whether the decisions of the predicate may be reused by other requests
+    # without evaluating it, i.e. its evaluation has no effects on the request
+    # (e.g. storing a value in the WSGI environment for the application).
+    cacheable = True
+
     def __init__(self, **kwargs):
         """
 
@@ -48,13 +240,59 @@ class X509Predicate(Predicate):
         :param validity_end_key: The WSGI environment key that specifies the
             encoded datetime that indicates the end of the validity range.
             If the timezone is not UTC (or GMT), it will fail.
+        :param clock_resolution: The number of milliseconds between the
+            refreshes of the clock used to check the validity range. By
+            default it is one second.
+        :param strict_validity: If true, the validity range is checked against
+            the exact current time instead of the clock.
+        :param schedule: A :py:class:`Schedule` with the times of the week
+            when the client certificate may be used. It is checked against
+            the same clock as the validity range. By default it may be used
+            at any time.
+        :param source: Where the client certificate variables are read from.
+            By default they are read from the WSGI environment as they are;
+            use a :py:class:`HeaderSource` to read them from the headers
+            forwarded by a reverse proxy.
+        :param tracer: A :py:class:`Tracer` that records where the time of the
+            evaluations of this predicate is spent. By default there is no
+            tracing.
+        :param decision_cache: A :py:class:`DecisionCache` that shares the
+            decisions of this predicate with the other nodes of a cluster.
+        :param negative_cache: A :py:class:`NegativeCache` that remembers the
+            certificates rejected by this predicate for a short time.
+        :param memoize: If true, this predicate is evaluated at most once per
+            request; checking it again within the same request returns the
+            same result.
         """
-        self.verify_key = kwargs.pop('verify_key', None) or VERIFY_KEY
-        self.validity_start_key = kwargs.pop('validity_start_key', None) or \
-            VALIDITY_START_KEY
-        self.validity_end_key = kwargs.pop('validity_end_key', None) or \
-            VALIDITY_END_KEY
+        for option in ('verify_key', 'validity_start_key',
+                       'validity_end_key'):
+            key = kwargs.pop(option, None)
+            if key:
+                setattr(self, option, _share(key))
+        clock_resolution = kwargs.pop('clock_resolution', None)
+        if clock_resolution is not None:
+            self.clock = get_clock(clock_resolution)
+        if kwargs.pop('strict_validity', False):
+            self.strict_validity = True
+        schedule = kwargs.pop('schedule', None)
+        if schedule is not None:
+            self.schedule = schedule
+        source = kwargs.pop('source', None)
+        if source is not None:
+            self.source = source
+        tracer = kwargs.pop('tracer', None)
+        decision_cache = kwargs.pop('decision_cache', None)
+        negative_cache = kwargs.pop('negative_cache', None)
+        memoize = kwargs.pop('memoize', False)
         super(X509Predicate, self).__init__(msg=kwargs.get('msg'))
+        if tracer is not None:
+            tracer.instrument(self)
+        if decision_cache is not None:
+            decision_cache.install(self)
+        if negative_cache is not None:
+            negative_cache.install(self)
+        if memoize:
+            self.evaluate = self._memoized(self.evaluate)
 
     def evaluate(self, environ, credentials):
         """
@@ -66,15 +304,89 @@ class X509Predicate(Predicate):
 
         :raise NotAuthorizedError: If the predicate is not met.
         """
-        # Cannot assume every environment will have all mod_ssl CGI vars.
-        if not verify_certificate(
-            environ,
-            self.verify_key,
-            self.validity_start_key,
-            self.validity_end_key
-        ):
+        if not self._verify_certificate(environ):
             self.unmet()
 
+    def validity(self, environ):
+        """
+        Gets the validity range of the client certificate as of now (by the
+        clock of this predicate), e.g. to know for how long a decision can be
+        cached.
+
+        :param environ: The WSGI environment.
+
+        :return: The :py:class:`Validity`, or ``None`` if the range is not
+            present or cannot be decoded.
+        """
+        try:
+            window = self.source.get_validity(environ,
+                                              self.validity_start_key,
+                                              self.validity_end_key)
+        except ValueError:
+            return None
+        if window is None:
+            return None
+        return Validity(window[0], window[1], self._now())
+
+    def _now(self):
+        return int(time.time()) if self.strict_validity else self.clock.now()
+
+    def _memoized(self, evaluate):
+        # The result (None if met, or the error) is kept in the environ, so it
+        # lives only as long as the request.
+        def memoized_evaluate(environ, credentials):
+            results = environ.get(ENVIRON_RESULTS_KEY)
+            if results is None:
+                results = environ[ENVIRON_RESULTS_KEY] = {}
+            try:
+                error = results[self]
+            except KeyError:
+                try:
+                    evaluate(environ, credentials)
+                except NotAuthorizedError, error:
+                    results[self] = error
+                    raise
+                results[self] = None
+                return
+
+            if error is not None:
+                raise error
+
+        return memoized_evaluate
+
+    def _certificate_identity(self, environ):
+        # The values that completely determine the result of the evaluation,
+        # or None if they cannot be known without evaluating. Subclasses that
+        # evaluate more than the validity must extend it.
+        if self.__class__.evaluate is not X509Predicate.evaluate:
+            return None
+        return self._validity_identity(environ)
+
+    def _validity_identity(self, environ):
+        source = self.source
+        return (source.get(environ, self.verify_key),
+                source.get(environ, self.validity_start_key),
+                source.get(environ, self.validity_end_key))
+
+    def _verify_certificate(self, environ):
+        source = self.source
+        if source.get(environ, self.verify_key) != 'SUCCESS':
+            return False
+
+        try:
+            window = source.get_validity(environ, self.validity_start_key,
+                                         self.validity_end_key)
+        except ValueError:
+            return False
+
+        now = time.time() if self.strict_validity else self.clock.now()
+        if self.schedule is not None and not self.schedule.allows(now):
+            return False
+        if window is None:
+            # Cannot assume every environment will have all mod_ssl CGI vars.
+            return True
+        return window[0] <= now <= window[1]
+
 
 class X509DNPredicate(X509Predicate):
     """
@@ -83,6 +395,9 @@ class X509DNPredicate(X509Predicate):
     specified.
     """
 
+    log = None
+    normalize = False
+
     def __init__(self, common_name=None, organization=None,
                  organizational_unit=None, country=None,
                  state=None, locality=None, environ_key=None, **kwargs):
@@ -99,7 +414,13 @@ class X509DNPredicate(X509Predicate):
             name is located.
         :param kwargs: You can specify a custom attribute type. The name of the
             key will count as the type, and the value is what is going to be
-            checked against.
+            checked against. Any value may be a :py:class:`any_of`,
+            :py:class:`all_of`, :py:class:`exactly` or :py:class:`none_of`
+            condition for multi-valued attribute types; a tuple or a list is
+            the same as :py:class:`all_of`. It also accepts ``normalize``: if
+            true, values are
+            compared regardless of case, Unicode normalization form and
+            whitespace (see :py:func:`normalize_dn_value`).
 
         :raise ValueError: When you don't specify at least one value for the
             parameters, including any custom one; or, when you don't specify an
@@ -123,16 +444,35 @@ class X509DNPredicate(X509Predicate):
             ('L', locality, 'locality')
         )
 
-        self.log = kwargs.get('log')
+        if kwargs.get('log'):
+            self.log = kwargs['log']
+        if kwargs.get('normalize'):
+            self.normalize = True
         self._prepare_dn_params_with_consistency(
             field_and_values,
             kwargs
         )
+        if len(self.dn_params) == 0:
+            raise ValueError('At least one attribute type must have a value')
+
+        for n, (type_, value) in enumerate(self.dn_params):
+            if isinstance(value, list) or isinstance(value, tuple):
+                value = all_of(*value)
+            if self.normalize:
+                # Expected values are normalized only once.
+                if isinstance(value, MultiValue):
+                    value = value.map(normalize_dn_value)
+                else:
+                    value = normalize_dn_value(value)
+            self.dn_params[n] = (type_, value)
+        # Tens of thousands of predicates share a few attribute types and
+        # values, and usually the same constraints.
+        self.dn_params = _share_params(self.dn_params)
 
         if environ_key is None or len(environ_key) == 0:
             raise ValueError('This predicate requires a WSGI environ key')
 
-        self.environ_key = environ_key
+        self.environ_key = _share(environ_key)
 
     def _prepare_dn_params_with_consistency(self, check_params, kwargs):
         # We prefer common_name over CN, for example
@@ -151,7 +491,7 @@ class X509DNPredicate(X509Predicate):
             if param[1] is not None:
                 self.dn_params.append((param[0], param[1]))
 
-        for param in ('validity_start_key', 'validity_end_key', 'verify_key'):
+        for param in PREDICATE_OPTIONS:
             try:
                 del kwargs[param]
             except:
@@ -172,27 +512,69 @@ class X509DNPredicate(X509Predicate):
         :raise NotAuthorizedError: When the evaluation fails.
         """
         super(X509DNPredicate, self).evaluate(environ, credentials)
+        self._match_dn(environ)
 
+    def _match_dn(self, environ):
         # First let's try with Apache-like server variables, and last rely on
         # the parsing of the DN itself.
-        try:
-            for suffix, value in self.dn_params:
-                self._check_server_variable(environ, '_' + suffix, value)
-        except KeyError:
-            pass
-        else:
+        if self._match_server_variables(environ):
             # Every environ variable is valid
             return
 
-        dn = environ.get(self.environ_key)
+        dn = self.source.get(environ, self.environ_key)
         if dn is None:
             self.unmet()
 
         try:
-            parsed_dn = parse_dn(dn)
+            parsed_dn = self._parse_dn(environ, dn)
         except:
             self.unmet()
-        
+
+        self._match_parsed_dn(environ, parsed_dn)
+
+    def _certificate_identity(self, environ):
+        dn = self.source.get(environ, self.environ_key)
+        if dn is None:
+            # Only server variables, which are not worth hashing.
+            return None
+        return self._validity_identity(environ) + (dn,)
+
+    def _match_server_variables(self, environ):
+        # Returns False if any of the server variables is not present.
+        try:
+            for suffix, value in self.dn_params:
+                self._check_server_variable(environ, '_' + suffix, value)
+        except KeyError:
+            return False
+        return True
+
+    def _parse_dn(self, environ, dn):
+        # Parsed (and normalized) only once per request.
+        cache = environ.get(ENVIRON_PARSED_KEY)
+        if cache is None:
+            cache = environ[ENVIRON_PARSED_KEY] = {}
+        key = (dn, self.normalize)
+        try:
+            parsed = cache[key]
+        except KeyError:
+            try:
+                parsed = parse_dn(dn)
+            except Exception:
+                parsed = None
+            else:
+                normalize = normalize_dn_value if self.normalize else None
+                parsed = dict([
+                    (type_, frozenset(map(normalize, values) if normalize
+                                      else values))
+                    for type_, values in parsed.iteritems()
+                ])
+            cache[key] = parsed
+
+        if parsed is None:
+            raise ValueError('Invalid DN')
+        return parsed
+
+    def _match_parsed_dn(self, environ, parsed_dn):
         try:
             for key, value in self.dn_params:
                 self._check_parsed_dict(parsed_dn, key, value)
@@ -200,29 +582,68 @@ class X509DNPredicate(X509Predicate):
             self.unmet()
 
     def _check_parsed_dict(self, parsed, key, value):
-        parsed_value = parsed[key]
-        if isinstance(value, list) or isinstance(value, tuple):
-            for v in value:
-                if v not in parsed_value:
-                    self.unmet()
-        
-        elif value not in parsed_value:
+        if isinstance(value, MultiValue):
+            if not value.matches(parsed.get(key, _EMPTY)):
+                self.unmet()
+
+        elif value not in parsed[key]:
             self.unmet()
 
     def _check_server_variable(self, environ, suffix, value):
         key = self.environ_key + suffix
-        if isinstance(value, list) or isinstance(value, tuple):
-            environ_values = []
-            for n in range(len(value)):
-                environ_values.append(environ[key + '_' + str(n)])
-
-            for v in value:
-                if v not in environ_values:
-                    self.unmet()
+        if isinstance(value, MultiValue):
+            if not value.matches(self._get_indexed_variables(environ, key)):
+                self.unmet()
 
-        elif environ[key] != value:
+        elif self._get_server_variable(environ, key) != value:
             self.unmet()
 
+    def _get_server_variable(self, environ, key):
+        value = self.source.get(environ, key)
+        if value is None:
+            raise KeyError(key)
+        if self.normalize:
+            cache = environ.get(ENVIRON_PARSED_KEY)
+            if cache is None:
+                cache = environ[ENVIRON_PARSED_KEY] = {}
+            try:
+                value = cache[('variable', value)]
+            except KeyError:
+                value = cache[('variable', value)] = normalize_dn_value(value)
+        return value
+
+    def _get_indexed_variables(self, environ, key):
+        # Every value of a multi-valued attribute type: the variable itself
+        # and the ones suffixed by an index (_0, _1, ...). They are discovered
+        # only once per request and source.
+        values = self.source._memoize(environ,
+                                      ('indexed', key, self.normalize),
+                                      self._find_indexed_variables, key)
+        if values is None:
+            raise KeyError(key)
+        return values
+
+    def _find_indexed_variables(self, environ, key):
+        source = self.source
+        values = []
+        value = source.get(environ, key)
+        if value is not None:
+            values.append(value)
+        n = 0
+        while True:
+            value = source.get(environ, '%s_%d' % (key, n))
+            if value is not None:
+                values.append(value)
+            elif n > 0:
+                # mod_ssl may start the indexes at 1
+                break
+            n += 1
+        if len(values) == 0:
+            return None
+        if self.normalize:
+            return frozenset([normalize_dn_value(v) for v in values])
+        return frozenset(values)
+
 class is_issuer(X509DNPredicate):
     """
     Represents a predicate that evaluates the issuer distinguished name.
@@ -271,3 +692,85 @@ class is_subject(X509DNPredicate):
             **kwargs
         )
 
+
+class is_client(X509Predicate):
+    """
+    Represents a predicate that evaluates both the subject and the issuer
+    distinguished names of the client certificate. It is met under the same
+    conditions as ``All(is_subject(...), is_issuer(...))``, but the
+    certificate is verified only once. Each name is still parsed and matched
+    on its own.
+    """
+
+    message = 'Invalid SSL client %(side)s.'
+
+    def __init__(self, subject=None, issuer=None, subject_key=None,
+                 issuer_key=None, **kwargs):
+        """
+        :param subject: A dictionary with the arguments of
+            :py:class:`is_subject` that the subject must match (e.g.
+            ``{'common_name': 'John Smith'}``).
+        :param issuer: A dictionary with the arguments of
+            :py:class:`is_issuer` that the issuer must match.
+        :param subject_key: The WSGI environment key of the subject
+            distinguished name.
+        :param issuer_key: The WSGI environment key of the issuer
+            distinguished name.
+        :param kwargs: The options of :py:class:`X509Predicate`. The
+            ``normalize`` and ``log`` options apply to both names.
+
+        :raise ValueError: When neither a subject nor an issuer are specified,
+            or when any of them is invalid for its predicate.
+        """
+        if not subject and not issuer:
+            raise ValueError('At least a subject or an issuer must be '
+                             'specified')
+
+        options = dict([(option, kwargs[option]) for option in
+                        ('normalize', 'log', 'source') if option in kwargs])
+        super(is_client, self).__init__(**kwargs)
+
+        sides = []
+        if subject:
+            sides.append((
+                'subject',
+                is_subject(subject_key=subject_key,
+                           **dict(options, **subject))
+            ))
+        if issuer:
+            sides.append((
+                'issuer',
+                is_issuer(issuer_key=issuer_key, **dict(options, **issuer))
+            ))
+        self.sides = tuple(sides)
+
+    def evaluate(self, environ, credentials):
+        """
+        Evaluates the subject and the issuer distinguished names of a valid
+        client certificate.
+
+        :param environ: The WSGI environment.
+        :param credentials: The user credentials. This parameter is not used.
+
+        :raise NotAuthorizedError: When the evaluation fails. The message says
+            which name did not match.
+        """
+        super(is_client, self).evaluate(environ, credentials)
+        for side, predicate in self.sides:
+            try:
+                predicate._match_dn(environ)
+            except NotAuthorizedError:
+                self.unmet(side=side)
+
+    def unmet(self, msg=None, **placeholders):
+        placeholders.setdefault('side', 'certificate')
+        super(is_client, self).unmet(msg, **placeholders)
+
+    def _certificate_identity(self, environ):
+        identity = self._validity_identity(environ)
+        for side, predicate in self.sides:
+            dn = self.source.get(environ, predicate.environ_key)
+            if dn is None:
+                return None
+            identity += (dn,)
+        return identity
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the predicate that throttles individual client
+certificates, and the table of token buckets that it uses.
+
+The table is a fixed-size memory map, either anonymous (and therefore shared
+with the processes forked after its creation, e.g. the workers of a prefork
+server) or backed by a file that every process of the host maps.
+"""
+from hashlib import md5
+import errno
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from .predicates import X509Predicate
+from .sources import CERT_KEY
+
+
+__all__ = ['x509_rate_limited', 'RateLimitTable']
+
+
+# The environ key where the buckets consumed during a request are kept, so
+# that every request takes at most one token from each bucket.
+ENVIRON_CONSUMED_KEY = 'repoze.what.x509.consumed'
+
+
+_MAGIC = 'X509RLT1'
+# Magic and number of slots.
+_HEADER = struct.Struct('<8sQ')
+# Key, tokens left and time of the last update.
+_SLOT = struct.Struct('<Qdd')
+_KEY = struct.Struct('<Q')
+
+_HEADER_SIZE = _HEADER.size
+_SLOT_SIZE = _SLOT.size
+_unpack_slot = _SLOT.unpack_from
+_pack_slot = _SLOT.pack_into
+
+# Keys are kept below 2 ** 63, so they are plain integers.
+_KEY_MASK = (1 << 63) - 1
+
+# The number of slots probed for a key before evicting the least recently
+# updated one.
+PROBES = 8
+
+# The number of hashes of distinguished names kept by every predicate.
+KEY_CACHE_SIZE = 10000
+
+
+class RateLimitTable(object):
+    """
+    A fixed-size table of token buckets in shared memory, indexed by 64-bit
+    keys with open addressing. A key is looked for in a few consecutive
+    slots; when they are all taken, the least recently updated bucket is
+    evicted, so a lookup never probes more than :py:data:`PROBES` slots.
+
+    The buckets are updated without locks. Concurrent updates of the same
+    bucket from several processes may overwrite each other, which at most
+    lets through one more request per concurrent process.
+    """
+
+    def __init__(self, path=None, slots=65536, timer=None):
+        """
+        :param path: The path of the file that backs the table, which is
+            created if it does not exist. By default the table is anonymous
+            and only shared with the processes forked after its creation.
+        :param slots: The number of buckets of the table. If the file already
+            exists its number of slots is used instead.
+        :param timer: A callable that returns the current time in seconds. By
+            default it is :py:func:`time.time`.
+
+        :raise ValueError: When the number of slots is not positive, or when
+            the file is not a valid table.
+        """
+        if slots <= 0:
+            raise ValueError('The number of slots must be positive')
+        self.timer = timer or time.time
+        self.evictions = 0
+        if path is None:
+            self._map = mmap.mmap(-1, _HEADER.size + slots * _SLOT.size)
+            _HEADER.pack_into(self._map, 0, _MAGIC, slots)
+        else:
+            self._map = self._open(path, slots)
+            magic, slots = _HEADER.unpack_from(self._map)
+            if magic != _MAGIC or \
+               len(self._map) != _HEADER.size + slots * _SLOT.size:
+                self._map.close()
+                raise ValueError('Invalid rate limit table: %s' % path)
+        self.slots = slots
+
+    def _open(self, path, slots):
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except OSError, error:
+            if error.errno != errno.ENOENT:
+                raise
+            self._create(path, slots)
+            fd = os.open(path, os.O_RDWR)
+        try:
+            if os.fstat(fd).st_size < _HEADER.size:
+                raise ValueError('Invalid rate limit table: %s' % path)
+            return mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+
+    def _create(self, path, slots):
+        # The table is written aside and linked into place, so no process
+        # maps it half written; when several processes create it at once,
+        # the first one to link it wins and the others use its table.
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.',
+                                        dir=os.path.dirname(path) or '.')
+        try:
+            os.write(fd, _HEADER.pack(_MAGIC, slots))
+            os.ftruncate(fd, _HEADER.size + slots * _SLOT.size)
+            try:
+                os.link(tmp_path, path)
+            except OSError, error:
+                if error.errno != errno.EEXIST:
+                    raise
+        finally:
+            os.close(fd)
+            os.unlink(tmp_path)
+
+    def consume(self, key, rate, burst, tokens=1):
+        """
+        Takes tokens from the bucket of a key, after refilling it for the
+        time elapsed since its last update.
+
+        :param key: The key of the bucket, a positive integer below
+            ``2 ** 63``.
+        :param rate: The tokens added to the bucket per second.
+        :param burst: The capacity of the bucket. A new bucket is full.
+        :param tokens: The tokens to take.
+
+        :return: Whether the bucket had enough tokens.
+        """
+        now = self.timer()
+        data = self._map
+        index = key % self.slots
+        offset = _HEADER_SIZE + index * _SLOT_SIZE
+        slot_key, level, updated = _unpack_slot(data, offset)
+        if slot_key != key:
+            offset, level, updated = self._probe(data, key, index, burst, now)
+        if now > updated:
+            level += (now - updated) * rate
+        if not 0.0 <= level <= burst:
+            # Full, or overwritten halfway by another process.
+            level = burst
+
+        if level < tokens:
+            _pack_slot(data, offset, key, level, now)
+            return False
+        _pack_slot(data, offset, key, level - tokens, now)
+        return True
+
+    def _probe(self, data, key, index, burst, now):
+        # The slot of a key that is not in its first slot, with its bucket.
+        slots = self.slots
+        oldest = victim = None
+        for _ in xrange(PROBES):
+            offset = _HEADER_SIZE + index * _SLOT_SIZE
+            slot_key, level, updated = _unpack_slot(data, offset)
+            if slot_key == key:
+                return offset, level, updated
+            if slot_key == 0:
+                return offset, burst, now
+            if oldest is None or updated < oldest:
+                oldest, victim = updated, offset
+            index = (index + 1) % slots
+        self.evictions += 1
+        return victim, burst, now
+
+    def __len__(self):
+        # The buckets in use.
+        data = self._map
+        offsets = xrange(_HEADER.size, len(data), _SLOT.size)
+        return sum([1 for offset in offsets
+                    if _KEY.unpack_from(data, offset)[0]])
+
+    def clear(self):
+        """
+        Empties every bucket.
+        """
+        self._map[_HEADER.size:] = '\0' * (self.slots * _SLOT.size)
+
+    def close(self):
+        """
+        Unmaps the table.
+        """
+        self._map.close()
+
+
+_DEFAULT_TABLE = None
+
+
+def _get_default_table():
+    # Created on first use; create it before forking to share it.
+    global _DEFAULT_TABLE
+    if _DEFAULT_TABLE is None:
+        _DEFAULT_TABLE = RateLimitTable()
+    return _DEFAULT_TABLE
+
+
+class x509_rate_limited(X509Predicate):
+    """
+    Represents a predicate that throttles every client certificate, by its
+    subject distinguished name or by its fingerprint, with a token bucket in
+    a :py:class:`RateLimitTable`.
+    """
+
+    message = 'SSL client certificate rate limit exceeded.'
+    # Every request must take a token.
+    cacheable = False
+
+    def __init__(self, rate, burst=None, by='subject', table=None,
+                 namespace=None, subject_key=None, cert_key=None, **kwargs):
+        """
+        :param rate: The number of requests per second allowed to every
+            certificate.
+        :param burst: The number of requests allowed at once. By default it
+            is the rate (but at least one).
+        :param by: What identifies a certificate: ``subject`` for its subject
+            distinguished name, or ``fingerprint`` for the SHA-256 fingerprint
+            of the certificate.
+        :param table: The :py:class:`RateLimitTable`. By default it is an
+            anonymous table of the process, created when the first predicate
+            is created.
+        :param namespace: What distinguishes the buckets of this predicate
+            from the ones of other predicates in the same table. By default
+            predicates with the same rate and burst share the buckets.
+        :param subject_key: The WSGI environment key of the subject
+            distinguished name.
+        :param cert_key: The WSGI environment key of the PEM encoded client
+            certificate. By default it is ``SSL_CLIENT_CERT``.
+
+        :raise ValueError: When the rate is not positive, or when ``by`` is
+            unknown.
+        """
+        super(x509_rate_limited, self).__init__(**kwargs)
+        if rate <= 0:
+            raise ValueError('The rate must be positive')
+        if by not in ('subject', 'fingerprint'):
+            raise ValueError('Unknown identification of certificates: %r' % by)
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.by = by
+        self.table = table if table is not None else _get_default_table()
+        if namespace is None:
+            namespace = '%r/%r' % (self.rate, self.burst)
+        self._namespace = _KEY.unpack(md5(namespace).digest()[:_KEY.size])[0]
+        self.subject_key = subject_key or 'SSL_CLIENT_S_DN'
+        self.cert_key = cert_key or CERT_KEY
+        self._keys = {}
+
+    def evaluate(self, environ, credentials):
+        """
+        Takes a token from the bucket of the client certificate, once per
+        request: further evaluations in the same request (even by other
+        predicates that share the bucket) reuse the first outcome.
+
+        :param environ: The WSGI environment.
+        :param credentials: The user credentials. This parameter is not used.
+
+        :raise NotAuthorizedError: When the certificate is not valid, cannot
+            be identified, or exceeded its rate.
+        """
+        super(x509_rate_limited, self).evaluate(environ, credentials)
+        key = self._bucket_key(environ)
+        if key is None:
+            self.unmet()
+        consumed = environ.get(ENVIRON_CONSUMED_KEY)
+        if consumed is None:
+            consumed = environ[ENVIRON_CONSUMED_KEY] = {}
+        bucket = (id(self.table), key)
+        allowed = consumed.get(bucket)
+        if allowed is None:
+            allowed = consumed[bucket] = self.table.consume(key, self.rate,
+                                                            self.burst)
+        if not allowed:
+            self.unmet()
+
+    def _bucket_key(self, environ):
+        if self.by == 'fingerprint':
+            try:
+                fingerprint = self.source.get_fingerprint(environ,
+                                                          self.cert_key)
+            except ValueError:
+                return None
+            if fingerprint is None:
+                return None
+            # It is already a uniformly distributed hash.
+            return self._namespaced(_KEY.unpack_from(fingerprint)[0])
+
+        dn = self.source.get(environ, self.subject_key)
+        if dn is None:
+            return None
+        keys = self._keys
+        key = keys.get(dn)
+        if key is None:
+            if len(keys) >= KEY_CACHE_SIZE:
+                keys.clear()
+            key = keys[dn] = self._namespaced(
+                _KEY.unpack(md5(dn).digest()[:_KEY.size])[0]
+            )
+        return key
+
+    def _namespaced(self, key):
+        return ((key ^ self._namespace) & _KEY_MASK) or 1
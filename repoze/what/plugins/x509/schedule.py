@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the weekly schedules that restrict when a client
+certificate may be used, compiled into a bitmap with one bit per minute of the
+week.
+"""
+from datetime import datetime
+from dateutil.tz import gettz, tzutc
+import re
+
+
+__all__ = ['Schedule', 'MINUTES_PER_WEEK']
+
+
+MINUTES_PER_DAY = 24 * 60
+
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# The epoch (1970-01-01) was a Thursday, and the weeks start on Monday.
+_EPOCH_MINUTE_OF_WEEK = 3 * MINUTES_PER_DAY
+
+# The UTC offset is computed again only when the clock leaves the quarter of
+# an hour it was computed for, which is when it may have changed.
+_OFFSET_PERIOD = 15 * 60
+
+_WINDOW_REGEX = re.compile(
+    r'^\s*(?P<days>\S+)\s+(?P<start>\d{1,2}:\d{2})\s*-\s*'
+    r'(?P<end>\d{1,2}:\d{2})\s*$'
+)
+
+
+def _parse_days(days):
+    # "*", "Mon", "Mon-Fri", "Sat,Sun" or "Mon-Wed,Fri"
+    if days == '*':
+        return range(7)
+    result = []
+    for part in days.lower().split(','):
+        first, _, last = part.partition('-')
+        try:
+            first = DAYS.index(first[:3])
+            last = DAYS.index(last[:3]) if last else first
+        except ValueError:
+            raise ValueError('Invalid days: %r' % days)
+        if last < first:
+            # e.g. Sat-Mon
+            last += 7
+        result.extend([day % 7 for day in range(first, last + 1)])
+    return result
+
+
+def _parse_time(value, window):
+    hours, minutes = map(int, value.split(':'))
+    if minutes > 59 or hours > 24 or (hours == 24 and minutes > 0):
+        raise ValueError('Invalid time in window: %r' % window)
+    return hours * 60 + minutes
+
+
+class Schedule(object):
+    """
+    A weekly schedule, e.g. business hours or maintenance windows, in a given
+    timezone. It is compiled into a bitmap with one bit per minute of the
+    week, so checking whether a time is within the schedule is a single bit
+    test.
+    """
+
+    def __init__(self, windows, tz=None):
+        """
+        :param windows: The windows of the schedule, as strings with the days
+            and the range of hours, e.g. ``Mon-Fri 09:00-17:00``,
+            ``Sat,Sun 10:00-14:00`` or ``* 02:00-03:00`` (every day). The end
+            is excluded, and a window whose end is before its start finishes
+            on the next day (e.g. ``Fri 22:00-06:00``).
+        :param tz: The timezone of the windows, either a ``tzinfo`` or its
+            name (e.g. ``America/Mexico_City``). By default it is UTC.
+
+        :raise ValueError: When a window or the timezone is invalid.
+        """
+        if isinstance(tz, basestring):
+            name = tz
+            tz = gettz(name)
+            if tz is None:
+                raise ValueError('Unknown timezone: %r' % name)
+        self.tz = tz or tzutc()
+        self._bits = bytearray(MINUTES_PER_WEEK // 8)
+        # The quarter of an hour and its UTC offset in seconds.
+        self._offset = (None, 0)
+        if isinstance(windows, basestring):
+            windows = [windows]
+        for window in windows:
+            self.add(window)
+
+    def add(self, window):
+        """
+        Adds a window to the schedule.
+
+        :param window: The window (see :py:meth:`__init__`).
+
+        :raise ValueError: When the window is invalid.
+        """
+        match = _WINDOW_REGEX.match(window)
+        if match is None:
+            raise ValueError('Invalid window: %r' % window)
+        start = _parse_time(match.group('start'), window)
+        end = _parse_time(match.group('end'), window)
+        if end <= start:
+            end += MINUTES_PER_DAY
+        bits = self._bits
+        for day in _parse_days(match.group('days')):
+            offset = day * MINUTES_PER_DAY
+            for minute in xrange(offset + start, offset + end):
+                minute %= MINUTES_PER_WEEK
+                bits[minute >> 3] |= 1 << (minute & 7)
+
+    def minute_of_week(self, now):
+        """
+        Gets the minute of the week (0 is Monday at 00:00) of a time in the
+        timezone of the schedule.
+
+        :param now: The time in seconds since the epoch.
+        """
+        quarter, offset = self._offset
+        if quarter != now // _OFFSET_PERIOD:
+            quarter = now // _OFFSET_PERIOD
+            delta = datetime.fromtimestamp(now, self.tz).utcoffset()
+            offset = delta.days * 86400 + delta.seconds
+            # A race between threads only means that both will compute it.
+            self._offset = (quarter, offset)
+        return ((now + offset) // 60 + _EPOCH_MINUTE_OF_WEEK) % \
+               MINUTES_PER_WEEK
+
+    def allows(self, now):
+        """
+        Checks whether a time is within the schedule.
+
+        :param now: The time in seconds since the epoch.
+        """
+        minute = self.minute_of_week(int(now))
+        return bool(self._bits[minute >> 3] & (1 << (minute & 7)))
+
+    def __len__(self):
+        # The minutes of the week within the schedule.
+        return sum([bin(byte).count('1') for byte in self._bits])
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the predicate that allows the client certificates whose
+serial numbers are within a set of ranges (e.g. the ranges issued by a CA per
+environment or per batch), and the compact files that hold large sets of such
+ranges.
+
+A serial file has a header and the merged ranges, sorted, as pairs of
+fixed-width big-endian integers.
+"""
+from binascii import hexlify, unhexlify
+from bisect import bisect_right
+import os
+import struct
+
+from .predicates import X509Predicate
+
+
+__all__ = ['is_serial_in', 'SerialRanges', 'write_serial_file',
+           'parse_serial', 'SERIAL_KEY']
+
+
+SERIAL_KEY = 'SSL_CLIENT_M_SERIAL'
+
+_MAGIC = 'X509SER1'
+# Magic, number of ranges, bytes per bound.
+_HEADER = struct.Struct('>8sQI')
+
+
+def parse_serial(serial):
+    """
+    Converts a serial number into an integer.
+
+    :param serial: The serial number, either an integer or its hexadecimal
+        representation as given by ``mod_ssl`` (optionally separated by colons
+        or prefixed by ``0x``).
+
+    :raise ValueError: When it is not a valid serial number.
+    """
+    if isinstance(serial, (int, long)):
+        value = serial
+    else:
+        serial = serial.strip().replace(':', '')
+        if serial[:2].lower() == '0x':
+            serial = serial[2:]
+        try:
+            value = int(serial, 16)
+        except ValueError:
+            raise ValueError('Invalid serial number: %r' % serial)
+    if value < 0:
+        raise ValueError('Invalid serial number: negative')
+    return value
+
+
+def _parse_range(value):
+    # A serial number, a (low, high) tuple, or a "low-high" string.
+    if isinstance(value, basestring) and '-' in value:
+        value = value.split('-', 1)
+    if isinstance(value, (tuple, list)):
+        low, high = [parse_serial(v) for v in value]
+        if high < low:
+            raise ValueError('Invalid range of serial numbers: %r' % (value,))
+        return low, high
+    value = parse_serial(value)
+    return value, value
+
+
+def _merge(ranges):
+    # The sorted ranges, merging the ones that overlap or are adjacent.
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            if high > merged[-1][1]:
+                merged[-1][1] = high
+        else:
+            merged.append([low, high])
+    return merged
+
+
+class SerialRanges(object):
+    """
+    A set of ranges of serial numbers, merged and sorted so that looking up a
+    serial number is a binary search.
+    """
+
+    def __init__(self, ranges=()):
+        """
+        :param ranges: An iterable of serial numbers (see
+            :py:func:`parse_serial`), ``(low, high)`` tuples, or ``low-high``
+            strings in hexadecimal. Both ends are included.
+
+        :raise ValueError: When any of the ranges is invalid.
+        """
+        merged = _merge([_parse_range(r) for r in ranges])
+        self._starts = [low for low, high in merged]
+        self._ends = [high for low, high in merged]
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads the ranges from a serial file.
+
+        :param path: The path of the file, as written by
+            :py:func:`write_serial_file`.
+
+        :raise ValueError: When the file is not a valid serial file.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < _HEADER.size:
+            raise ValueError('Invalid serial file: truncated')
+        magic, count, width = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError('Invalid serial file: unknown format')
+        if len(data) != _HEADER.size + count * 2 * width:
+            raise ValueError('Invalid serial file: truncated')
+
+        ranges = cls()
+        bounds = [long(hexlify(data[offset:offset + width]), 16)
+                  for offset in xrange(_HEADER.size, len(data), width)]
+        # Already merged and sorted.
+        ranges._starts = bounds[0::2]
+        ranges._ends = bounds[1::2]
+        return ranges
+
+    def __contains__(self, serial):
+        index = bisect_right(self._starts, serial) - 1
+        return index >= 0 and serial <= self._ends[index]
+
+    def __len__(self):
+        # The number of (merged) ranges.
+        return len(self._starts)
+
+    def __iter__(self):
+        return iter(zip(self._starts, self._ends))
+
+
+def write_serial_file(path, ranges):
+    """
+    Writes a serial file.
+
+    :param path: The path of the file.
+    :param ranges: A :py:class:`SerialRanges`, or an iterable of ranges (see
+        :py:class:`SerialRanges`).
+
+    :return: The number of ranges written, once merged.
+    """
+    if not isinstance(ranges, SerialRanges):
+        ranges = SerialRanges(ranges)
+    ranges = list(ranges)
+    largest = max([high for low, high in ranges] or [0])
+    width = max(1, (largest.bit_length() + 7) // 8)
+
+    def encode(n):
+        return unhexlify('%0*x' % (width * 2, n))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, len(ranges), width))
+        for low, high in ranges:
+            f.write(encode(low))
+            f.write(encode(high))
+    os.rename(tmp_path, path)
+    return len(ranges)
+
+
+class is_serial_in(X509Predicate):
+    """
+    Represents a predicate that checks that the serial number of the client
+    certificate is within a set of ranges.
+    """
+
+    message = 'Invalid SSL client certificate serial number.'
+
+    def __init__(self, ranges, serial_key=None, **kwargs):
+        """
+        :param ranges: The ranges of serial numbers that are allowed. Either a
+            :py:class:`SerialRanges` (e.g. read from a file with
+            :py:meth:`SerialRanges.load`), or an iterable of ranges (see
+            :py:class:`SerialRanges`).
+        :param serial_key: The WSGI environment key of the serial number in
+            hexadecimal. By default it is ``SSL_CLIENT_M_SERIAL``.
+
+        :raise ValueError: When any of the ranges is invalid.
+        """
+        super(is_serial_in, self).__init__(**kwargs)
+        if not isinstance(ranges, SerialRanges):
+            ranges = SerialRanges(ranges)
+        self.ranges = ranges
+        self.serial_key = serial_key or SERIAL_KEY
+
+    def _certificate_identity(self, environ):
+        serial = self.source.get(environ, self.serial_key)
+        if serial is None:
+            return None
+        return self._validity_identity(environ) + (serial,)
+
+    def evaluate(self, environ, credentials):
+        """
+        Evaluates the serial number of the client certificate. It is
+        converted only once per request.
+
+        :param environ: The WSGI environment.
+        :param credentials: The user credentials. This parameter is not used.
+
+        :raise NotAuthorizedError: When the evaluation fails.
+        """
+        super(is_serial_in, self).evaluate(environ, credentials)
+        serial = self._serial(environ)
+        if serial is None or serial not in self.ranges:
+            self.unmet()
+
+    def _serial(self, environ):
+        return self.source._memoize(environ, ('serial', self.serial_key),
+                                    self._parse_serial, self.serial_key)
+
+    def _parse_serial(self, environ, key):
+        value = self.source.get(environ, key)
+        try:
+            return None if value is None else parse_serial(value)
+        except ValueError:
+            return None
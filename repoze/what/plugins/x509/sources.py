@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+This module contains the sources from which the predicates read the client
+certificate variables: either the WSGI environment as set by the web server
+(e.g. ``mod_ssl``), or the HTTP headers forwarded by a reverse proxy.
+"""
+from repoze.who.plugins.x509.utils import VALIDITY_START_KEY, \
+     VALIDITY_END_KEY
+from urllib import unquote
+import base64
+import hashlib
+import re
+
+from .clock import validity_window
+from .der import Certificate
+
+
+__all__ = ['EnvironSource', 'HeaderSource', 'decode_certificate',
+           'CERT_KEY']
+
+
+CERT_KEY = 'SSL_CLIENT_CERT'
+
+# The environ key where the values decoded during a request are kept.
+ENVIRON_DECODED_KEY = 'repoze.what.x509.decoded'
+
+_PEM_BEGIN = '-----BEGIN CERTIFICATE-----'
+_PEM_END = '-----END CERTIFICATE-----'
+_WHITESPACE_REGEX = re.compile(r'\s+')
+
+ENCODINGS = ('url', 'base64', 'tab', 'plain')
+
+
+def decode_certificate(value, encoding=None):
+    """
+    Decodes a certificate as forwarded by a web server or a reverse proxy into
+    a PEM encoded certificate.
+
+    :param value: The encoded certificate.
+    :param encoding: How the certificate is encoded: ``url`` for an URL
+        encoded PEM, ``base64`` for a base64 encoded DER, ``tab`` for a PEM
+        whose lines are joined by tabs (or any other whitespace), and ``plain``
+        for a PEM. If it is not specified it will be detected.
+
+    :raise ValueError: When the certificate cannot be decoded.
+    """
+    if encoding == 'url' or (encoding is None and '%' in value):
+        value = unquote(value)
+
+    begin = value.find(_PEM_BEGIN)
+    if begin == -1:
+        if encoding not in (None, 'base64'):
+            raise ValueError('Invalid certificate: not PEM encoded')
+        body = value
+    else:
+        end = value.find(_PEM_END, begin)
+        if end == -1:
+            raise ValueError('Invalid certificate: incomplete PEM')
+        body = value[begin + len(_PEM_BEGIN):end]
+
+    # Either the lines were joined, or it was a single base64 line, so it is
+    # normalized in lines of 64 characters.
+    body = _WHITESPACE_REGEX.sub('', body)
+    if len(body) == 0:
+        raise ValueError('Invalid certificate: empty')
+    lines = [body[i:i + 64] for i in range(0, len(body), 64)]
+    return '\n'.join([_PEM_BEGIN] + lines + [_PEM_END]) + '\n'
+
+
+def _pem_to_der(pem):
+    body = pem[len(_PEM_BEGIN):pem.rindex(_PEM_END)]
+    try:
+        return base64.b64decode(body)
+    except TypeError:
+        raise ValueError('Invalid certificate: invalid base64')
+
+
+class EnvironSource(object):
+    """
+    Reads the client certificate variables straight from the WSGI environment
+    (e.g. as set by ``mod_ssl`` with ``mod_wsgi``).
+    """
+
+    # The configuration that sets the values decoded by this source apart
+    # from the ones decoded by other sources of the same class.
+    _config = ()
+
+    def get(self, environ, key, default=None):
+        """
+        Gets the value of a client certificate variable.
+
+        :param environ: The WSGI environment.
+        :param key: The name of the variable, e.g. ``SSL_CLIENT_S_DN``.
+        :param default: The value returned if the variable is not present.
+        """
+        return environ.get(key, default)
+
+    def get_validity(self, environ, start_key=VALIDITY_START_KEY,
+                     end_key=VALIDITY_END_KEY):
+        """
+        Gets the validity range of the client certificate.
+
+        :param environ: The WSGI environment.
+        :param start_key: The name of the variable with the start of the
+            range.
+        :param end_key: The name of the variable with the end of the range.
+
+        :return: A tuple with the start and the end of the range in seconds
+            since the epoch, or ``None`` if it is not present.
+
+        :raise ValueError: When the range cannot be decoded.
+        """
+        start = self.get(environ, start_key)
+        end = self.get(environ, end_key)
+        if start is None or end is None:
+            return None
+        window = validity_window(start, end)
+        if window is None:
+            raise ValueError('Invalid validity range')
+        return window
+
+    def get_pem(self, environ, key=CERT_KEY):
+        """
+        Gets the PEM encoded client certificate, normalized. The result is kept
+        in the WSGI environment for the rest of the request.
+
+        :param environ: The WSGI environment.
+        :param key: The name of the variable with the certificate.
+
+        :return: The PEM encoded certificate, or ``None`` if it is not present.
+
+        :raise ValueError: When the certificate cannot be decoded.
+        """
+        return self._memoize(environ, ('pem', key), self._decode_pem, key)
+
+    def get_der(self, environ, key=CERT_KEY):
+        """
+        Gets the DER encoded client certificate. The result is kept in the
+        WSGI environment for the rest of the request.
+
+        :param environ: The WSGI environment.
+        :param key: The name of the variable with the certificate.
+
+        :return: The DER encoded certificate, or ``None`` if it is not present.
+
+        :raise ValueError: When the certificate cannot be decoded.
+        """
+        return self._memoize(environ, ('der', key), self._decode_der, key)
+
+    def get_certificate(self, environ, key=CERT_KEY):
+        """
+        Gets the decoded client certificate. The result is kept in the WSGI
+        environment for the rest of the request.
+
+        :param environ: The WSGI environment.
+        :param key: The name of the variable with the certificate.
+
+        :return: The :py:class:`Certificate`, or ``None`` if it is not present.
+
+        :raise ValueError: When the certificate cannot be decoded.
+        """
+        return self._memoize(environ, ('certificate', key),
+                             self._decode_certificate, key)
+
+    def get_fingerprint(self, environ, key=CERT_KEY, spki=False):
+        """
+        Gets the SHA-256 digest of the client certificate, or of its subject
+        public key info. The result is kept in the WSGI environment for the
+        rest of the request.
+
+        :param environ: The WSGI environment.
+        :param key: The name of the variable with the certificate.
+        :param spki: If true, the digest is of the subject public key info
+            instead of the whole certificate.
+
+        :return: The binary digest, or ``None`` if there is no certificate.
+
+        :raise ValueError: When the certificate cannot be decoded.
+        """
+        if spki:
+            return self._memoize(environ, ('spki-sha256', key),
+                                 self._spki_fingerprint, key)
+        return self._memoize(environ, ('sha256', key), self._fingerprint, key)
+
+    def _decode_pem(self, environ, key):
+        value = environ.get(key)
+        if value is None:
+            return None
+        return decode_certificate(value, 'plain')
+
+    def _decode_der(self, environ, key):
+        pem = self.get_pem(environ, key)
+        if pem is None:
+            return None
+        return _pem_to_der(pem)
+
+    def _decode_certificate(self, environ, key):
+        der = self.get_der(environ, key)
+        if der is None:
+            return None
+        return Certificate(der)
+
+    def _fingerprint(self, environ, key):
+        der = self.get_der(environ, key)
+        if der is None:
+            return None
+        return hashlib.sha256(der).digest()
+
+    def _spki_fingerprint(self, environ, key):
+        certificate = self.get_certificate(environ, key)
+        if certificate is None:
+            return None
+        return hashlib.sha256(certificate.spki).digest()
+
+    def _memoize(self, environ, name, function, key):
+        # Every source of the request shares the dictionary, so the values are
+        # kept by source too.
+        decoded = environ.get(ENVIRON_DECODED_KEY)
+        if decoded is None:
+            decoded = environ[ENVIRON_DECODED_KEY] = {}
+        name = (self.__class__, self._config, name)
+        try:
+            return decoded[name]
+        except KeyError:
+            value = decoded[name] = function(environ, key)
+            return value
+
+
+class HeaderSource(EnvironSource):
+    """
+    Reads the client certificate variables directly from the HTTP headers
+    forwarded by a reverse proxy, e.g. ``HTTP_SSL_CLIENT_S_DN`` for
+    ``SSL_CLIENT_S_DN``, so there is no need of a middleware that copies them.
+    Values are decoded lazily, only when a predicate reads them, and once per
+    request.
+    """
+
+    def __init__(self, prefix='HTTP_', encoding=None):
+        """
+        :param prefix: The prefix of the WSGI environment keys of the headers.
+        :param encoding: How the certificates are encoded by the proxy. See
+            :py:func:`decode_certificate`. If it is not specified it will be
+            detected. Any other value is URL decoded unless the encoding is
+            ``plain``.
+
+        :raise ValueError: When the encoding is unknown.
+        """
+        if encoding is not None and encoding not in ENCODINGS:
+            raise ValueError('Unknown encoding: %s' % encoding)
+        self.prefix = prefix
+        self.encoding = encoding
+        self._config = (prefix, encoding)
+
+    def get(self, environ, key, default=None):
+        value = environ.get(self.prefix + key)
+        if value is None:
+            return default
+        if '%' not in value or self.encoding == 'plain':
+            return value
+        return self._memoize(environ, ('header', key), self._unquote, key)
+
+    def _unquote(self, environ, key):
+        return unquote(environ[self.prefix + key])
+
+    def _decode_pem(self, environ, key):
+        value = environ.get(self.prefix + key)
+        if value is None:
+            return None
+        return decode_certificate(value, self.encoding)
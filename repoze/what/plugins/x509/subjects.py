@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the predicate that allows the client certificates whose
+subjects are within a large set of exact distinguished names, and the subject
+table files that hold such sets.
+
+A subject table is a minimal perfect hash of the canonical distinguished
+names, built with the hash and displace method: every name is hashed into a
+bucket, and every bucket has a displacement that sends its names to distinct
+slots. Each slot holds a fingerprint of its name, so the names that are not in
+the table are rejected. A lookup reads one displacement and one fingerprint,
+and a table file is memory-mapped, so it is shared by every process of the
+host.
+"""
+from hashlib import sha1
+import mmap
+import os
+import struct
+
+from repoze.who.plugins.x509.utils import parse_dn
+
+from .predicates import X509Predicate, X509DNPredicate, ENVIRON_PARSED_KEY, \
+     normalize_dn_value
+
+
+__all__ = ['is_subject_in', 'SubjectTable', 'write_subject_table',
+           'canonical_dn']
+
+
+_MAGIC = 'X509PHT1'
+# Magic, number of names (and slots), number of buckets, flags and salt.
+_HEADER = struct.Struct('<8sQQI4s')
+# Bucket, first and second hashes, and fingerprint, out of a SHA-1 digest.
+_DIGEST = struct.Struct('<IIIQ')
+_WORD = struct.Struct('<Q')
+
+_HEADER_SIZE = _HEADER.size
+_unpack_digest = _DIGEST.unpack
+_unpack_word = _WORD.unpack_from
+
+_NORMALIZE = 1
+
+# The average number of names per bucket.
+_LOAD = 2
+# The number of salts tried, and of first displacements per bucket, before
+# giving up.
+_MAX_ATTEMPTS = 32
+_MAX_DISPLACEMENTS = 1024
+
+
+def canonical_dn(dn, normalize=False):
+    """
+    Gets the canonical form of a distinguished name, which does not depend on
+    the order of its attributes.
+
+    :param dn: The distinguished name, either as a string or as a dictionary
+        of attribute types (e.g. ``CN``) and their value or values.
+    :param normalize: If true, the values are normalized (see
+        :py:func:`normalize_dn_value`).
+
+    :return: The canonical form, as an UTF-8 encoded string.
+
+    :raise ValueError: When the distinguished name is invalid.
+    """
+    if isinstance(dn, basestring):
+        try:
+            parsed = parse_dn(dn)
+        except Exception:
+            raise ValueError('Invalid DN: %r' % dn)
+    else:
+        parsed = dict([
+            (type_, [values] if isinstance(values, basestring) else values)
+            for type_, values in dn.iteritems()
+        ])
+    if normalize:
+        parsed = dict([(type_, map(normalize_dn_value, values))
+                       for type_, values in parsed.iteritems()])
+    return _canonical(parsed)
+
+
+def _canonical(parsed):
+    # The sorted, unique "TYPE=value" pairs of a parsed distinguished name.
+    pairs = set()
+    for type_, values in parsed.iteritems():
+        for value in values:
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            pairs.add('%s=%s' % (type_, value))
+    return '\0'.join(sorted(pairs))
+
+
+def _build(keys):
+    # The salt, the displacements and the fingerprints of a minimal perfect
+    # hash of the keys.
+    count = len(keys)
+    buckets = max(1, (count + _LOAD - 1) // _LOAD)
+    for attempt in xrange(_MAX_ATTEMPTS):
+        salt = struct.pack('<I', attempt)
+        hashed = [[] for i in xrange(buckets)]
+        for key in keys:
+            bucket, first, second, fingerprint = _unpack_digest(
+                sha1(salt + key).digest()
+            )
+            hashed[bucket % buckets].append((first % count, second % count,
+                                             fingerprint))
+        placed = _place(hashed, count)
+        if placed is not None:
+            return (salt,) + placed
+    raise ValueError('Cannot build the subject table')
+
+
+def _place(hashed, count):
+    # Places the largest buckets first, while there are many free slots.
+    # Returns None when a bucket cannot be placed with this salt.
+    occupied = bytearray(count)
+    displacements = [0] * len(hashed)
+    fingerprints = [0] * count
+    order = sorted(xrange(len(hashed)), key=lambda b: len(hashed[b]),
+                   reverse=True)
+    free = 0
+    for bucket in order:
+        entries = hashed[bucket]
+        size = len(entries)
+        if size == 0:
+            break
+        if size == 1:
+            # Any free slot will do.
+            while occupied[free]:
+                free += 1
+            first, second, fingerprint = entries[0]
+            displacements[bucket] = (free - first) % count
+            occupied[free] = 1
+            fingerprints[free] = fingerprint
+            continue
+
+        slots = None
+        for d0 in xrange(min(count, _MAX_DISPLACEMENTS)):
+            base = [(first + d0 * second) % count
+                    for first, second, fingerprint in entries]
+            if len(set(base)) < size:
+                continue
+            # Shifting them keeps them distinct.
+            for d1 in xrange(count):
+                for slot in base:
+                    if occupied[(slot + d1) % count]:
+                        break
+                else:
+                    slots = [(slot + d1) % count for slot in base]
+                    break
+            if slots is not None:
+                break
+        if slots is None:
+            return None
+        displacements[bucket] = d0 * count + d1
+        for slot, entry in zip(slots, entries):
+            occupied[slot] = 1
+            fingerprints[slot] = entry[2]
+    return displacements, fingerprints
+
+
+class SubjectTable(object):
+    """
+    A set of exact distinguished names, as a minimal perfect hash table.
+    Looking up a distinguished name takes constant time, and the table takes
+    12 bytes per name (or nothing per process when it is memory-mapped).
+
+    Only a fingerprint of every name is kept, so a name that is not in the
+    table is taken as one of them with a probability of ``2 ** -64``.
+    """
+
+    def __init__(self, subjects=(), normalize=False):
+        """
+        :param subjects: An iterable of distinguished names (see
+            :py:func:`canonical_dn`).
+        :param normalize: If true, the values of the names are normalized
+            both when the table is built and when it is looked up.
+
+        :raise ValueError: When any of the names is invalid.
+        """
+        keys = list(set([canonical_dn(subject, normalize)
+                         for subject in subjects]))
+        count = len(keys)
+        if count:
+            salt, displacements, fingerprints = _build(keys)
+        else:
+            salt, displacements, fingerprints = '\0' * 4, [], []
+        buckets = len(displacements)
+        self._data = ''.join([
+            _HEADER.pack(_MAGIC, count, buckets,
+                         _NORMALIZE if normalize else 0, salt),
+            struct.pack('<%dQ' % buckets, *displacements),
+            struct.pack('<%dQ' % count, *fingerprints),
+        ])
+        self._load_header()
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-maps a subject table file.
+
+        :param path: The path of the file, as written by
+            :py:func:`write_subject_table`.
+
+        :raise ValueError: When the file is not a valid subject table.
+        """
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER_SIZE:
+                raise ValueError('Invalid subject table: truncated')
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        table = cls.__new__(cls)
+        table._data = data
+        try:
+            table._load_header()
+        except ValueError:
+            data.close()
+            raise
+        return table
+
+    def _load_header(self):
+        magic, count, buckets, flags, salt = _HEADER.unpack_from(self._data)
+        if magic != _MAGIC:
+            raise ValueError('Invalid subject table: unknown format')
+        if len(self._data) != _HEADER_SIZE + (buckets + count) * 8:
+            raise ValueError('Invalid subject table: truncated')
+        self.normalize = bool(flags & _NORMALIZE)
+        self._count = count
+        self._buckets = buckets
+        self._salt = salt
+        self._fingerprints = _HEADER_SIZE + buckets * 8
+
+    def close(self):
+        """
+        Unmaps the file of the table, if any.
+        """
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def __contains__(self, subject):
+        try:
+            key = canonical_dn(subject, self.normalize)
+        except ValueError:
+            return False
+        return self._contains_key(key)
+
+    def _contains_key(self, key):
+        count = self._count
+        if not count:
+            return False
+        bucket, first, second, fingerprint = _unpack_digest(
+            sha1(self._salt + key).digest()
+        )
+        data = self._data
+        d0, d1 = divmod(_unpack_word(data, _HEADER_SIZE +
+                                     (bucket % self._buckets) * 8)[0],
+                        count)
+        slot = (first % count + d0 * (second % count) + d1) % count
+        return _unpack_word(data, self._fingerprints + slot * 8)[0] == \
+               fingerprint
+
+    def __len__(self):
+        return self._count
+
+
+def write_subject_table(path, subjects, normalize=False):
+    """
+    Writes a subject table file.
+
+    :param path: The path of the file.
+    :param subjects: A :py:class:`SubjectTable`, or an iterable of
+        distinguished names (see :py:func:`canonical_dn`).
+    :param normalize: If true, the values of the names are normalized. It is
+        ignored when ``subjects`` is a :py:class:`SubjectTable`.
+
+    :return: The number of distinct names written.
+
+    :raise ValueError: When any of the names is invalid.
+    """
+    if not isinstance(subjects, SubjectTable):
+        subjects = SubjectTable(subjects, normalize)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(subjects._data[:])
+    os.rename(tmp_path, path)
+    return len(subjects)
+
+
+class is_subject_in(X509DNPredicate):
+    """
+    Represents a predicate that checks that the subject distinguished name of
+    the client certificate is exactly one of the names of a
+    :py:class:`SubjectTable`, regardless of the order of its attributes.
+    """
+
+    message = 'Invalid SSL client subject.'
+
+    def __init__(self, table, subject_key=None, **kwargs):
+        """
+        :param table: The allowed distinguished names. Either a
+            :py:class:`SubjectTable` (e.g. memory-mapped with
+            :py:meth:`SubjectTable.load`), or an iterable of names (see
+            :py:func:`canonical_dn`).
+        :param subject_key: The WSGI environment key of the subject
+            distinguished name.
+        :param kwargs: The options of :py:class:`X509Predicate`. The
+            ``normalize`` option is taken from the table.
+
+        :raise ValueError: When any of the names is invalid.
+        """
+        # No attribute types to match, so the checks of X509DNPredicate do
+        # not apply.
+        X509Predicate.__init__(self, **kwargs)
+        if not isinstance(table, SubjectTable):
+            table = SubjectTable(table, kwargs.get('normalize', False))
+        self.table = table
+        self.normalize = table.normalize
+        self.environ_key = subject_key or 'SSL_CLIENT_S_DN'
+        self.dn_params = ()
+
+    def evaluate(self, environ, credentials):
+        """
+        Evaluates the subject of the client certificate.
+
+        :param environ: The WSGI environment.
+        :param credentials: The user credentials. This parameter is not used.
+
+        :raise NotAuthorizedError: When the evaluation fails.
+        """
+        X509Predicate.evaluate(self, environ, credentials)
+        key = self._key(environ)
+        if key is None or not self.table._contains_key(key):
+            self.unmet()
+
+    def _key(self, environ):
+        # The canonical subject, computed only once per request.
+        dn = self.source.get(environ, self.environ_key)
+        if dn is None:
+            return None
+        cache = environ.get(ENVIRON_PARSED_KEY)
+        if cache is None:
+            cache = environ[ENVIRON_PARSED_KEY] = {}
+        key = ('canonical', dn, self.normalize)
+        try:
+            return cache[key]
+        except KeyError:
+            try:
+                canonical = _canonical(self._parse_dn(environ, dn))
+            except ValueError:
+                canonical = None
+            cache[key] = canonical
+            return canonical
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the resolution of the tenant of a client certificate from
+the attributes of its subject (e.g. its organization), through a hash index
+instead of one predicate per tenant.
+"""
+import itertools
+
+from .predicates import X509Predicate, X509DNPredicate, normalize_dn_value, \
+     _EMPTY
+
+
+__all__ = ['TenantIndex', 'in_tenant', 'ENVIRON_TENANT_KEY']
+
+
+# The environ key where the tenant resolved during a request is kept for the
+# rest of the application.
+ENVIRON_TENANT_KEY = 'repoze.what.x509.tenant'
+
+
+class TenantIndex(object):
+    """
+    Maps the values of some attribute types of the subject distinguished name
+    (by default the organization and the organizational unit) to the tenants.
+    """
+
+    def __init__(self, tenants, attributes=('O', 'OU'), normalize=False,
+                 tenant_key=ENVIRON_TENANT_KEY):
+        """
+        :param tenants: A dictionary with the tenant of every tuple of values
+            of the attribute types, e.g.
+            ``{('Example', 'Engineering'): 'example-eng'}``. With a single
+            attribute type the values may be strings instead of tuples.
+        :param attributes: The attribute types, in the order of the tuples.
+        :param normalize: If true, values are compared regardless of case,
+            Unicode normalization form and whitespace (see
+            :py:func:`normalize_dn_value`).
+        :param tenant_key: The WSGI environment key where the resolved tenant
+            is kept.
+
+        :raise ValueError: When there are no attribute types, or when a tuple
+            does not have a value for every attribute type.
+        """
+        if len(attributes) == 0:
+            raise ValueError('At least one attribute type must be specified')
+        self.attributes = tuple(attributes)
+        self.normalize = normalize
+        self.tenant_key = tenant_key
+        self._index = {}
+        for values, tenant in tenants.iteritems():
+            self.add(values, tenant)
+
+    def add(self, values, tenant):
+        """
+        Adds a tenant to the index.
+
+        :param values: The tuple of values of the attribute types.
+        :param tenant: The tenant.
+
+        :raise ValueError: When the tuple does not have a value for every
+            attribute type.
+        """
+        if isinstance(values, basestring):
+            values = (values,)
+        if len(values) != len(self.attributes):
+            raise ValueError('Expected values for %s, got %r' %
+                             (', '.join(self.attributes), values))
+        if self.normalize:
+            values = tuple([normalize_dn_value(v) for v in values])
+        self._index[tuple(values)] = tenant
+
+    def lookup(self, values):
+        """
+        Gets the tenant of the values of a distinguished name.
+
+        :param values: A list with the set of values of every attribute type,
+            in order.
+
+        :return: The tenant, or ``None`` if there is none or if the values
+            match more than one tenant.
+        """
+        index = self._index
+        tenant = None
+        for candidate in itertools.product(*values):
+            found = index.get(candidate)
+            if found is None:
+                continue
+            if tenant is not None and found != tenant:
+                # Ambiguous
+                return None
+            tenant = found
+        return tenant
+
+    def __len__(self):
+        return len(self._index)
+
+
+class in_tenant(X509DNPredicate):
+    """
+    Represents a predicate that resolves the tenant of the subject of the
+    client certificate through a :py:class:`TenantIndex`, and checks that it
+    is one of the allowed tenants. The tenant is resolved only once per
+    request and kept in the WSGI environment (under
+    ``repoze.what.x509.tenant`` by default) for the rest of the application.
+    """
+
+    message = 'Invalid SSL client tenant.'
+    # The tenant must be stored in the environ of every request.
+    cacheable = False
+
+    def __init__(self, index, tenants=None, subject_key=None, **kwargs):
+        """
+        :param index: The :py:class:`TenantIndex`.
+        :param tenants: The allowed tenants. By default any tenant is allowed,
+            as long as there is one.
+        :param subject_key: The WSGI environment key of the subject
+            distinguished name.
+        :param kwargs: The options of :py:class:`X509Predicate`.
+        """
+        # No attribute types to match, so the checks of X509DNPredicate do
+        # not apply.
+        X509Predicate.__init__(self, **kwargs)
+        if index.normalize:
+            self.normalize = True
+        self.index = index
+        self.tenants = None if tenants is None else frozenset(tenants)
+        self.environ_key = subject_key or 'SSL_CLIENT_S_DN'
+        self.dn_params = ()
+
+    def evaluate(self, environ, credentials):
+        """
+        Evaluates the tenant of the client certificate.
+
+        :param environ: The WSGI environment.
+        :param credentials: The user credentials. This parameter is not used.
+
+        :raise NotAuthorizedError: When the evaluation fails.
+        """
+        X509Predicate.evaluate(self, environ, credentials)
+        tenant = self.resolve(environ)
+        if tenant is None or \
+           (self.tenants is not None and tenant not in self.tenants):
+            self.unmet()
+
+    def resolve(self, environ):
+        """
+        Gets the tenant of the client certificate, without verifying the
+        certificate. It is resolved only once per request.
+
+        :param environ: The WSGI environment.
+
+        :return: The tenant, or ``None`` if there is none.
+        """
+        tenant = self.source._memoize(environ,
+                                      ('tenant', self.index, self.environ_key),
+                                      self._lookup, None)
+        # Even if it was resolved before, as it may have been from another
+        # source.
+        environ[self.index.tenant_key] = tenant
+        return tenant
+
+    def _lookup(self, environ, key):
+        return self.index.lookup(self._values(environ))
+
+    def _certificate_identity(self, environ):
+        dn = self.source.get(environ, self.environ_key)
+        if dn is None:
+            return None
+        return self._validity_identity(environ) + (dn,)
+
+    def _values(self, environ):
+        # The values of every attribute type of the index, from the server
+        # variables or else from the distinguished name.
+        values = []
+        parsed = None
+        for type_ in self.index.attributes:
+            try:
+                values.append(self._get_indexed_variables(
+                    environ,
+                    '%s_%s' % (self.environ_key, type_)
+                ))
+                continue
+            except KeyError:
+                pass
+            if parsed is None:
+                dn = self.source.get(environ, self.environ_key)
+                try:
+                    parsed = self._parse_dn(environ, dn) if dn else {}
+                except ValueError:
+                    parsed = {}
+            values.append(parsed.get(type_, _EMPTY))
+        return values
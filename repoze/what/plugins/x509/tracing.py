@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+"""
+This module contains the opt-in tracing of the evaluation of the predicates,
+that records where the authorization time is spent.
+"""
+from collections import deque
+from threading import Lock
+from UserDict import DictMixin
+import json
+import random
+import time
+
+from repoze.what.predicates import NotAuthorizedError
+
+
+__all__ = ['Tracer', 'Span', 'RingBufferSink', 'JSONLinesSink']
+
+
+class Span(object):
+    """
+    The record of one evaluation of a predicate.
+
+    :ivar predicate: The name of the class of the predicate.
+    :ivar path: How the distinguished name was resolved: ``server`` if every
+        server variable was present, ``fallback`` if some was missing so the
+        distinguished name had to be parsed, and ``parse`` when it was parsed
+        successfully.
+    :ivar keys: The WSGI environment keys that were read, in order.
+    :ivar timings: The seconds spent in each step (``verify``, ``parse`` and
+        ``match``).
+    :ivar duration: The total seconds of the evaluation.
+    :ivar met: If the predicate was met.
+    """
+
+    def __init__(self, predicate, start):
+        self.predicate = predicate
+        self.start = start
+        self.path = None
+        self.keys = []
+        self.timings = {}
+        self.duration = None
+        self.met = None
+
+    def touch(self, key):
+        if key not in self.keys:
+            self.keys.append(key)
+
+    def add_timing(self, step, seconds):
+        self.timings[step] = self.timings.get(step, 0.0) + seconds
+
+    def as_dict(self):
+        """
+        Gets the span as a dictionary that can be serialized to JSON.
+        """
+        return {
+            'predicate': self.predicate,
+            'start': self.start,
+            'path': self.path,
+            'keys': self.keys,
+            'timings': self.timings,
+            'duration': self.duration,
+            'met': self.met
+        }
+
+
+class RingBufferSink(object):
+    """
+    Keeps the latest spans in memory.
+    """
+
+    def __init__(self, size=1000):
+        """
+        :param size: The maximum number of spans that are kept.
+        """
+        self._spans = deque(maxlen=size)
+
+    def emit(self, span):
+        self._spans.append(span)
+
+    def spans(self):
+        """
+        Gets the spans that are kept, from the oldest to the newest.
+        """
+        return list(self._spans)
+
+
+class JSONLinesSink(object):
+    """
+    Appends the spans to a file, one JSON object per line.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the file.
+        """
+        self.path = path
+        self._lock = Lock()
+
+    def emit(self, span):
+        line = json.dumps(span.as_dict()) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+class _RecordingEnviron(DictMixin):
+    # Delegates to the WSGI environment, recording the keys that are read.
+
+    def __init__(self, environ, span):
+        self.environ = environ
+        self.span = span
+
+    def __getitem__(self, key):
+        self.span.touch(key)
+        return self.environ[key]
+
+    def __setitem__(self, key, value):
+        self.environ[key] = value
+
+    def __delitem__(self, key):
+        del self.environ[key]
+
+    def __contains__(self, key):
+        self.span.touch(key)
+        return key in self.environ
+
+    def keys(self):
+        return self.environ.keys()
+
+
+# The steps of the predicates that are timed, and the name of their timing.
+_STEPS = (
+    ('_verify_certificate', 'verify'),
+    ('_parse_dn', 'parse'),
+    ('_match_server_variables', 'match'),
+    ('_match_parsed_dn', 'match'),
+)
+
+
+class Tracer(object):
+    """
+    Records a :py:class:`Span` for a sample of the evaluations of the
+    predicates that were constructed with it (through the ``tracer`` argument)
+    and emits them to a sink. Predicates without a tracer are not affected at
+    all.
+    """
+
+    def __init__(self, sink, sample_rate=1.0, timer=None):
+        """
+        :param sink: The object whose ``emit`` method receives the spans, such
+            as a :py:class:`RingBufferSink` or a :py:class:`JSONLinesSink`.
+        :param sample_rate: The fraction (between 0 and 1) of the evaluations
+            that are traced.
+        :param timer: A callable that returns the current time in seconds. By
+            default it is :py:func:`time.time`.
+
+        :raise ValueError: When the sample rate is not between 0 and 1.
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError('The sample rate must be between 0 and 1')
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.timer = timer or time.time
+
+    def instrument(self, predicate):
+        """
+        Instruments a predicate so that its evaluations are traced.
+
+        :param predicate: The predicate to instrument.
+        """
+        for method, step in _STEPS:
+            function = getattr(predicate, method, None)
+            if function is not None:
+                setattr(predicate, method, self._timed(function, step))
+        predicate.evaluate = self._traced(predicate, predicate.evaluate)
+
+    def _traced(self, predicate, evaluate):
+        name = predicate.__class__.__name__
+
+        def traced_evaluate(environ, credentials):
+            if isinstance(environ, _RecordingEnviron) or \
+               random.random() >= self.sample_rate:
+                return evaluate(environ, credentials)
+
+            span = Span(name, self.timer())
+            try:
+                evaluate(_RecordingEnviron(environ, span), credentials)
+            except NotAuthorizedError:
+                span.met = False
+                raise
+            else:
+                span.met = True
+            finally:
+                span.duration = self.timer() - span.start
+                self.sink.emit(span)
+
+        return traced_evaluate
+
+    def _timed(self, function, step):
+        timer = self.timer
+
+        def timed_step(environ, *args):
+            span = getattr(environ, 'span', None)
+            if span is None:
+                return function(environ, *args)
+
+            start = timer()
+            try:
+                result = function(environ, *args)
+            finally:
+                span.add_timing(step, timer() - start)
+
+            if step == 'match' and result is not None:
+                span.path = 'server' if result else 'fallback'
+            elif step == 'parse':
+                span.path = 'parse'
+            return result
+
+        return timed_step
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This module contains the predicates on the purposes of the client
+certificate: its extended key usage, its key usage and its certificate
+policies.
+
+Every OID required by a predicate is interned into a table of the process
+that assigns it a bit, so the OIDs of a certificate become a bitmask (computed
+once per request) and every requirement is checked with a bitwise AND.
+"""
+from threading import Lock
+
+from .predicates import X509Predicate, ENVIRON_PARSED_KEY
+from .sources import CERT_KEY
+
+
+__all__ = ['has_extended_key_usage', 'has_key_usage', 'has_policy',
+           'oid_bit', 'EXTENDED_KEY_USAGES', 'KEY_USAGES']
+
+
+# The names of the extended key usages (RFC 5280).
+EXTENDED_KEY_USAGES = {
+    'serverAuth': '1.3.6.1.5.5.7.3.1',
+    'clientAuth': '1.3.6.1.5.5.7.3.2',
+    'codeSigning': '1.3.6.1.5.5.7.3.3',
+    'emailProtection': '1.3.6.1.5.5.7.3.4',
+    'timeStamping': '1.3.6.1.5.5.7.3.8',
+    'OCSPSigning': '1.3.6.1.5.5.7.3.9',
+    'anyExtendedKeyUsage': '2.5.29.37.0',
+}
+
+# The named bits of the key usage (RFC 5280).
+KEY_USAGES = {
+    'digitalSignature': 0,
+    'nonRepudiation': 1,
+    'contentCommitment': 1,
+    'keyEncipherment': 2,
+    'dataEncipherment': 3,
+    'keyAgreement': 4,
+    'keyCertSign': 5,
+    'cRLSign': 6,
+    'encipherOnly': 7,
+    'decipherOnly': 8,
+}
+
+_OID_BITS = {}
+_OID_BITS_LOCK = Lock()
+
+
+def oid_bit(oid):
+    """
+    Gets the bit of an OID in the table of the process, assigning the next
+    one if the OID is new.
+
+    :param oid: The dotted representation of the OID.
+    """
+    bit = _OID_BITS.get(oid)
+    if bit is None:
+        with _OID_BITS_LOCK:
+            bit = _OID_BITS.get(oid)
+            if bit is None:
+                bit = _OID_BITS[oid] = 1 << len(_OID_BITS)
+    return bit
+
+
+def _oids_mask(oids):
+    # Only the OIDs required by some predicate have a bit; the rest cannot
+    # make a difference.
+    mask = 0
+    get = _OID_BITS.get
+    for oid in oids:
+        mask |= get(oid, 0)
+    return mask
+
+
+class _UsagePredicate(X509Predicate):
+    # The usage of the certificate is decoded once per request, and shared by
+    # every predicate of this module.
+
+    message = 'Invalid SSL client certificate usage.'
+
+    def __init__(self, required, require_all=True, cert_key=None, **kwargs):
+        super(_UsagePredicate, self).__init__(**kwargs)
+        if not required:
+            raise ValueError('At least one usage must be specified')
+        self.mask = 0
+        for value in required:
+            self.mask |= self._bit(value)
+        self.require_all = require_all
+        self.cert_key = cert_key or CERT_KEY
+
+    def evaluate(self, environ, credentials):
+        """
+        Evaluates the usage of the client certificate.
+
+        :param environ: The WSGI environment.
+        :param credentials: The user credentials. This parameter is not used.
+
+        :raise NotAuthorizedError: When the evaluation fails.
+        """
+        super(_UsagePredicate, self).evaluate(environ, credentials)
+        usage = self._usage(environ)
+        if usage is None:
+            self.unmet()
+        mask = self._mask(usage)
+        if mask is None:
+            # Unrestricted
+            return
+        if self.require_all:
+            if mask & self.mask != self.mask:
+                self.unmet()
+        elif not mask & self.mask:
+            self.unmet()
+
+    def _certificate_identity(self, environ):
+        certificate = self.source.get(environ, self.cert_key)
+        if certificate is None:
+            return None
+        return self._validity_identity(environ) + (certificate,)
+
+    def _usage(self, environ):
+        # The extended key usage, key usage and policies masks, or None if
+        # there is no valid certificate. They are computed again only if
+        # other OIDs were interned since. They are kept by source, like the
+        # values decoded by the source.
+        cache = environ.get(ENVIRON_PARSED_KEY)
+        if cache is None:
+            cache = environ[ENVIRON_PARSED_KEY] = {}
+        source = self.source
+        key = ('usage', source.__class__, source._config, self.cert_key)
+        entry = cache.get(key)
+        if entry is not None and entry[0] == len(_OID_BITS):
+            return entry[1]
+
+        size = len(_OID_BITS)
+        try:
+            certificate = source.get_certificate(environ, self.cert_key)
+            if certificate is None:
+                usage = None
+            else:
+                eku = certificate.extended_key_usage
+                usage = (None if eku is None else _oids_mask(eku),
+                         certificate.key_usage,
+                         _oids_mask(certificate.policies))
+        except ValueError:
+            usage = None
+        cache[key] = (size, usage)
+        return usage
+
+
+class has_extended_key_usage(_UsagePredicate):
+    """
+    Represents a predicate that checks the extended key usage of the client
+    certificate, e.g. that it may be used for client authentication.
+    """
+
+    def __init__(self, *usages, **kwargs):
+        """
+        :param usages: The names (see :py:data:`EXTENDED_KEY_USAGES`) or the
+            OIDs of the extended key usages.
+        :param require_all: If true (by default), every usage is required;
+            otherwise any of them.
+        :param strict: If true, a certificate without the extended key usage
+            extension is rejected. By default such certificate may be used
+            for any purpose, as per RFC 5280.
+        :param cert_key: The WSGI environment key of the PEM encoded client
+            certificate. By default it is ``SSL_CLIENT_CERT``.
+
+        :raise ValueError: When no usage is specified.
+        """
+        self.strict = kwargs.pop('strict', False)
+        super(has_extended_key_usage, self).__init__(usages, **kwargs)
+
+    def _bit(self, usage):
+        return oid_bit(EXTENDED_KEY_USAGES.get(usage, usage))
+
+    def _mask(self, usage):
+        if usage[0] is None and self.strict:
+            return 0
+        return usage[0]
+
+
+class has_key_usage(_UsagePredicate):
+    """
+    Represents a predicate that checks the key usage of the client
+    certificate, e.g. that its key may be used for digital signatures.
+    """
+
+    def __init__(self, *usages, **kwargs):
+        """
+        :param usages: The names of the key usages (see
+            :py:data:`KEY_USAGES`).
+        :param require_all: If true (by default), every usage is required;
+            otherwise any of them.
+        :param strict: If true, a certificate without the key usage extension
+            is rejected. By default its key may be used for any purpose.
+        :param cert_key: The WSGI environment key of the PEM encoded client
+            certificate. By default it is ``SSL_CLIENT_CERT``.
+
+        :raise ValueError: When no usage is specified, or a usage is unknown.
+        """
+        self.strict = kwargs.pop('strict', False)
+        super(has_key_usage, self).__init__(usages, **kwargs)
+
+    def _bit(self, usage):
+        try:
+            return 1 << KEY_USAGES[usage]
+        except KeyError:
+            raise ValueError('Unknown key usage: %r' % usage)
+
+    def _mask(self, usage):
+        if usage[1] is None and self.strict:
+            return 0
+        return usage[1]
+
+
+class has_policy(_UsagePredicate):
+    """
+    Represents a predicate that checks the certificate policies of the client
+    certificate.
+    """
+
+    message = 'Invalid SSL client certificate policy.'
+
+    def __init__(self, *policies, **kwargs):
+        """
+        :param policies: The OIDs of the policies.
+        :param require_all: If true, every policy is required. By default any
+            of them is enough.
+        :param cert_key: The WSGI environment key of the PEM encoded client
+            certificate. By default it is ``SSL_CLIENT_CERT``.
+
+        :raise ValueError: When no policy is specified.
+        """
+        kwargs.setdefault('require_all', False)
+        super(has_policy, self).__init__(policies, **kwargs)
+
+    def _bit(self, policy):
+        return oid_bit(policy)
+
+    def _mask(self, usage):
+        return usage[2]
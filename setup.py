@@ -67,5 +67,8 @@ setup(name='repoze.what-x509',
       ],
       setup_requires=['nose>=1.0'],
       test_suite='nose.collector',
-      entry_points=''
+      entry_points="""
+      [console_scripts]
+      x509-audit = repoze.what.plugins.x509.audit:main
+      """
 )
@@ -27,6 +27,15 @@ from datetime import datetime
 from repoze.what import predicates
 import unittest
 import locale
+import os
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def read_data(name):
+    """Reads a file of the test data directory"""
+    return open(os.path.join(DATA_DIR, name)).read()
 
 
 class TestX509Base(unittest.TestCase):
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from urllib import quote
+import base64
+
+from tests import TestX509Base, read_data
+from repoze.what.plugins.x509 import is_subject, is_issuer, is_client, \
+     is_pinned, ModSSLSource, NginxSource, HAProxySource, EnvoySource
+from repoze.what.plugins.x509.adapters import rfc2253_to_openssl, \
+     parse_xfcc, parse_time
+
+
+SUBJECT_RFC2253 = 'CN=John Smith,OU=Operations,OU=Engineering,O=Example,' \
+                  'L=San Diego,ST=California,C=US'
+SUBJECT_OPENSSL = '/C=US/ST=California/L=San Diego/O=Example' \
+                  '/OU=Engineering/OU=Operations/CN=John Smith'
+ISSUER_OPENSSL = '/C=US/O=Example/OU=Engineering/CN=Example Intermediate CA'
+CERT_FINGERPRINT = '24FB7D9C4EF9473B7B828ACF97CAB1DA' \
+                   '640A781F77BF5F90FE61F44128B6C3FE'
+
+
+class TestRFC2253(TestX509Base):
+
+    def test_reversed(self):
+        self.assertEqual(rfc2253_to_openssl(SUBJECT_RFC2253),
+                         SUBJECT_OPENSSL)
+
+    def test_escaped(self):
+        self.assertEqual(rfc2253_to_openssl(r'CN=Smith\, John,O=A\+B'),
+                         '/O=A+B/CN=Smith, John')
+        self.assertEqual(rfc2253_to_openssl('CN="Smith, John",C=US'),
+                         '/C=US/CN=Smith, John')
+        self.assertEqual(rfc2253_to_openssl(r'CN=Jos\C3\A9'),
+                         '/CN=Jos\xc3\xa9')
+
+    def test_multi_valued_rdn(self):
+        self.assertEqual(rfc2253_to_openssl('CN=Name+UID=1,C=US'),
+                         '/C=US/CN=Name/UID=1')
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, rfc2253_to_openssl, 'CN=Name,Invalid')
+        self.assertRaises(ValueError, rfc2253_to_openssl, 'CN="Name')
+
+
+class TestParseTime(TestX509Base):
+
+    def test_formats(self):
+        for value, date_format in (
+            ('Jan  1 00:00:00 2012 GMT', 'openssl'),
+            ('notAfter=Jan  1 00:00:00 2012 GMT', 'openssl'),
+            ('120101000000Z', 'asn1'),
+            ('120101000000', 'asn1'),
+            ('2012-01-01T00:00:00Z', 'iso8601'),
+            ('2012-01-01T01:00:00+01:00', 'iso8601'),
+            ('1325376000', 'epoch')):
+            self.assertEqual(parse_time(value, date_format), 1325376000)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_time, 'invalid', 'asn1')
+        self.assertRaises(ValueError, parse_time, 'Jan  1 00:00:00 2012 EST',
+                          'openssl')
+
+
+class TestParseXFCC(TestX509Base):
+
+    def test_parse(self):
+        elements = parse_xfcc(
+            'By=spiffe://a;Hash=AB;Subject="CN=Name,O=Org";URI=,'
+            'By=spiffe://b;Hash=CD;Subject="CN=\\"Quoted\\""'
+        )
+        self.assertEqual(len(elements), 2)
+        self.assertEqual(elements[0]['Subject'], 'CN=Name,O=Org')
+        self.assertEqual(elements[0]['URI'], '')
+        self.assertEqual(elements[1]['Subject'], 'CN="Quoted"')
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_xfcc, 'Hash')
+        self.assertRaises(ValueError, parse_xfcc, 'Subject="CN=Name')
+
+
+class TestModSSLSource(TestX509Base):
+
+    def test_unknown_formats(self):
+        self.assertRaises(ValueError, ModSSLSource, date_format='unknown')
+        self.assertRaises(ValueError, ModSSLSource, dn_format='unknown')
+
+    def test_key_map(self):
+        source = ModSSLSource(keys={'SSL_CLIENT_S_DN': 'HTTP_X_CLIENT_DN'})
+        environ = self.make_environ(ISSUER_OPENSSL, SUBJECT_OPENSSL,
+                                    subject_key='HTTP_X_CLIENT_DN')
+        self.eval_met_predicate(
+            is_subject(common_name='John Smith', source=source),
+            environ
+        )
+        self.assertEqual(source.get(environ, 'OTHER', 'default'), 'default')
+
+    def test_validity(self):
+        source = ModSSLSource()
+        environ = {'SSL_CLIENT_V_START': 'Jan  1 00:00:00 2012 GMT',
+                   'SSL_CLIENT_V_END': 'Jan  1 00:00:00 2013 GMT'}
+        self.assertEqual(source.get_validity(environ),
+                         (1325376000, 1356998400))
+        self.assertEqual(source.get_validity({}), None)
+
+
+class TestNginxSource(TestX509Base):
+
+    def make_environ_for_test(self, **kwargs):
+        environ = self.make_environ(
+            'CN=Example Intermediate CA,OU=Engineering,O=Example,C=US',
+            SUBJECT_RFC2253,
+            **kwargs
+        )
+        environ['SSL_CLIENT_CERT'] = read_data('client.pem').replace('\n',
+                                                                     '\t')
+        return environ
+
+    def test_rfc2253(self):
+        predicate = is_client(
+            subject={'organizational_unit': ('Engineering', 'Operations'),
+                     'common_name': 'John Smith'},
+            issuer={'common_name': 'Example Intermediate CA'},
+            source=NginxSource()
+        )
+        self.eval_met_predicate(predicate, self.make_environ_for_test())
+
+    def test_expired(self):
+        from datetime import datetime
+        from dateutil.tz import tzutc
+        end = datetime(2012, 1, 1, tzinfo=tzutc())
+        predicate = is_subject(common_name='John Smith',
+                               source=NginxSource())
+        environ = self.make_environ_for_test(end=end)
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_failed_verification(self):
+        predicate = is_subject(common_name='John Smith', source=NginxSource())
+        environ = self.make_environ_for_test()
+        environ['SSL_CLIENT_VERIFY'] = 'FAILED:certificate has expired'
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_invalid_dn(self):
+        predicate = is_subject(common_name='John Smith', source=NginxSource())
+        environ = self.make_environ_for_test()
+        environ['SSL_CLIENT_S_DN'] = 'CN="John Smith'
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_prefix(self):
+        predicate = is_subject(common_name='John Smith',
+                               source=NginxSource(prefix='HTTP_'))
+        environ = self.make_environ(
+            'CN=Example Intermediate CA', SUBJECT_RFC2253, prefix='HTTP_',
+            verify_key='HTTP_SSL_CLIENT_VERIFY'
+        )
+        self.eval_met_predicate(predicate, environ)
+
+    def test_escaped_certificate(self):
+        environ = self.make_environ_for_test()
+        environ['SSL_CLIENT_CERT'] = quote(read_data('client.pem'))
+        self.eval_met_predicate(
+            is_pinned([CERT_FINGERPRINT], source=NginxSource()),
+            environ
+        )
+
+
+class TestHAProxySource(TestX509Base):
+
+    def make_environ_for_test(self, verify='0'):
+        pem = read_data('client.pem').splitlines()
+        der = base64.b64decode(''.join(pem[1:-1]))
+        return {
+            'HTTP_X_SSL_CLIENT_VERIFY': verify,
+            'HTTP_X_SSL_CLIENT_NOTBEFORE': '120101000000Z',
+            'HTTP_X_SSL_CLIENT_NOTAFTER': '491231235959Z',
+            'HTTP_X_SSL_CLIENT_S_DN': SUBJECT_OPENSSL,
+            'HTTP_X_SSL_CLIENT_I_DN': ISSUER_OPENSSL,
+            'HTTP_X_SSL_CLIENT_SERIAL': '1A2B3C4D5E',
+            'HTTP_X_SSL_CLIENT_CERT': base64.b64encode(der),
+        }
+
+    def test_headers(self):
+        source = HAProxySource()
+        environ = self.make_environ_for_test()
+        self.eval_met_predicate(
+            is_client(subject={'common_name': 'John Smith'},
+                      issuer={'organization': 'Example'}, source=source),
+            environ
+        )
+        self.eval_met_predicate(is_pinned([CERT_FINGERPRINT], source=source),
+                                environ)
+        self.assertEqual(source.get(environ, 'SSL_CLIENT_M_SERIAL'),
+                         '1A2B3C4D5E')
+
+    def test_failed_verification(self):
+        predicate = is_subject(common_name='John Smith',
+                               source=HAProxySource())
+        environ = self.make_environ_for_test(verify='10')
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_expired(self):
+        predicate = is_subject(common_name='John Smith',
+                               source=HAProxySource())
+        environ = self.make_environ_for_test()
+        environ['HTTP_X_SSL_CLIENT_NOTAFTER'] = '130101000000Z'
+        self.assertEqual(predicate.is_met(environ), False)
+
+
+class TestEnvoySource(TestX509Base):
+
+    def make_environ_for_test(self, **fields):
+        fields.setdefault('Cert', quote(read_data('client.pem')))
+        fields.setdefault('Subject', '"%s"' % SUBJECT_RFC2253)
+        element = ';'.join(['%s=%s' % (k, v) for k, v in fields.iteritems()
+                            if v is not None])
+        return {'HTTP_X_FORWARDED_CLIENT_CERT':
+                'By=spiffe://edge;Hash=00,' + element}
+
+    def test_subject_and_issuer(self):
+        predicate = is_client(
+            subject={'common_name': 'John Smith', 'country': 'US'},
+            issuer={'common_name': 'Example Intermediate CA'},
+            source=EnvoySource()
+        )
+        self.eval_met_predicate(predicate, self.make_environ_for_test())
+
+    def test_subject_from_certificate(self):
+        predicate = is_subject(common_name='John Smith', source=EnvoySource())
+        environ = self.make_environ_for_test(Subject=None)
+        self.eval_met_predicate(predicate, environ)
+
+    def test_without_certificate(self):
+        predicate = is_issuer(common_name='Example Intermediate CA',
+                              source=EnvoySource())
+        environ = self.make_environ_for_test(Cert=None)
+        self.assertEqual(predicate.is_met(environ), False)
+        self.eval_met_predicate(
+            is_subject(common_name='John Smith', source=EnvoySource()),
+            environ
+        )
+
+    def test_without_header(self):
+        predicate = is_subject(common_name='John Smith', source=EnvoySource())
+        self.assertEqual(predicate.is_met({}), False)
+
+    def test_invalid_certificate(self):
+        predicate = is_subject(common_name='John Smith', source=EnvoySource())
+        environ = self.make_environ_for_test(Cert='invalid')
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_fingerprint_from_hash(self):
+        environ = self.make_environ_for_test(Hash=CERT_FINGERPRINT, Cert=None)
+        self.eval_met_predicate(
+            is_pinned([CERT_FINGERPRINT], source=EnvoySource()),
+            environ
+        )
+
+    def test_serial(self):
+        environ = self.make_environ_for_test()
+        self.assertEqual(EnvoySource().get(environ, 'SSL_CLIENT_M_SERIAL'),
+                         '1A2B3C4D5E')
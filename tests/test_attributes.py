@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from tests import TestX509Base
+from repoze.what.plugins.x509 import X509AttributePredicate, \
+     AttributeDirectory, SQLiteAttributeBackend, HeaderSource
+from repoze.what.plugins.x509.attributes import AttributeBackend, \
+     ENVIRON_ATTRIBUTES_KEY
+from repoze.what.plugins.x509.cache import TTLCache
+
+
+SUBJECT = '/CN=Name/O=Company/C=US'
+OTHER_SUBJECT = '/CN=Other/O=Company/C=US'
+
+
+class _CountingBackend(AttributeBackend):
+
+    def __init__(self, data):
+        self.data = data
+        self.lookups = 0
+        self.loads = 0
+
+    def lookup_many(self, subjects):
+        self.lookups += 1
+        return dict((s, self.data[s]) for s in subjects if s in self.data)
+
+    def load_all(self):
+        self.loads += 1
+        return dict(self.data)
+
+
+class TestTTLCache(TestX509Base):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = TTLCache(ttl=10, max_size=2, timer=lambda: self.now)
+
+    def test_get_and_expire(self):
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.now += 11
+        self.assertEqual(self.cache.get('a'), None)
+        assert 'a' not in self.cache
+
+    def test_custom_ttl(self):
+        self.cache.set('a', 1, ttl=100)
+        self.now += 50
+        self.assertEqual(self.cache.get('a'), 1)
+
+    def test_evicts_oldest(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.set('c', 3)
+        self.assertEqual(len(self.cache), 2)
+        assert 'a' not in self.cache
+        assert 'c' in self.cache
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, TTLCache, max_size=0)
+
+
+class TestX509AttributePredicate(TestX509Base):
+
+    def setUp(self):
+        self.backend = _CountingBackend({
+            SUBJECT: {'team': ['ops', 'dev'], 'clearance': ['secret']}
+        })
+        self.directory = AttributeDirectory(self.backend)
+
+    def make_environ_for_test(self, subject=SUBJECT, **kwargs):
+        return self.make_environ({'CN': 'CA'}, subject, **kwargs)
+
+    def test_construct_without_attributes(self):
+        self.assertRaises(ValueError, X509AttributePredicate, self.directory)
+
+    def test_attribute(self):
+        predicate = X509AttributePredicate(self.directory, team='ops')
+        self.eval_met_predicate(predicate, self.make_environ_for_test())
+
+    def test_multiple_values(self):
+        predicate = X509AttributePredicate(self.directory, team=('dev', 'ops'),
+                                           clearance='secret')
+        self.eval_met_predicate(predicate, self.make_environ_for_test())
+
+    def test_fail_attribute(self):
+        predicate = X509AttributePredicate(self.directory, team='sales')
+        self.eval_unmet_predicate(predicate, self.make_environ_for_test(),
+                                  X509AttributePredicate.message)
+
+    def test_fail_missing_attribute(self):
+        predicate = X509AttributePredicate(self.directory, tenant='acme')
+        self.eval_unmet_predicate(predicate, self.make_environ_for_test(),
+                                  X509AttributePredicate.message)
+
+    def test_fail_unknown_subject(self):
+        predicate = X509AttributePredicate(self.directory, team='ops')
+        environ = self.make_environ_for_test(OTHER_SUBJECT)
+        self.eval_unmet_predicate(predicate, environ,
+                                  X509AttributePredicate.message)
+
+    def test_fail_invalid_certificate(self):
+        predicate = X509AttributePredicate(self.directory, team='ops')
+        environ = self.make_environ_for_test(verified=False)
+        self.eval_unmet_predicate(predicate, environ,
+                                  X509AttributePredicate.message)
+
+    def test_options_are_not_attributes(self):
+        predicate = X509AttributePredicate(self.directory, team='ops',
+                                           verify_key='SSL_CLIENT_VERIFY')
+        self.assertEqual(predicate.attribute_params, [('team', 'ops')])
+
+    def test_resolution_is_shared_within_request(self):
+        environ = self.make_environ_for_test()
+        X509AttributePredicate(self.directory, team='ops').is_met(environ)
+        self.directory.cache.clear()
+        X509AttributePredicate(self.directory, team='dev').is_met(environ)
+        self.assertEqual(self.backend.lookups, 1)
+        self.assertEqual([key[-1] for key in environ[ENVIRON_ATTRIBUTES_KEY]],
+                         [SUBJECT])
+
+    def test_resolution_by_directory(self):
+        other = AttributeDirectory(_CountingBackend({
+            SUBJECT: {'team': ['blue']}
+        }))
+        environ = self.make_environ_for_test()
+        self.eval_met_predicate(
+            X509AttributePredicate(self.directory, team='ops'), environ
+        )
+        self.assertEqual(
+            X509AttributePredicate(other, team='ops').is_met(environ), False
+        )
+        self.eval_met_predicate(X509AttributePredicate(other, team='blue'),
+                                environ)
+
+    def test_resolution_by_source(self):
+        environ = self.make_environ_for_test()
+        for key, value in environ.items():
+            if key.startswith('SSL_CLIENT_'):
+                environ['HTTP_' + key] = value
+        environ['HTTP_SSL_CLIENT_S_DN'] = OTHER_SUBJECT
+        self.eval_met_predicate(
+            X509AttributePredicate(self.directory, team='ops'), environ
+        )
+        self.assertEqual(
+            X509AttributePredicate(self.directory, team='ops',
+                                   source=HeaderSource()).is_met(environ),
+            False
+        )
+
+    def test_resolution_is_cached_across_requests(self):
+        predicate = X509AttributePredicate(self.directory, team='ops')
+        for n in range(3):
+            self.eval_met_predicate(predicate, self.make_environ_for_test())
+        self.assertEqual(self.backend.lookups, 1)
+
+    def test_negative_caching(self):
+        predicate = X509AttributePredicate(self.directory, team='ops')
+        for n in range(3):
+            predicate.is_met(self.make_environ_for_test(OTHER_SUBJECT))
+        self.assertEqual(self.backend.lookups, 1)
+
+    def test_warm_up(self):
+        self.assertEqual(self.directory.warm_up(), 1)
+        predicate = X509AttributePredicate(self.directory, team='ops')
+        self.eval_met_predicate(predicate, self.make_environ_for_test())
+        self.assertEqual(self.backend.lookups, 0)
+
+    def test_backend_error(self):
+        class _BrokenBackend(AttributeBackend):
+            def lookup_many(self, subjects):
+                raise RuntimeError('down')
+        directory = AttributeDirectory(_BrokenBackend())
+        predicate = X509AttributePredicate(directory, team='ops')
+        self.eval_unmet_predicate(predicate, self.make_environ_for_test(),
+                                  X509AttributePredicate.message)
+
+
+class TestSQLiteAttributeBackend(TestX509Base):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, 'attributes.db')
+        conn = sqlite3.connect(self.database)
+        conn.execute('CREATE TABLE x509_attributes (subject, name, value)')
+        conn.executemany(
+            'INSERT INTO x509_attributes VALUES (?, ?, ?)',
+            [(SUBJECT, 'team', 'ops'), (SUBJECT, 'team', 'dev'),
+             (OTHER_SUBJECT, 'tenant', 'acme')]
+        )
+        conn.commit()
+        conn.close()
+        self.backend = SQLiteAttributeBackend(self.database, pool_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup_many(self):
+        result = self.backend.lookup_many([SUBJECT, '/CN=Unknown'])
+        self.assertEqual(result.keys(), [SUBJECT])
+        self.assertEqual(sorted(result[SUBJECT]['team']), ['dev', 'ops'])
+
+    def test_lookup_many_in_chunks(self):
+        subjects = ['/CN=%d' % n for n in range(1200)] + [OTHER_SUBJECT]
+        result = self.backend.lookup_many(subjects)
+        self.assertEqual(result, {OTHER_SUBJECT: {'tenant': ['acme']}})
+
+    def test_load_all(self):
+        self.assertEqual(len(self.backend.load_all()), 2)
+
+    def test_connections_are_reused(self):
+        with self.backend.connection() as first:
+            pass
+        with self.backend.connection() as second:
+            with self.backend.connection() as third:
+                pass
+        assert first is second or first is third
+
+    def test_invalid_identifier(self):
+        self.assertRaises(ValueError, SQLiteAttributeBackend, self.database,
+                          table='x; DROP TABLE x')
+
+    def test_predicate(self):
+        directory = AttributeDirectory(self.backend)
+        predicate = X509AttributePredicate(directory, tenant='acme')
+        environ = self.make_environ({'CN': 'CA'}, OTHER_SUBJECT)
+        self.eval_met_predicate(predicate, environ)
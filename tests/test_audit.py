@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from StringIO import StringIO
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from tests import TestX509Base
+from repoze.what.plugins.x509.audit import audit, load_rules, main, \
+     _TopCounter
+
+
+RULES = {
+    'operations': {'predicate': 'is_subject',
+                   'organizational_unit': 'Operations'},
+    'example-ca': {'predicate': 'is_issuer', 'organization': 'Example'},
+}
+
+RECORDS = [
+    {'SSL_CLIENT_S_DN': '/O=Example/OU=Operations/CN=John',
+     'SSL_CLIENT_I_DN': '/O=Example/CN=CA'},
+    {'SSL_CLIENT_S_DN': '/O=Example/OU=Sales/CN=Jane',
+     'SSL_CLIENT_I_DN': '/O=Example/CN=CA'},
+    {'SSL_CLIENT_S_DN': '/O=Other/OU=Operations/CN=Joe',
+     'SSL_CLIENT_I_DN': '/O=Other/CN=CA'},
+    {'SSL_CLIENT_S_DN': '/O=Other/OU=Operations/CN=Joe',
+     'SSL_CLIENT_I_DN': '/O=Other/CN=CA', 'SSL_CLIENT_VERIFY': 'FAILED'},
+]
+
+LOG_PATTERN = r'"(?P<SSL_CLIENT_S_DN>[^"]*)" "(?P<SSL_CLIENT_I_DN>[^"]*)"$'
+
+
+def make_lines(records=RECORDS):
+    return [json.dumps(record) + '\n' for record in records]
+
+
+class TestAudit(TestX509Base):
+
+    def test_load_rules(self):
+        rules = load_rules(RULES)
+        self.assertEqual([name for name, predicate in rules],
+                         ['example-ca', 'operations'])
+
+    def test_load_invalid_rules(self):
+        self.assertRaises(ValueError, load_rules,
+                          {'x': {'predicate': 'unknown', 'O': 'Org'}})
+
+    def test_audit(self):
+        report = audit(make_lines() + ['\n', 'invalid\n'], RULES,
+                       processes=1, chunk_size=2)
+        self.assertEqual(report['records'], 4)
+        self.assertEqual(report['invalid'], 1)
+        operations = report['rules']['operations']
+        self.assertEqual(operations['hits'], 2)
+        self.assertEqual(operations['denied'], 2)
+        self.assertEqual(operations['denied_identities'], {
+            '/O=Example/OU=Sales/CN=Jane': 1,
+            '/O=Other/OU=Operations/CN=Joe': 1
+        })
+        self.assertEqual(report['rules']['example-ca']['hits'], 2)
+
+    def test_audit_with_processes(self):
+        lines = make_lines(RECORDS * 50)
+        self.assertEqual(audit(lines, RULES, processes=2, chunk_size=7),
+                         audit(lines, RULES, processes=1))
+
+    def test_max_identities(self):
+        report = audit(make_lines(), RULES, processes=1, max_identities=1)
+        identities = report['rules']['example-ca']['denied_identities']
+        self.assertEqual(identities, {'/O=Other/OU=Operations/CN=Joe': 2})
+
+    def test_bounded_identities(self):
+        # Many identities denied once, and one denied many times.
+        records = [{'SSL_CLIENT_S_DN': '/O=Example/OU=Sales/CN=%d' % n}
+                   for n in range(500)]
+        records[::5] = [{'SSL_CLIENT_S_DN': '/O=Example/OU=Sales/CN=Jane'}
+                        ] * 100
+        report = audit(make_lines(records), RULES, processes=1,
+                       chunk_size=50, max_identities=10)
+        operations = report['rules']['operations']
+        self.assertEqual(operations['denied'], 500)
+        identities = operations['denied_identities']
+        self.assertEqual(len(identities), 10)
+        assert identities['/O=Example/OU=Sales/CN=Jane'] >= 100
+
+    def test_top_counter(self):
+        counter = _TopCounter(3)
+        for key in 'aaaaaaabbbcdefgh':
+            counter.add(key)
+        self.assertEqual(len(counter.counts), 3)
+        # More frequent than a third of the keys, so it is kept.
+        assert counter.counts['a'] >= 7
+        self.assertEqual(sum(counter.counts.itervalues()), 16)
+        empty = _TopCounter(0)
+        empty.add('a')
+        self.assertEqual(empty.counts, {})
+
+    def test_json_lines_that_are_not_objects(self):
+        report = audit(make_lines() + ['[]\n', '"x"\n', '1\n', 'null\n'],
+                       RULES, processes=1)
+        self.assertEqual(report['records'], 4)
+        self.assertEqual(report['invalid'], 4)
+
+    def test_validity_at_record_time(self):
+        validity = {'SSL_CLIENT_V_START': 'Jan  1 00:00:00 2019 GMT',
+                    'SSL_CLIENT_V_END': 'Jan  1 00:00:00 2020 GMT'}
+        records = [dict(RECORDS[0], time=time, **validity) for time in
+                   ('2019-06-01T10:00:00Z', 1559383200, '2021-01-01')]
+        # Without time, it is unknown whether it was valid.
+        records.append(dict(RECORDS[0], **validity))
+        report = audit(make_lines(records) + [make_lines([
+            dict(RECORDS[0], time='invalid', **validity)
+        ])[0]], RULES, processes=1)
+        self.assertEqual(report['records'], 4)
+        self.assertEqual(report['invalid'], 1)
+        self.assertEqual(report['rules']['operations']['hits'], 3)
+        self.assertEqual(report['rules']['operations']['denied_identities'],
+                         {'/O=Example/OU=Operations/CN=John': 1})
+
+    def test_access_log(self):
+        lines = ['127.0.0.1 - - [01/Jan/2012] "GET / HTTP/1.1" 200 '
+                 '"%s" "%s"\n' % (r['SSL_CLIENT_S_DN'], r['SSL_CLIENT_I_DN'])
+                 for r in RECORDS[:3]]
+        report = audit(lines, RULES, LOG_PATTERN, processes=1)
+        self.assertEqual(report['records'], 3)
+        self.assertEqual(report['rules']['operations']['hits'], 2)
+
+    def test_access_log_time(self):
+        pattern = (r'\[(?P<time>[^]]*)\] .* "(?P<SSL_CLIENT_S_DN>[^"]*)" '
+                   r'"(?P<SSL_CLIENT_V_START>[^"]*)" '
+                   r'"(?P<SSL_CLIENT_V_END>[^"]*)"$')
+        lines = ['127.0.0.1 - - [%s] "GET / HTTP/1.1" 200 "%s" '
+                 '"Jan  1 00:00:00 2019 GMT" "Jan  1 00:00:00 2020 GMT"\n' %
+                 (time, RECORDS[0]['SSL_CLIENT_S_DN'])
+                 for time in ('01/Jun/2019:10:00:00 -0700',
+                              '01/Jun/2020:10:00:00 -0700')]
+        report = audit(lines, RULES, pattern, processes=1)
+        self.assertEqual(report['records'], 2)
+        self.assertEqual(report['rules']['operations']['hits'], 1)
+
+
+class TestMain(TestX509Base):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rules_path = os.path.join(self.directory, 'rules.json')
+        json.dump(RULES, open(self.rules_path, 'w'))
+        self.input_path = os.path.join(self.directory, 'input.jsonl')
+        open(self.input_path, 'w').writelines(make_lines())
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        shutil.rmtree(self.directory)
+
+    def test_main(self):
+        self.assertEqual(main([self.rules_path, self.input_path, '-j', '1']),
+                         0)
+        report = json.loads(sys.stdout.getvalue())
+        self.assertEqual(report['rules']['operations']['hits'], 2)
+
+    def test_invalid_rules_file(self):
+        open(self.rules_path, 'w').write('not json')
+        self.assertRaises(SystemExit, main, [self.rules_path])
+        assert 'Invalid rules file' in sys.stderr.getvalue()
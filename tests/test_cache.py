@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from tests import TestX509Base
+from repoze.what.plugins.x509 import is_subject, is_issuer, NegativeCache
+
+
+class _Log(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def warn(self, message):
+        self.messages.append(message)
+
+
+class TestNegativeCache(TestX509Base):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.log = _Log()
+        self.cache = NegativeCache(ttl=5, log=self.log, log_interval=60,
+                                   timer=lambda: self.now)
+
+    def make_environ_for_test(self, subject):
+        return self.make_environ({'CN': 'CA'}, subject)
+
+    def test_rejection_is_remembered(self):
+        predicate = is_subject(common_name='Name', negative_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Other'})
+        for i in range(3):
+            self.eval_unmet_predicate(predicate, environ,
+                                      'Invalid SSL client subject.')
+        stats = self.cache.stats()
+        self.assertEqual(stats['stored'], 1)
+        self.assertEqual(stats['evaluated'], 1)
+        self.assertEqual(stats['saved'], 5)
+
+    def test_rejection_expires(self):
+        predicate = is_subject(common_name='Name', negative_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Other'})
+        self.assertEqual(predicate.is_met(environ), False)
+        self.now += 6
+        self.assertEqual(predicate.is_met(environ), False)
+        self.assertEqual(self.cache.stats()['evaluated'], 2)
+        self.assertEqual(self.cache.stats()['saved'], 0)
+
+    def test_authorized_not_cached(self):
+        predicate = is_subject(common_name='Name', negative_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Name'})
+        self.eval_met_predicate(predicate, environ)
+        self.assertEqual(self.cache.stats()['stored'], 0)
+        self.assertEqual(self.cache.stats()['evaluated'], 2)
+
+    def test_keyed_by_certificate(self):
+        predicate = is_subject(common_name='Name', negative_cache=self.cache)
+        self.assertEqual(
+            predicate.is_met(self.make_environ_for_test({'CN': 'Other'})),
+            False
+        )
+        self.eval_met_predicate(predicate,
+                                self.make_environ_for_test({'CN': 'Name'}))
+
+    def test_keyed_by_predicate(self):
+        subject = is_subject(common_name='Other', negative_cache=self.cache)
+        issuer = is_issuer(common_name='Other', negative_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Other'})
+        self.assertEqual(issuer.is_met(environ), False)
+        self.eval_met_predicate(subject, environ)
+
+    def test_server_variables_not_cached(self):
+        predicate = is_subject(common_name='Name', negative_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Other'})
+        del environ['SSL_CLIENT_S_DN']
+        environ['SSL_CLIENT_S_DN_CN'] = 'Other'
+        self.assertEqual(predicate.is_met(environ), False)
+        self.assertEqual(self.cache.stats()['stored'], 0)
+
+    def test_rate_limited_log(self):
+        self.cache.log_interval = 2
+        predicate = is_subject(common_name='Name', negative_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Other'})
+        for i in range(3):
+            predicate.is_met(environ)
+        self.assertEqual(len(self.log.messages), 1)
+        self.now += 3
+        predicate.is_met(environ)
+        self.assertEqual(len(self.log.messages), 2)
+        assert self.log.messages[1].startswith('2 requests denied')
+
+    def test_not_yet_valid_rejection(self):
+        from datetime import datetime, timedelta
+        from dateutil.tz import tzutc
+        start = datetime.utcnow().replace(tzinfo=tzutc()) + \
+                timedelta(seconds=2)
+        predicate = is_subject(common_name='Name', negative_cache=self.cache)
+        environ = self.make_environ({'CN': 'CA'}, {'CN': 'Name'}, start=start)
+        self.assertEqual(predicate.is_met(environ), False)
+        # Remembered only until the certificate becomes valid, not for the
+        # five seconds of the cache.
+        self.now += 4
+        self.assertEqual(predicate.is_met(environ), False)
+        self.assertEqual(self.cache.stats()['evaluated'], 2)
+        self.assertEqual(self.cache.stats()['saved'], 0)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from tests import TestX509Base, read_data
+from repoze.what.plugins.x509 import is_signed_by, EnvironSource, \
+     HeaderSource
+from repoze.what.plugins.x509.cache import TTLCache
+
+
+INTERMEDIATE_DN = '/C=US/O=Example/OU=Engineering/CN=Example Intermediate CA'
+ROOT_DN = '/C=US/O=Example Root/CN=Example Root CA'
+INTERMEDIATE_FINGERPRINT = ('D4:82:70:E8:25:62:83:0E:22:A8:93:14:41:7D:2F:A5:'
+                            'FB:F1:56:A8:3A:4D:5B:9A:31:F0:05:C3:A7:9B:1E:B9')
+ROOT_FINGERPRINT = ('FD:22:EB:C0:DF:37:BE:C3:34:9A:9A:0C:BB:6A:CB:76:C3:A1:'
+                    '2B:2D:9E:1F:B0:3D:E4:1C:F1:A3:B0:1F:DD:C5')
+EMAIL_DN = ('/C=US/O=Example/CN=Example Email CA/emailAddress=ca@example.com'
+            '/title=Authority')
+EMAIL_CA_FINGERPRINT = ('A8:BD:19:09:97:03:42:96:C7:36:16:87:89:20:13:29:'
+                        '28:C5:31:55:DA:68:66:E5:7E:FE:6A:F7:93:6F:34:33')
+
+
+class TestIsSignedBy(TestX509Base):
+
+    def setUp(self):
+        self.cache = TTLCache()
+
+    def make_environ_for_test(self, *chain, **kwargs):
+        issuer = kwargs.pop('issuer', INTERMEDIATE_DN)
+        environ = self.make_environ(issuer, {'CN': 'John Smith'}, **kwargs)
+        for n, name in enumerate(chain):
+            environ['SSL_CLIENT_CERT_CHAIN_%d' % n] = read_data(name)
+        return environ
+
+    def test_without_anchors(self):
+        self.assertRaises(ValueError, is_signed_by)
+        self.assertRaises(ValueError, is_signed_by, fingerprints=['AB'])
+
+    def test_anchor_dn(self):
+        predicate = is_signed_by([INTERMEDIATE_DN], cache=self.cache)
+        environ = self.make_environ_for_test('intermediate.pem', 'root.pem')
+        self.eval_met_predicate(predicate, environ)
+
+    def test_anchor_deeper_in_chain(self):
+        predicate = is_signed_by([ROOT_DN], cache=self.cache)
+        environ = self.make_environ_for_test('intermediate.pem', 'root.pem')
+        self.eval_met_predicate(predicate, environ)
+
+    def test_fingerprint(self):
+        predicate = is_signed_by(fingerprints=[ROOT_FINGERPRINT],
+                                 cache=self.cache)
+        environ = self.make_environ_for_test('intermediate.pem', 'root.pem')
+        self.eval_met_predicate(predicate, environ)
+
+    def test_untrusted_chain(self):
+        predicate = is_signed_by([ROOT_DN], cache=self.cache)
+        environ = self.make_environ_for_test('intermediate.pem')
+        self.eval_unmet_predicate(predicate, environ,
+                                  'Invalid SSL client certificate chain.')
+
+    def test_without_chain(self):
+        predicate = is_signed_by([ROOT_DN], cache=self.cache)
+        self.assertEqual(predicate.is_met(self.make_environ_for_test()), False)
+
+    def test_invalid_certificate(self):
+        predicate = is_signed_by([ROOT_DN], cache=self.cache)
+        environ = self.make_environ_for_test('intermediate.pem', 'root.pem',
+                                             verified=False)
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_invalid_chain_element(self):
+        predicate = is_signed_by([ROOT_DN], cache=self.cache)
+        environ = self.make_environ_for_test('intermediate.pem', 'root.pem')
+        environ['SSL_CLIENT_CERT_CHAIN_0'] = 'invalid'
+        # The root is not reached without the intermediate certificate.
+        self.eval_unmet_predicate(predicate, environ,
+                                  'Invalid SSL client certificate chain.')
+
+    def test_chain_in_any_order(self):
+        predicate = is_signed_by([ROOT_DN], cache=self.cache)
+        environ = self.make_environ_for_test('root.pem', 'intermediate.pem')
+        self.eval_met_predicate(predicate, environ)
+
+    def test_appended_anchor(self):
+        # A trusted certificate that does not issue the client certificate
+        # (nor its issuers) is not enough.
+        for anchors, fingerprints in (([ROOT_DN], ()),
+                                      ((), [ROOT_FINGERPRINT])):
+            predicate = is_signed_by(anchors, fingerprints, cache=self.cache)
+            environ = self.make_environ_for_test('root.pem',
+                                                 issuer={'CN': 'Evil CA'})
+            self.eval_unmet_predicate(predicate, environ,
+                                      'Invalid SSL client certificate chain.')
+            environ = self.make_environ_for_test('other.pem', 'root.pem')
+            self.eval_unmet_predicate(predicate, environ,
+                                      'Invalid SSL client certificate chain.')
+
+    def test_issuer_with_email(self):
+        # The distinguished names of the chain are compared with the ones of
+        # mod_ssl, which uses the OpenSSL names of the attribute types.
+        predicate = is_signed_by(fingerprints=[EMAIL_CA_FINGERPRINT],
+                                 cache=self.cache)
+        environ = self.make_environ_for_test('email_ca.pem', issuer=EMAIL_DN)
+        self.eval_met_predicate(predicate, environ)
+
+    def test_without_issuer(self):
+        predicate = is_signed_by([ROOT_DN], cache=self.cache)
+        environ = self.make_environ_for_test('intermediate.pem', 'root.pem')
+        del environ['SSL_CLIENT_I_DN']
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_stops_at_anchor(self):
+        predicate = is_signed_by([INTERMEDIATE_DN], cache=self.cache)
+        environ = self.make_environ_for_test('intermediate.pem', 'root.pem')
+        self.eval_met_predicate(predicate, environ)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_decoded_once_per_process(self):
+        predicate = is_signed_by([ROOT_DN], cache=self.cache,
+                                 source=EnvironSource())
+        self.eval_met_predicate(
+            predicate,
+            self.make_environ_for_test('intermediate.pem', 'root.pem')
+        )
+        self.assertEqual(len(self.cache), 2)
+        # A different client with the same chain.
+        environ = self.make_environ_for_test('intermediate.pem', 'root.pem')
+        predicate.source.get_certificate = None
+        self.eval_met_predicate(predicate, environ)
+
+    def test_header_source(self):
+        predicate = is_signed_by([ROOT_DN], cache=self.cache,
+                                 source=HeaderSource(encoding='plain'))
+        environ = {
+            'HTTP_SSL_CLIENT_VERIFY': 'SUCCESS',
+            'HTTP_SSL_CLIENT_I_DN': ROOT_DN,
+            'HTTP_SSL_CLIENT_CERT_CHAIN_0': read_data('root.pem'),
+        }
+        self.eval_met_predicate(predicate, environ)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from tests import TestX509Base
+from repoze.what.plugins.x509.clock import CoarseClock, Validity, \
+     get_clock, validity_window
+
+
+class TestCoarseClock(TestX509Base):
+
+    def setUp(self):
+        self.now = 1000.25
+        self.clock = CoarseClock(500, timer=lambda: self.now)
+
+    def test_now_is_integer(self):
+        self.assertEqual(self.clock.now(), 1000)
+
+    def test_does_not_refresh_before_resolution(self):
+        self.clock.now()
+        self.now = 1001.5
+        self.assertEqual(self.clock.now(), 1001)
+        self.now = 1001.9
+        self.assertEqual(self.clock.now(), 1001)
+        self.now = 1002.1
+        self.assertEqual(self.clock.now(), 1002)
+
+    def test_invalid_resolution(self):
+        self.assertRaises(ValueError, CoarseClock, -1)
+
+    def test_shared_clock(self):
+        assert get_clock(250) is get_clock(250)
+        assert get_clock(250) is not get_clock(500)
+
+
+class TestValidityWindow(TestX509Base):
+
+    def test_utc(self):
+        self.assertEqual(
+            validity_window('Jan 01 00:00:00 2000 UTC',
+                            'Jan 01 00:00:00 2001 GMT'),
+            (946684800, 978307200)
+        )
+
+    def test_other_timezone(self):
+        self.assertEqual(
+            validity_window('Jan 01 00:00:00 2000 +0100',
+                            'Jan 01 00:00:00 2001 UTC'),
+            None
+        )
+
+    def test_invalid(self):
+        self.assertEqual(validity_window('invalid', 'invalid'), None)
+
+
+class TestValidity(TestX509Base):
+
+    def test_valid(self):
+        validity = Validity(1000, 5000, 1500)
+        self.assertEqual(validity.elapsed, 500)
+        self.assertEqual(validity.remaining, 3500)
+        self.assertEqual(validity.is_valid, True)
+        self.assertEqual(validity.ttl(), 3500)
+        self.assertEqual(validity.ttl(300), 300)
+
+    def test_expired(self):
+        validity = Validity(1000, 5000, 6000)
+        self.assertEqual(validity.remaining, -1000)
+        self.assertEqual(validity.is_valid, False)
+        self.assertEqual(validity.ttl(300), 0)
+
+    def test_not_yet_valid(self):
+        validity = Validity(1000, 5000, 900)
+        self.assertEqual(validity.elapsed, -100)
+        self.assertEqual(validity.is_valid, False)
+        self.assertEqual(validity.ttl(), 100)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from tests import TestX509Base, read_data
+from repoze.what.plugins.x509.der import Certificate, decode_oid, \
+     decode_time
+from repoze.what.plugins.x509.sources import EnvironSource
+
+
+def load_certificate(name):
+    environ = {'SSL_CLIENT_CERT': read_data(name)}
+    return EnvironSource().get_certificate(environ)
+
+
+class TestCertificate(TestX509Base):
+
+    def test_serial(self):
+        self.assertEqual(load_certificate('client.pem').serial, 0x1A2B3C4D5E)
+
+    def test_validity(self):
+        certificate = load_certificate('client.pem')
+        # UTCTime and GeneralizedTime, respectively.
+        self.assertEqual(certificate.not_before, 1792422395)
+        self.assertEqual(certificate.not_after, 4816422395)
+
+    def test_distinguished_names(self):
+        certificate = load_certificate('client.pem')
+        self.assertEqual(
+            certificate.subject_dn,
+            '/C=US/ST=California/L=San Diego/O=Example/OU=Engineering'
+            '/OU=Operations/CN=John Smith'
+        )
+        self.assertEqual(
+            certificate.issuer_dn,
+            '/C=US/O=Example/OU=Engineering/CN=Example Intermediate CA'
+        )
+
+    def test_openssl_attribute_types(self):
+        self.assertEqual(
+            load_certificate('email_ca.pem').subject_dn,
+            '/C=US/O=Example/CN=Example Email CA/emailAddress=ca@example.com'
+            '/title=Authority'
+        )
+
+    def test_extensions(self):
+        certificate = load_certificate('client.pem')
+        self.assertEqual(certificate.extensions['2.5.29.15'][0], True)
+        self.assertEqual(certificate.extensions['2.5.29.37'][0], False)
+        assert '2.5.29.37' not in load_certificate('root.pem').extensions
+
+    def test_extended_key_usage(self):
+        self.assertEqual(load_certificate('client.pem').extended_key_usage,
+                         ('1.3.6.1.5.5.7.3.2', '1.3.6.1.5.5.7.3.4'))
+        self.assertEqual(load_certificate('root.pem').extended_key_usage,
+                         None)
+
+    def test_key_usage(self):
+        # digitalSignature and keyEncipherment
+        self.assertEqual(load_certificate('client.pem').key_usage, 0x05)
+        # keyCertSign and cRLSign
+        self.assertEqual(load_certificate('root.pem').key_usage, 0x60)
+        self.assertEqual(load_certificate('other.pem').key_usage, None)
+
+    def test_policies(self):
+        self.assertEqual(load_certificate('client.pem').policies,
+                         ('1.3.6.1.4.1.99999.1.1', '2.23.140.1.2.1'))
+        self.assertEqual(load_certificate('other.pem').policies, ())
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, Certificate, '')
+        self.assertRaises(ValueError, Certificate, '\x30\x05\x02\x01')
+        der = load_certificate('client.pem').der
+        self.assertRaises(ValueError, Certificate, der[:200])
+
+
+class TestDecodeOID(TestX509Base):
+
+    def test_decode(self):
+        self.assertEqual(decode_oid('\x55\x04\x03'), '2.5.4.3')
+        self.assertEqual(decode_oid('\x2b\x06\x01\x05\x05\x07\x03\x02'),
+                         '1.3.6.1.5.5.7.3.2')
+        self.assertEqual(decode_oid('\x67\x81\x0c\x01\x02\x01'),
+                         '2.23.140.1.2.1')
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, decode_oid, '')
+
+
+class TestDecodeTime(TestX509Base):
+
+    def test_decode(self):
+        self.assertEqual(decode_time('120101000000Z'), 1325376000)
+        self.assertEqual(decode_time('20120101000000Z'), 1325376000)
+        self.assertEqual(decode_time('991231235959Z'), 946684799)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, decode_time, '120101000000')
+        self.assertRaises(ValueError, decode_time, '1201010000Z')
+        self.assertRaises(ValueError, decode_time, '121301000000Z')
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import socket
+
+from tests import TestX509Base
+from repoze.what.plugins.x509 import is_subject, is_issuer, is_client, \
+     is_serial_in, is_subject_in, Schedule, DecisionCache, LocalBackend, \
+     MemcachedBackend, LoopbackMemcachedServer, TenantIndex, in_tenant, \
+     x509_rate_limited, RateLimitTable
+from repoze.what.plugins.x509.distributed import BackendError, \
+     predicate_name
+from repoze.what.plugins.x509.tenants import ENVIRON_TENANT_KEY
+
+
+class _Log(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def warn(self, message):
+        self.messages.append(message)
+
+
+class _Backend(LocalBackend):
+    # Records the TTLs of the stored entries.
+
+    def __init__(self):
+        super(_Backend, self).__init__()
+        self.ttls = []
+        self.gets = 0
+
+    def get_multi(self, keys):
+        self.gets += 1
+        return super(_Backend, self).get_multi(keys)
+
+    def set_multi(self, mapping, ttl):
+        self.ttls.append(ttl)
+        super(_Backend, self).set_multi(mapping, ttl)
+
+
+class _FailingBackend(LocalBackend):
+
+    def get_multi(self, keys):
+        raise BackendError('Timeout')
+
+    def set_multi(self, mapping, ttl):
+        raise BackendError('Timeout')
+
+
+class TestDecisionCache(TestX509Base):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.log = _Log()
+        self.backend = _Backend()
+        self.cache = DecisionCache(self.backend, ttl=60, log=self.log,
+                                   retry_interval=5, timer=lambda: self.now)
+
+    def make_environ_for_test(self, subject):
+        return self.make_environ({'CN': 'CA'}, subject)
+
+    def test_decision_shared_between_predicates(self):
+        # Two equal predicates, as if they were built by two nodes.
+        first = is_subject(common_name='Name', decision_cache=self.cache)
+        second = is_subject(common_name='Name', decision_cache=self.cache)
+        self.eval_met_predicate(first, self.make_environ_for_test(
+            {'CN': 'Name'}
+        ))
+        self.eval_met_predicate(second, self.make_environ_for_test(
+            {'CN': 'Name'}
+        ))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.stats()['hits'], 3)
+
+    def test_rejection_shared(self):
+        first = is_subject(common_name='Name', decision_cache=self.cache)
+        second = is_subject(common_name='Name', decision_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Other'})
+        self.eval_unmet_predicate(first, environ,
+                                  'Invalid SSL client subject.')
+        self.eval_unmet_predicate(second,
+                                  self.make_environ_for_test({'CN': 'Other'}),
+                                  'Invalid SSL client subject.')
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.backend.ttls, [60])
+
+    def test_keyed_by_predicate(self):
+        subject = is_subject(common_name='Other', decision_cache=self.cache)
+        issuer = is_issuer(common_name='Other', decision_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Other'})
+        self.assertEqual(issuer.is_met(environ), False)
+        self.eval_met_predicate(subject, environ)
+        self.assertNotEqual(predicate_name(subject), predicate_name(issuer))
+
+    def test_different_constraints_not_shared(self):
+        alice = is_subject(common_name='Alice', decision_cache=self.cache)
+        admin = is_subject(common_name='Admin', decision_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Alice'})
+        self.eval_met_predicate(alice, environ)
+        self.eval_unmet_predicate(admin,
+                                  self.make_environ_for_test({'CN': 'Alice'}),
+                                  'Invalid SSL client subject.')
+
+    def test_different_objects_not_shared(self):
+        environ = self.make_environ_for_test({'CN': 'Alice'})
+        environ['SSL_CLIENT_M_SERIAL'] = '10'
+        self.eval_met_predicate(
+            is_serial_in(['0-FF'], decision_cache=self.cache), environ
+        )
+        self.assertEqual(
+            is_serial_in(['100-1FF'], decision_cache=self.cache).is_met(
+                dict(environ)
+            ),
+            False
+        )
+        self.eval_met_predicate(
+            is_subject_in(['/CN=Alice'], decision_cache=self.cache),
+            dict(environ)
+        )
+        self.assertEqual(
+            is_subject_in(['/CN=Admin'], decision_cache=self.cache).is_met(
+                dict(environ)
+            ),
+            False
+        )
+        self.eval_met_predicate(
+            is_client(subject={'common_name': 'Alice'},
+                      decision_cache=self.cache),
+            dict(environ)
+        )
+        self.assertEqual(
+            is_client(subject={'common_name': 'Admin'},
+                      decision_cache=self.cache).is_met(dict(environ)),
+            False
+        )
+
+    def test_keyed_by_constraints(self):
+        first = is_subject(common_name='Name')
+        second = is_subject(common_name='Other')
+        self.assertEqual(predicate_name(first),
+                         predicate_name(is_subject(common_name='Name')))
+        self.assertNotEqual(predicate_name(first), predicate_name(second))
+
+    def test_ttl_bounded_by_expiration(self):
+        from datetime import datetime, timedelta
+        from dateutil.tz import tzutc
+        end = datetime.utcnow().replace(tzinfo=tzutc()) + \
+              timedelta(seconds=30)
+        predicate = is_subject(common_name='Name', decision_cache=self.cache)
+        environ = self.make_environ({'CN': 'CA'}, {'CN': 'Name'}, end=end)
+        self.assertEqual(predicate.is_met(environ), True)
+        self.assertEqual(len(self.backend.ttls), 1)
+        # The clock of the predicate may lag for up to one second.
+        assert 0 < self.backend.ttls[0] <= 31
+
+    def test_not_yet_valid_rejection(self):
+        from datetime import datetime, timedelta
+        from dateutil.tz import tzutc
+        start = datetime.utcnow().replace(tzinfo=tzutc()) + \
+                timedelta(seconds=20)
+        predicate = is_subject(common_name='Name', decision_cache=self.cache)
+        environ = self.make_environ({'CN': 'CA'}, {'CN': 'Name'}, start=start)
+        self.assertEqual(predicate.is_met(environ), False)
+        assert 0 < self.backend.ttls[0] <= 21
+
+    def test_server_variables_not_cached(self):
+        predicate = is_subject(common_name='Name', decision_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Other'})
+        del environ['SSL_CLIENT_S_DN']
+        environ['SSL_CLIENT_S_DN_CN'] = 'Other'
+        self.assertEqual(predicate.is_met(environ), False)
+        self.assertEqual(self.backend.ttls, [])
+
+    def test_scheduled_predicate_not_cached(self):
+        predicate = is_subject(common_name='Name', decision_cache=self.cache,
+                               schedule=Schedule(['* 00:00-24:00']))
+        self.eval_met_predicate(predicate,
+                                self.make_environ_for_test({'CN': 'Name'}))
+        self.assertEqual(self.backend.ttls, [])
+
+    def test_predicates_with_effects_not_cached(self):
+        index = TenantIndex({('Name',): 'tenant'}, attributes=('CN',))
+        predicate = in_tenant(index, decision_cache=self.cache)
+        for _ in range(2):
+            environ = self.make_environ_for_test({'CN': 'Name'})
+            self.eval_met_predicate(predicate, environ)
+            self.assertEqual(environ[ENVIRON_TENANT_KEY], 'tenant')
+        predicate = x509_rate_limited(1, table=RateLimitTable(slots=64),
+                                      decision_cache=self.cache)
+        self.eval_met_predicate(predicate,
+                                self.make_environ_for_test({'CN': 'Name'}))
+        self.assertEqual(
+            predicate.is_met(self.make_environ_for_test({'CN': 'Name'})),
+            False
+        )
+        self.assertEqual(self.backend.ttls, [])
+
+    def test_prefetch(self):
+        first = is_subject(common_name='Name', decision_cache=self.cache)
+        second = is_issuer(common_name='CA', decision_cache=self.cache)
+        environ = self.make_environ_for_test({'CN': 'Name'})
+        self.cache.prefetch(environ, [first, second])
+        self.assertEqual(self.backend.gets, 1)
+        self.eval_met_predicate(first, environ)
+        self.eval_met_predicate(second, environ)
+        self.assertEqual(self.backend.gets, 1)
+
+    def test_fail_open(self):
+        cache = DecisionCache(_FailingBackend(), log=self.log,
+                              retry_interval=5, timer=lambda: self.now)
+        predicate = is_subject(common_name='Name', decision_cache=cache)
+        self.eval_met_predicate(predicate,
+                                self.make_environ_for_test({'CN': 'Name'}))
+        self.eval_unmet_predicate(predicate,
+                                  self.make_environ_for_test({'CN': 'Other'}),
+                                  'Invalid SSL client subject.')
+        # The backend is not used again until the retry interval elapses.
+        self.assertEqual(cache.stats()['errors'], 1)
+        self.assertEqual(len(self.log.messages), 1)
+        self.now += 6
+        predicate.is_met(self.make_environ_for_test({'CN': 'Name'}))
+        self.assertEqual(cache.stats()['errors'], 2)
+
+
+class TestMemcachedBackend(TestX509Base):
+
+    def setUp(self):
+        self.server = LoopbackMemcachedServer().start()
+        self.backend = MemcachedBackend([self.server.address], timeout=1,
+                                        pool_size=2)
+
+    def tearDown(self):
+        self.backend.close()
+        self.server.stop()
+
+    def test_set_and_get(self):
+        self.backend.set_multi({'a': '1', 'b': '0'}, 60)
+        self.assertEqual(self.backend.get_multi(['a', 'b', 'c']),
+                         {'a': '1', 'b': '0'})
+
+    def test_expiration(self):
+        self.server.store.timer = lambda: 0
+        self.backend.set_multi({'a': '1'}, 60)
+        # The sets are not replied, so wait until it is stored.
+        self.assertEqual(self.backend.get_multi(['a']), {'a': '1'})
+        self.server.store.timer = lambda: 61
+        self.assertEqual(self.backend.get_multi(['a']), {})
+
+    def test_connections_pooled(self):
+        for i in range(5):
+            self.backend.set_multi({'a': str(i)}, 60)
+            self.assertEqual(self.backend.get_multi(['a']), {'a': str(i)})
+        self.assertEqual(self.backend._pools[0].qsize(), 1)
+
+    def test_several_servers(self):
+        other = LoopbackMemcachedServer().start()
+        try:
+            backend = MemcachedBackend([self.server.address, other.address],
+                                       timeout=1)
+            mapping = dict(('key%d' % i, str(i)) for i in range(20))
+            backend.set_multi(mapping, 60)
+            self.assertEqual(backend.get_multi(mapping.keys()), mapping)
+            assert len(self.server.store) > 0
+            assert len(other.store) > 0
+        finally:
+            other.stop()
+
+    def test_unavailable_server(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        address = listener.getsockname()
+        listener.close()
+        backend = MemcachedBackend([address], timeout=0.5)
+        self.assertRaises(BackendError, backend.get_multi, ['a'])
+        self.assertRaises(BackendError, backend.set_multi, {'a': '1'}, 60)
+
+    def test_timeout(self):
+        # A server that accepts the connection but never replies.
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        try:
+            backend = MemcachedBackend([listener.getsockname()],
+                                       timeout=0.05)
+            self.assertRaises(BackendError, backend.get_multi, ['a'])
+            self.assertEqual(backend._pools[0].qsize(), 0)
+        finally:
+            listener.close()
+
+    def test_decision_cache(self):
+        cache = DecisionCache(self.backend)
+        predicate = is_subject(common_name='Name', decision_cache=cache)
+        # Both requests share the certificate, validity dates included.
+        base = self.make_environ({'CN': 'CA'}, {'CN': 'Name'})
+        environ = dict(base)
+        self.eval_met_predicate(predicate, environ)
+        # The sets are not replied, so wait until it is stored.
+        self.assertEqual(len(self.backend.get_multi(
+            [environ['repoze.what.x509.decisions'].keys()[0]]
+        )), 1)
+        self.assertEqual(len(self.server.store), 1)
+        self.eval_met_predicate(predicate, dict(base))
+        self.assertEqual(cache.stats()['misses'], 1)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzutc
+
+from tests import TestX509Base
+from repoze.what.plugins.x509 import ExpiryHeaderMiddleware, expiry_headers, \
+     X509Predicate, HAProxySource
+from repoze.what.plugins.x509.clock import CoarseClock
+
+
+def make_predicate(now, **kwargs):
+    predicate = X509Predicate(**kwargs)
+    predicate.clock = CoarseClock(1000, timer=lambda: now)
+    return predicate
+
+
+class TestExpiryHeaders(TestX509Base):
+
+    def make_environ_for_test(self):
+        return {'SSL_CLIENT_VERIFY': 'SUCCESS',
+                'SSL_CLIENT_V_START': 'Jan  1 00:00:00 2012 GMT',
+                'SSL_CLIENT_V_END': 'Jan  2 00:00:00 2012 GMT'}
+
+    def test_remaining_seconds(self):
+        predicate = make_predicate(1325376000 + 400)
+        self.assertEqual(
+            expiry_headers(self.make_environ_for_test(), predicate),
+            [('X-SSL-Client-Cert-TTL', '86000')]
+        )
+
+    def test_max_ttl(self):
+        predicate = make_predicate(1325376000 + 400)
+        self.assertEqual(
+            expiry_headers(self.make_environ_for_test(), predicate,
+                           'X-TTL', 60),
+            [('X-TTL', '60')]
+        )
+
+    def test_expired(self):
+        predicate = make_predicate(1325376000 + 86401)
+        self.assertEqual(
+            expiry_headers(self.make_environ_for_test(), predicate),
+            []
+        )
+
+    def test_unknown_validity(self):
+        self.assertEqual(expiry_headers({}), [])
+
+    def test_default_predicate(self):
+        end = datetime.utcnow().replace(tzinfo=tzutc()) + \
+              relativedelta(days=1)
+        environ = self.make_environ({'CN': 'CA'}, {'CN': 'Name'}, end=end)
+        headers = expiry_headers(environ)
+        # The clock is truncated to the second.
+        assert 86000 < int(headers[0][1]) <= 86401
+
+    def test_source(self):
+        predicate = make_predicate(1325376000 + 400, source=HAProxySource())
+        environ = {'HTTP_X_SSL_CLIENT_NOTBEFORE': '120101000000Z',
+                   'HTTP_X_SSL_CLIENT_NOTAFTER': '120102000000Z'}
+        self.assertEqual(expiry_headers(environ, predicate),
+                         [('X-SSL-Client-Cert-TTL', '86000')])
+
+
+class TestExpiryHeaderMiddleware(TestX509Base):
+
+    def setUp(self):
+        self.status = '200 OK'
+        self.predicate = make_predicate(1325376000 + 400)
+        self.middleware = ExpiryHeaderMiddleware(self.app, self.predicate)
+
+    def app(self, environ, start_response):
+        start_response(self.status, [('Content-Type', 'text/plain')])
+        return ['body']
+
+    def call(self):
+        environ = {'SSL_CLIENT_V_START': 'Jan  1 00:00:00 2012 GMT',
+                   'SSL_CLIENT_V_END': 'Jan  2 00:00:00 2012 GMT'}
+        responses = []
+        body = self.middleware(
+            environ,
+            lambda status, headers, exc_info=None: responses.append(headers)
+        )
+        self.assertEqual(body, ['body'])
+        return responses[0]
+
+    def test_successful_response(self):
+        self.assertEqual(self.call(), [('Content-Type', 'text/plain'),
+                                       ('X-SSL-Client-Cert-TTL', '86000')])
+
+    def test_denied_response(self):
+        self.status = '403 Forbidden'
+        self.assertEqual(self.call(), [('Content-Type', 'text/plain')])
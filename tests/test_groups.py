@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from unittest import TestCase
+
+from repoze.what.adapters import SourceError
+from repoze.what.middleware import AuthorizationMetadata
+from repoze.what.plugins.x509 import X509GroupAdapter
+from repoze.what.plugins.x509.groups import parse_attribute
+
+
+SUBJECT = ('/C=US/ST=California/L=San Diego/O=Example/OU=Engineering/'
+           'OU=Operations/CN=John Smith')
+
+GROUPS = {
+    'developers': ['OU=Engineering'],
+    'operators': ['OU=Operations', ('OU', 'Support')],
+    'partners': ['O=Other'],
+    'staff': ['O=Example'],
+}
+
+
+class TestParseAttribute(TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_attribute('OU=Engineering'),
+                         ('OU', 'Engineering'))
+        self.assertEqual(parse_attribute(('OU', 'A=B')), ('OU', 'A=B'))
+        self.assertEqual(parse_attribute('CN=A=B'), ('CN', 'A=B'))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_attribute, 'Engineering')
+        self.assertRaises(ValueError, parse_attribute, '=Engineering')
+
+
+class TestX509GroupAdapter(TestCase):
+
+    def setUp(self):
+        self.adapter = X509GroupAdapter(GROUPS)
+
+    def test_find_sections(self):
+        groups = self.adapter.find_sections({'subject': SUBJECT,
+                                             'repoze.what.userid': 'jsmith'})
+        self.assertEqual(set(groups),
+                         set(['developers', 'operators', 'staff']))
+
+    def test_without_subject(self):
+        self.assertEqual(set(self.adapter.find_sections({})), set())
+        self.assertEqual(set(self.adapter.find_sections(u'developers')),
+                         set())
+
+    def test_invalid_subject(self):
+        self.assertEqual(set(self.adapter.find_sections({'subject': 'x'})),
+                         set())
+
+    def test_cached(self):
+        self.adapter.groups_of(SUBJECT)
+        self.adapter._table.clear()
+        self.assertEqual(self.adapter.groups_of(SUBJECT),
+                         frozenset(['developers', 'operators', 'staff']))
+        self.adapter.cache.clear()
+        self.assertEqual(self.adapter.groups_of(SUBJECT), frozenset())
+
+    def test_normalize(self):
+        adapter = X509GroupAdapter({'developers': [u'OU=ENGINEERING ']},
+                                   normalize=True)
+        self.assertEqual(adapter.groups_of(SUBJECT),
+                         frozenset(['developers']))
+
+    def test_sections(self):
+        sections = self.adapter.get_all_sections()
+        self.assertEqual(sorted(sections.keys()), sorted(GROUPS.keys()))
+        self.assertEqual(self.adapter.get_section_items('operators'),
+                         set(['OU=Operations', 'OU=Support']))
+        assert self.adapter._item_is_included('operators', 'OU=Support')
+        assert not self.adapter._item_is_included('staff', 'OU=Support')
+
+    def test_read_only(self):
+        self.assertRaises(SourceError, self.adapter.include_item,
+                          'developers', 'OU=Research')
+        self.assertRaises(SourceError, self.adapter.create_section, 'new')
+
+    def test_metadata_provider(self):
+        metadata = AuthorizationMetadata({'x509': self.adapter}, {})
+        identity = {'repoze.who.userid': 'jsmith', 'subject': SUBJECT}
+        metadata.add_metadata({}, identity)
+        self.assertEqual(set(identity['groups']),
+                         set(['developers', 'operators', 'staff']))
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from unittest import TestCase
+
+from repoze.what.adapters import SourceError
+from repoze.what.middleware import AuthorizationMetadata
+from repoze.what.plugins.x509 import X509PermissionAdapter, \
+     X509GroupAdapter, X509AuthorizationMetadata, setup_x509_auth
+
+
+SUBJECT = ('/C=US/ST=California/L=San Diego/O=Example/OU=Engineering/'
+           'OU=Operations/CN=John Smith')
+ISSUER = '/C=US/O=Example/OU=Engineering/CN=Example Intermediate CA'
+
+PERMISSIONS = {
+    'deploy': ['admins', 'OU=Operations'],
+    'review': ['developers', 'OU=Engineering'],
+    'audit': ['issuer:CN=Example Intermediate CA'],
+    'billing': ['O=Other', 'issuer:O=Other'],
+}
+
+
+class TestX509PermissionAdapter(TestCase):
+
+    def setUp(self):
+        self.adapter = X509PermissionAdapter(PERMISSIONS)
+
+    def test_by_group(self):
+        self.assertEqual(set(self.adapter.find_sections(u'admins')),
+                         set(['deploy']))
+        self.assertEqual(set(self.adapter.find_sections(u'nobody')), set())
+
+    def test_by_identity(self):
+        credentials = {'subject': SUBJECT, 'issuer': ISSUER}
+        self.assertEqual(set(self.adapter.find_sections(credentials)),
+                         set(['deploy', 'review', 'audit']))
+        self.assertEqual(
+            set(self.adapter.find_sections({'subject': '/O=Other/CN=Jane'})),
+            set(['billing'])
+        )
+
+    def test_identity_and_groups(self):
+        credentials = {'subject': '/O=Other/CN=Jane', 'groups': ('admins',)}
+        self.assertEqual(set(self.adapter.find_sections(credentials)),
+                         set(['billing', 'deploy']))
+
+    def test_invalid_identity(self):
+        self.assertEqual(self.adapter.permissions_of('invalid', 'invalid'),
+                         frozenset())
+        self.assertEqual(self.adapter.permissions_of(), frozenset())
+
+    def test_shared_permissions(self):
+        first = self.adapter.permissions_of('/OU=Operations/CN=A')
+        second = self.adapter.permissions_of('/OU=Operations/CN=B')
+        assert first is second
+
+    def test_bounded_cache(self):
+        adapter = X509PermissionAdapter(PERMISSIONS, max_size=10)
+        for n in range(100):
+            adapter.permissions_of('/OU=Operations/CN=%d' % n)
+        self.assertEqual(len(adapter.cache), 10)
+
+    def test_normalize(self):
+        adapter = X509PermissionAdapter({'deploy': [u'OU=OPERATIONS ']},
+                                        normalize=True)
+        self.assertEqual(adapter.permissions_of(SUBJECT),
+                         frozenset(['deploy']))
+
+    def test_sections(self):
+        self.assertEqual(sorted(self.adapter.get_all_sections().keys()),
+                         sorted(PERMISSIONS.keys()))
+        self.assertEqual(self.adapter.get_section_items('billing'),
+                         set(['O=Other', 'issuer:O=Other']))
+        assert self.adapter._item_is_included('audit',
+                                              'issuer:CN=Example '
+                                              'Intermediate CA')
+        assert not self.adapter._item_is_included('audit', 'admins')
+
+    def test_invalid_item(self):
+        self.assertRaises(ValueError, X509PermissionAdapter,
+                          {'deploy': ['=Operations']})
+
+    def test_read_only(self):
+        self.assertRaises(SourceError, self.adapter.include_item, 'deploy',
+                          'developers')
+
+    def test_metadata_provider(self):
+        groups = X509GroupAdapter({'developers': ['OU=Engineering']})
+        metadata = AuthorizationMetadata({'x509': groups},
+                                         {'x509': self.adapter})
+        identity = {'repoze.who.userid': 'jsmith', 'subject': SUBJECT}
+        metadata.add_metadata({}, identity)
+        # repoze.what only asks for the permissions of the groups.
+        self.assertEqual(set(identity['permissions']), set(['review']))
+
+    def test_x509_metadata_provider(self):
+        groups = X509GroupAdapter({'developers': ['OU=Engineering']})
+        metadata = X509AuthorizationMetadata({'x509': groups},
+                                             {'x509': self.adapter})
+        identity = {'repoze.who.userid': 'jsmith', 'subject': SUBJECT}
+        environ = {'SSL_CLIENT_I_DN': ISSUER}
+        metadata.add_metadata(environ, identity)
+        self.assertEqual(identity['groups'], ('developers',))
+        self.assertEqual(set(identity['permissions']),
+                         set(['deploy', 'review', 'audit']))
+        self.assertEqual(
+            set(environ['repoze.what.credentials']['permissions']),
+            set(['deploy', 'review', 'audit'])
+        )
+
+    def test_x509_metadata_provider_without_groups(self):
+        metadata = X509AuthorizationMetadata(None, {'x509': self.adapter})
+        identity = {'repoze.who.userid': 'jane',
+                    'subject': '/O=Other/CN=Jane'}
+        metadata.add_metadata({}, identity)
+        self.assertEqual(identity['permissions'], ('billing',))
+
+    def test_setup_x509_auth(self):
+        app = setup_x509_auth(object(), None, {'x509': self.adapter},
+                              identifiers=[], authenticators=[],
+                              challengers=[])
+        provider = app.name_registry['authorization_md']
+        assert isinstance(provider, X509AuthorizationMetadata)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from tests import TestX509Base, read_data
+from repoze.what.plugins.x509 import is_pinned, PinSet, write_pin_file
+from repoze.what.plugins.x509.pinning import parse_fingerprint
+
+
+CERT_FINGERPRINT = ('24:FB:7D:9C:4E:F9:47:3B:7B:82:8A:CF:97:CA:B1:DA:64:0A:78:'
+                    '1F:77:BF:5F:90:FE:61:F4:41:28:B6:C3:FE')
+SPKI_FINGERPRINT = ('842b96d8d0929557677cb475a96ee72b94928f2320f24e2897e7d668'
+                    '6868ba70')
+OTHER_FINGERPRINTS = [hashlib.sha256(str(n)).hexdigest() for n in range(1000)]
+
+
+class _TestPinnedBase(TestX509Base):
+
+    def make_environ_for_test(self, name='client.pem', **kwargs):
+        environ = self.make_environ({'CN': 'CA'}, {'CN': 'Name'}, **kwargs)
+        environ['SSL_CLIENT_CERT'] = read_data(name)
+        return environ
+
+
+class TestParseFingerprint(TestX509Base):
+
+    def test_formats(self):
+        raw = parse_fingerprint(CERT_FINGERPRINT)
+        self.assertEqual(len(raw), 32)
+        self.assertEqual(parse_fingerprint(raw), raw)
+        self.assertEqual(
+            parse_fingerprint(CERT_FINGERPRINT.replace(':', '').lower()),
+            raw
+        )
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_fingerprint, 'xyz')
+        self.assertRaises(ValueError, parse_fingerprint, 'abcd')
+
+
+class TestPinSet(TestX509Base):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'pins.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_membership(self):
+        count = write_pin_file(self.path, OTHER_FINGERPRINTS +
+                               OTHER_FINGERPRINTS[:10])
+        self.assertEqual(count, 1000)
+        pins = PinSet(self.path)
+        self.assertEqual(len(pins), 1000)
+        for fingerprint in OTHER_FINGERPRINTS:
+            assert parse_fingerprint(fingerprint) in pins
+        assert parse_fingerprint(CERT_FINGERPRINT) not in pins
+        assert 'short' not in pins
+        pins.close()
+
+    def test_without_bloom_filter(self):
+        write_pin_file(self.path, OTHER_FINGERPRINTS, bloom_bits_per_pin=0)
+        pins = PinSet(self.path)
+        assert parse_fingerprint(OTHER_FINGERPRINTS[500]) in pins
+        assert parse_fingerprint(CERT_FINGERPRINT) not in pins
+
+    def test_empty(self):
+        write_pin_file(self.path, [])
+        assert parse_fingerprint(CERT_FINGERPRINT) not in PinSet(self.path)
+
+    def test_invalid_file(self):
+        open(self.path, 'wb').write('not a pin file at all, really')
+        self.assertRaises(ValueError, PinSet, self.path)
+        write_pin_file(self.path, OTHER_FINGERPRINTS)
+        open(self.path, 'ab').write('x')
+        self.assertRaises(ValueError, PinSet, self.path)
+
+    def test_predicate(self):
+        write_pin_file(self.path, OTHER_FINGERPRINTS + [CERT_FINGERPRINT])
+        predicate = is_pinned(PinSet(self.path))
+        environ = {'SSL_CLIENT_VERIFY': 'SUCCESS',
+                   'SSL_CLIENT_CERT': read_data('client.pem')}
+        self.eval_met_predicate(predicate, environ)
+
+
+class TestIsPinned(_TestPinnedBase):
+
+    def test_fingerprint(self):
+        predicate = is_pinned([CERT_FINGERPRINT])
+        self.eval_met_predicate(predicate, self.make_environ_for_test())
+
+    def test_spki_fingerprint(self):
+        predicate = is_pinned([SPKI_FINGERPRINT], spki=True)
+        self.eval_met_predicate(predicate, self.make_environ_for_test())
+
+    def test_fail_not_pinned(self):
+        predicate = is_pinned([CERT_FINGERPRINT])
+        environ = self.make_environ_for_test('other.pem')
+        self.eval_unmet_predicate(predicate, environ, is_pinned.message)
+
+    def test_fail_spki_of_certificate(self):
+        predicate = is_pinned([CERT_FINGERPRINT], spki=True)
+        self.eval_unmet_predicate(predicate, self.make_environ_for_test(),
+                                  is_pinned.message)
+
+    def test_fail_without_certificate(self):
+        predicate = is_pinned([CERT_FINGERPRINT])
+        environ = self.make_environ_for_test()
+        del environ['SSL_CLIENT_CERT']
+        self.eval_unmet_predicate(predicate, environ, is_pinned.message)
+
+    def test_fail_invalid_certificate(self):
+        predicate = is_pinned([CERT_FINGERPRINT], spki=True)
+        environ = self.make_environ_for_test()
+        environ['SSL_CLIENT_CERT'] = 'invalid'
+        self.eval_unmet_predicate(predicate, environ, is_pinned.message)
+
+    def test_fail_unverified(self):
+        predicate = is_pinned([CERT_FINGERPRINT])
+        environ = self.make_environ_for_test(verified=False)
+        self.eval_unmet_predicate(predicate, environ, is_pinned.message)
+
+    def test_fingerprint_is_calculated_once(self):
+        environ = self.make_environ_for_test()
+        is_pinned([CERT_FINGERPRINT]).is_met(environ)
+        environ['SSL_CLIENT_CERT'] = read_data('other.pem')
+        self.eval_met_predicate(is_pinned([CERT_FINGERPRINT]), environ)
@@ -20,9 +20,15 @@
 from dateutil.relativedelta import relativedelta
 from dateutil.tz import tzutc
 from datetime import datetime
+import time
 
 from tests import TestX509Base
-from repoze.what.plugins.x509 import is_issuer, is_subject, X509DNPredicate 
+from repoze.what.plugins.x509 import is_issuer, is_subject, X509DNPredicate, \
+     X509Predicate, is_client, any_of, all_of, exactly, none_of, Schedule, \
+     HeaderSource
+from repoze.what.plugins.x509.clock import CoarseClock
+from repoze.what.plugins.x509.predicates import ENVIRON_PARSED_KEY, \
+     ENVIRON_RESULTS_KEY
 
 
 class _TestDNBase(TestX509Base):
@@ -467,6 +473,197 @@ class _TestDNBase(TestX509Base):
         )
         self.eval_met_predicate(predicate, environ)
 
+    def test_construct_predicate_only_with_options(self):
+        self.assertRaises(ValueError, self.PREDICATE, normalize=True)
+
+    def test_normalized_case_and_whitespace(self):
+        predicate = self.PREDICATE(organization='ACME  Corp', normalize=True)
+        environ = self.make_environ_for_test(
+            to_test={'CN': 'Name', 'O': ' acme corp'},
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_met_predicate(predicate, environ)
+
+    def test_normalized_unicode(self):
+        # NFC in the predicate, NFD in the certificate
+        predicate = self.PREDICATE(locality=u'San Jos\xe9', normalize=True)
+        environ = self.make_environ_for_test(
+            to_test={'CN': 'Name', 'L': 'SAN JOSE\xcc\x81'},
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_met_predicate(predicate, environ)
+
+    def test_normalized_multiple_values(self):
+        predicate = self.PREDICATE(organizational_unit=('Unit', 'OTHER unit'),
+                                   normalize=True)
+        environ = self.make_environ_for_test(
+            to_test='/OU=other   Unit/OU=UNIT/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_met_predicate(predicate, environ)
+
+    def test_normalized_server(self):
+        predicate = self.PREDICATE(common_name='Name', normalize=True)
+        environ = self.make_environ_for_test(
+            to_test={'CN': 'Fail'},
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        environ[self.get_key_dn() + '_CN'] = 'NAME '
+        self.eval_met_predicate(predicate, environ)
+
+    def test_fail_normalized(self):
+        predicate = self.PREDICATE(common_name='Name', normalize=True)
+        environ = self.make_environ_for_test(
+            to_test={'CN': 'Names'},
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_unmet_predicate(predicate, environ, self.get_error_message())
+
+    def test_fail_not_normalized(self):
+        predicate = self.PREDICATE(organization='ACME Corp')
+        environ = self.make_environ_for_test(
+            to_test={'CN': 'Name', 'O': 'acme corp'},
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_unmet_predicate(predicate, environ, self.get_error_message())
+
+    def test_parsed_dn_is_shared_within_request(self):
+        environ = self.make_environ_for_test(
+            to_test={'CN': 'Name', 'O': 'Company'},
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_met_predicate(self.PREDICATE(common_name='Name'), environ)
+        # Every further predicate reuses the parsed DN
+        dn = environ[self.get_key_dn()]
+        environ[ENVIRON_PARSED_KEY][(dn, False)]['O'] = frozenset(['Changed'])
+        self.eval_met_predicate(self.PREDICATE(organization='Changed'),
+                                environ)
+
+    def test_any_of(self):
+        predicate = self.PREDICATE(organizational_unit=any_of('Ops', 'Eng'))
+        environ = self.make_environ_for_test(
+            to_test='/OU=Sales/OU=Eng/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_met_predicate(predicate, environ)
+
+    def test_fail_any_of(self):
+        predicate = self.PREDICATE(organizational_unit=any_of('Ops', 'Eng'))
+        environ = self.make_environ_for_test(
+            to_test='/OU=Sales/OU=Legal/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_unmet_predicate(predicate, environ, self.get_error_message())
+
+    def test_exactly(self):
+        predicate = self.PREDICATE(organizational_unit=exactly('Ops', 'Eng'))
+        environ = self.make_environ_for_test(
+            to_test='/OU=Eng/OU=Ops/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_met_predicate(predicate, environ)
+
+    def test_fail_exactly(self):
+        predicate = self.PREDICATE(organizational_unit=exactly('Ops', 'Eng'))
+        environ = self.make_environ_for_test(
+            to_test='/OU=Eng/OU=Ops/OU=Sales/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_unmet_predicate(predicate, environ, self.get_error_message())
+
+    def test_none_of(self):
+        predicate = self.PREDICATE(organizational_unit=none_of('Sales'),
+                                   common_name='Name')
+        environ = self.make_environ_for_test(
+            to_test='/OU=Eng/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_met_predicate(predicate, environ)
+
+    def test_none_of_without_attribute_type(self):
+        predicate = self.PREDICATE(organizational_unit=none_of('Sales'))
+        environ = self.make_environ_for_test(
+            to_test='/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_met_predicate(predicate, environ)
+
+    def test_fail_none_of(self):
+        predicate = self.PREDICATE(organizational_unit=none_of('Sales'))
+        environ = self.make_environ_for_test(
+            to_test='/OU=Eng/OU=Sales/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        self.eval_unmet_predicate(predicate, environ, self.get_error_message())
+
+    def test_multi_value_without_values(self):
+        self.assertRaises(ValueError, any_of)
+
+    def test_multiple_values_server_beyond_expected(self):
+        # Values are found at any index, not only as many as expected
+        predicate = self.PREDICATE(organizational_unit=('Ops', 'Eng'))
+        environ = self.make_environ_for_test(
+            to_test='/OU=Fail/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        environ[self.get_key_dn() + '_OU'] = 'Sales'
+        environ[self.get_key_dn() + '_OU_1'] = 'Legal'
+        environ[self.get_key_dn() + '_OU_2'] = 'Eng'
+        environ[self.get_key_dn() + '_OU_3'] = 'Ops'
+        self.eval_met_predicate(predicate, environ)
+
+    def test_any_of_server(self):
+        predicate = self.PREDICATE(organizational_unit=any_of('Ops', 'Eng'))
+        environ = self.make_environ_for_test(
+            to_test='/OU=Fail/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        environ[self.get_key_dn() + '_OU_0'] = 'Sales'
+        environ[self.get_key_dn() + '_OU_1'] = 'Ops'
+        self.eval_met_predicate(predicate, environ)
+
+    def test_fail_exactly_server(self):
+        predicate = self.PREDICATE(organizational_unit=exactly('Ops'))
+        environ = self.make_environ_for_test(
+            to_test='/OU=Ops/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        environ[self.get_key_dn() + '_OU_0'] = 'Ops'
+        environ[self.get_key_dn() + '_OU_1'] = 'Sales'
+        self.eval_unmet_predicate(predicate, environ, self.get_error_message())
+
+    def test_indexed_variables_are_discovered_once(self):
+        environ = self.make_environ_for_test(
+            to_test='/OU=Fail/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        environ[self.get_key_dn() + '_OU_0'] = 'Ops'
+        self.eval_met_predicate(
+            self.PREDICATE(organizational_unit=any_of('Ops')), environ
+        )
+        del environ[self.get_key_dn() + '_OU_0']
+        self.eval_met_predicate(
+            self.PREDICATE(organizational_unit=all_of('Ops')), environ
+        )
+
+    def test_indexed_variables_by_source(self):
+        environ = self.make_environ_for_test(
+            to_test='/OU=Fail/CN=Name',
+            not_to_test={'CN': 'Other', 'C': 'US'}
+        )
+        environ[self.get_key_dn() + '_OU'] = 'Trusted'
+        for key, value in environ.items():
+            if key.startswith('SSL_CLIENT_'):
+                environ['HTTP_' + key] = value
+        environ['HTTP_' + self.get_key_dn() + '_OU'] = 'Evil'
+        predicate = self.PREDICATE(organizational_unit=any_of('Trusted'),
+                                   source=HeaderSource())
+        self.eval_met_predicate(
+            self.PREDICATE(organizational_unit=any_of('Trusted')), environ
+        )
+        self.eval_unmet_predicate(predicate, environ,
+                                  self.get_error_message())
+
     def test_invalid_certificate(self):
         predicate = self.PREDICATE(common_name='Name')
         environ = self.make_environ_for_test(
@@ -521,6 +718,167 @@ class TestIsSubject(_TestDNBase):
         environ['HTTP_SSL_CLIENT_S_DN_CN'] = 'NAME'
         self.eval_met_predicate(predicate, environ)
 
+class TestX509Predicate(TestX509Base):
+
+    def make_environ_for_test(self, **kwargs):
+        return self.make_environ({'CN': 'CA'}, {'CN': 'Name'}, **kwargs)
+
+    def test_valid_certificate(self):
+        self.eval_met_predicate(X509Predicate(), self.make_environ_for_test())
+
+    def test_without_validity_range(self):
+        environ = {'SSL_CLIENT_VERIFY': 'SUCCESS'}
+        self.eval_met_predicate(X509Predicate(), environ)
+
+    def test_expired_certificate(self):
+        end = datetime.utcnow().replace(tzinfo=tzutc()) + \
+              relativedelta(days=-1)
+        environ = self.make_environ_for_test(end=end)
+        self.assertEqual(X509Predicate().is_met(environ), False)
+
+    def test_not_yet_valid_certificate(self):
+        start = datetime.utcnow().replace(tzinfo=tzutc()) + \
+                relativedelta(days=1)
+        environ = self.make_environ_for_test(start=start)
+        self.assertEqual(X509Predicate().is_met(environ), False)
+
+    def test_invalid_validity_range(self):
+        environ = self.make_environ_for_test()
+        environ['SSL_CLIENT_V_END'] = 'invalid'
+        self.assertEqual(X509Predicate().is_met(environ), False)
+
+    def test_coarse_clock(self):
+        predicate = X509Predicate(clock_resolution=60000)
+        environ = self.make_environ_for_test()
+        end = datetime.utcnow().replace(tzinfo=tzutc()) + \
+              relativedelta(seconds=-5)
+        expired = self.make_environ_for_test(end=end)
+        # A clock that ticked before the certificate expired
+        predicate.clock = CoarseClock(60000, timer=lambda: self.clock_time)
+        self.clock_time = time.time() - 10
+        self.eval_met_predicate(predicate, environ)
+        self.eval_met_predicate(predicate, expired)
+
+    def test_strict_validity(self):
+        predicate = X509Predicate(clock_resolution=60000, strict_validity=True)
+        end = datetime.utcnow().replace(tzinfo=tzutc()) + \
+              relativedelta(seconds=-5)
+        expired = self.make_environ_for_test(end=end)
+        predicate.clock = CoarseClock(60000, timer=lambda: time.time() - 10)
+        self.assertEqual(predicate.is_met(expired), False)
+
+    def test_schedule(self):
+        predicate = is_subject(common_name='Name',
+                               schedule=Schedule('Mon-Fri 09:00-17:00'))
+        environ = {'SSL_CLIENT_VERIFY': 'SUCCESS',
+                   'SSL_CLIENT_S_DN': '/CN=Name'}
+        # Monday, January 2nd 2012, at 10:00 and 18:00 UTC
+        predicate.clock = CoarseClock(1000, timer=lambda: 1325498400)
+        self.eval_met_predicate(predicate, environ)
+        predicate.clock = CoarseClock(1000, timer=lambda: 1325527200)
+        self.eval_unmet_predicate(predicate, environ,
+                                  'Invalid SSL client subject.')
+
+    def test_schedule_is_not_dn_param(self):
+        predicate = is_subject(common_name='Name',
+                               schedule=Schedule('* 00:00-24:00'))
+        self.assertEqual(predicate.dn_params, (('CN', 'Name'),))
+
+    def test_options_are_not_dn_params(self):
+        predicate = is_subject(common_name='Name', clock_resolution=10,
+                               strict_validity=True)
+        self.assertEqual(predicate.dn_params, (('CN', 'Name'),))
+
+    def test_defaults_are_not_stored(self):
+        predicate = is_subject(common_name='Name')
+        self.assertEqual(sorted(predicate.__dict__.keys()),
+                         ['dn_params', 'environ_key'])
+
+    def test_shared_constraints(self):
+        unit = ''.join(['Engine', 'ering'])
+        first = is_subject(country='US', organizational_unit='Engineering')
+        second = is_subject(country='US', organizational_unit=unit)
+        assert first.dn_params is second.dn_params
+        third = is_subject(country='US', organizational_unit=any_of(unit))
+        value = third.dn_params[0][1]
+        assert list(value.values)[0] is first.dn_params[0][1]
+        assert not hasattr(value, '__dict__')
+
+    def test_shared_constraints_bounded(self):
+        from repoze.what.plugins.x509 import predicates
+        limit = predicates._MAX_SHARED
+        predicates._MAX_SHARED = len(predicates._SHARED_PARAMS)
+        try:
+            first = is_subject(common_name=u'Tenant \xe9 1')
+            second = is_subject(common_name=u'Tenant \xe9 1')
+            assert first.dn_params is not second.dn_params
+            self.assertEqual(first.dn_params, second.dn_params)
+        finally:
+            predicates._MAX_SHARED = limit
+
+    def test_unhashable_constraints(self):
+        predicate = is_subject(common_name=bytearray('Name'))
+        self.assertEqual(predicate.dn_params, (('CN', bytearray('Name')),))
+
+    def test_validity(self):
+        predicate = X509Predicate()
+        predicate.clock = CoarseClock(1000, timer=lambda: 1325376000 + 60)
+        environ = {'SSL_CLIENT_VERIFY': 'SUCCESS',
+                   'SSL_CLIENT_V_START': 'Jan  1 00:00:00 2012 GMT',
+                   'SSL_CLIENT_V_END': 'Jan  2 00:00:00 2012 GMT'}
+        validity = predicate.validity(environ)
+        self.assertEqual(validity.not_before, 1325376000)
+        self.assertEqual(validity.elapsed, 60)
+        self.assertEqual(validity.remaining, 86400 - 60)
+
+    def test_validity_unknown(self):
+        predicate = X509Predicate()
+        self.assertEqual(predicate.validity({}), None)
+        environ = self.make_environ_for_test()
+        environ['SSL_CLIENT_V_END'] = 'invalid'
+        self.assertEqual(predicate.validity(environ), None)
+
+    def test_memoized_within_request(self):
+        predicate = is_subject(common_name='Name', memoize=True)
+        environ = self.make_environ_for_test()
+        self.eval_met_predicate(predicate, environ)
+        self.assertEqual(environ[ENVIRON_RESULTS_KEY], {predicate: None})
+        # The result of the first evaluation is kept, even if the request
+        # changed afterwards.
+        environ['SSL_CLIENT_S_DN'] = '/CN=Other'
+        self.eval_met_predicate(predicate, environ)
+
+    def test_memoized_failure(self):
+        predicate = is_subject(common_name='Other', memoize=True)
+        environ = self.make_environ_for_test()
+        self.eval_unmet_predicate(predicate, environ,
+                                  'Invalid SSL client subject.')
+        environ['SSL_CLIENT_S_DN'] = '/CN=Other'
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_memoized_per_request(self):
+        predicate = is_subject(common_name='Name', memoize=True)
+        self.eval_met_predicate(predicate, self.make_environ_for_test())
+        environ = self.make_environ_for_test()
+        environ['SSL_CLIENT_S_DN'] = '/CN=Other'
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_memoized_per_predicate(self):
+        environ = self.make_environ_for_test()
+        self.eval_met_predicate(is_subject(common_name='Name', memoize=True),
+                                environ)
+        self.assertEqual(
+            is_subject(common_name='Other', memoize=True).is_met(environ),
+            False
+        )
+
+    def test_not_memoized_by_default(self):
+        predicate = is_subject(common_name='Name')
+        environ = self.make_environ_for_test()
+        self.eval_met_predicate(predicate, environ)
+        assert ENVIRON_RESULTS_KEY not in environ
+
+
 class TestX509DNPredicate(TestX509Base):
 
     def test_invalid_subject_key(self):
@@ -581,3 +939,72 @@ class TestIsIssuer(_TestDNBase):
         environ['HTTP_SSL_CLIENT_I_DN_CN'] = 'NAME'
         self.eval_met_predicate(predicate, environ)
 
+
+
+class TestIsClient(TestX509Base):
+
+    def make_environ_for_test(self, subject, **kwargs):
+        return self.make_environ({'O': 'Example', 'CN': 'Example CA'},
+                                 subject, **kwargs)
+
+    def test_without_constraints(self):
+        self.assertRaises(ValueError, is_client)
+        self.assertRaises(ValueError, is_client, subject={}, issuer={})
+
+    def test_met(self):
+        predicate = is_client(subject={'common_name': 'John Smith'},
+                              issuer={'organization': 'Example'})
+        environ = self.make_environ_for_test({'CN': 'John Smith'})
+        self.eval_met_predicate(predicate, environ)
+
+    def test_only_subject(self):
+        predicate = is_client(subject={'common_name': 'John Smith'})
+        environ = self.make_environ_for_test({'CN': 'John Smith'})
+        self.eval_met_predicate(predicate, environ)
+
+    def test_subject_fails(self):
+        predicate = is_client(subject={'common_name': 'John Smith'},
+                              issuer={'organization': 'Example'})
+        environ = self.make_environ_for_test({'CN': 'Jane Doe'})
+        self.eval_unmet_predicate(predicate, environ,
+                                  'Invalid SSL client subject.')
+
+    def test_issuer_fails(self):
+        predicate = is_client(subject={'common_name': 'John Smith'},
+                              issuer={'organization': 'Other'})
+        environ = self.make_environ_for_test({'CN': 'John Smith'})
+        self.eval_unmet_predicate(predicate, environ,
+                                  'Invalid SSL client issuer.')
+
+    def test_invalid_certificate(self):
+        predicate = is_client(subject={'common_name': 'John Smith'})
+        environ = self.make_environ_for_test({'CN': 'John Smith'},
+                                             verified=False)
+        self.eval_unmet_predicate(predicate, environ,
+                                  'Invalid SSL client certificate.')
+
+    def test_server_variables(self):
+        predicate = is_client(subject={'common_name': 'John Smith'},
+                              issuer={'common_name': 'Example CA'})
+        environ = self.make_environ_for_test({'CN': 'Fail'})
+        environ['SSL_CLIENT_S_DN_CN'] = 'John Smith'
+        self.eval_met_predicate(predicate, environ)
+
+    def test_normalize_applies_to_both(self):
+        predicate = is_client(subject={'common_name': 'JOHN  SMITH'},
+                              issuer={'organization': 'example'},
+                              normalize=True)
+        environ = self.make_environ_for_test({'CN': 'John Smith'})
+        self.eval_met_predicate(predicate, environ)
+
+    def test_same_as_all(self):
+        from repoze.what.predicates import All
+        subject = {'common_name': 'John Smith', 'organizational_unit':
+                   any_of('Engineering', 'Operations')}
+        issuer = {'organization': 'Example'}
+        fused = is_client(subject=subject, issuer=issuer)
+        compound = All(is_subject(**subject), is_issuer(**issuer))
+        for dn in ('/CN=John Smith/OU=Operations', '/CN=John Smith/OU=Sales',
+                   '/CN=Jane Doe/OU=Engineering'):
+            environ = self.make_environ_for_test(dn)
+            self.assertEqual(fused.is_met(environ), compound.is_met(environ))
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+
+from tests import TestX509Base, read_data
+from repoze.what.plugins.x509 import x509_rate_limited, RateLimitTable
+from repoze.what.plugins.x509.ratelimit import PROBES
+
+
+class TestRateLimitTable(TestX509Base):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.table = RateLimitTable(slots=64, timer=lambda: self.now)
+
+    def test_burst(self):
+        for _ in range(3):
+            assert self.table.consume(1, 1, 3)
+        assert not self.table.consume(1, 1, 3)
+        # Other keys have their own buckets.
+        assert self.table.consume(2, 1, 3)
+        self.assertEqual(len(self.table), 2)
+
+    def test_refill(self):
+        for _ in range(2):
+            assert self.table.consume(1, 2, 2)
+        assert not self.table.consume(1, 2, 2)
+        self.now += 0.5
+        assert self.table.consume(1, 2, 2)
+        assert not self.table.consume(1, 2, 2)
+        # Never more than the burst.
+        self.now += 60
+        assert self.table.consume(1, 2, 2)
+        assert self.table.consume(1, 2, 2)
+        assert not self.table.consume(1, 2, 2)
+
+    def test_bounded_eviction(self):
+        # Keys that collide in the same slot.
+        keys = [n * 64 + 5 for n in range(1, PROBES + 2)]
+        for key in keys[:-1]:
+            self.now += 1
+            assert self.table.consume(key, 1, 1)
+        self.assertEqual(self.table.evictions, 0)
+        self.now += 1
+        assert self.table.consume(keys[-1], 1, 1)
+        self.assertEqual(self.table.evictions, 1)
+        self.assertEqual(len(self.table), PROBES)
+        # The least recently updated bucket was evicted, so it starts full.
+        assert self.table.consume(keys[0], 1, 1)
+
+    def test_clear(self):
+        assert self.table.consume(1, 1, 1)
+        self.table.clear()
+        self.assertEqual(len(self.table), 0)
+        assert self.table.consume(1, 1, 1)
+
+    def test_invalid_slots(self):
+        self.assertRaises(ValueError, RateLimitTable, slots=0)
+
+    def test_shared_with_forked_processes(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.table.consume(1, 1, 2)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        assert self.table.consume(1, 1, 2)
+        assert not self.table.consume(1, 1, 2)
+
+
+class TestRateLimitFile(TestX509Base):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'buckets')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_file(self):
+        first = RateLimitTable(self.path, slots=128)
+        second = RateLimitTable(self.path, slots=16)
+        self.assertEqual(second.slots, 128)
+        assert first.consume(1, 1, 1)
+        assert not second.consume(1, 1, 1)
+        first.close()
+        second.close()
+
+    def test_created_concurrently(self):
+        # Another process opens the table while this one is creating it,
+        # and neither of them sees it half written.
+        ftruncate = os.ftruncate
+        tables = []
+
+        def concurrent_ftruncate(fd, size):
+            ftruncate(fd, size)
+            os.ftruncate = ftruncate
+            tables.append(RateLimitTable(self.path, slots=32))
+
+        os.ftruncate = concurrent_ftruncate
+        try:
+            table = RateLimitTable(self.path, slots=16)
+        finally:
+            os.ftruncate = ftruncate
+        self.assertEqual(table.slots, tables[0].slots)
+        assert table.consume(1, 1, 1)
+        assert not tables[0].consume(1, 1, 1)
+        self.assertEqual(os.listdir(self.directory), ['buckets'])
+        table.close()
+        tables[0].close()
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as f:
+            f.write('X' * 100)
+        self.assertRaises(ValueError, RateLimitTable, self.path)
+
+
+class TestX509RateLimited(TestX509Base):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.table = RateLimitTable(slots=64, timer=lambda: self.now)
+
+    def make_environ_for_test(self, subject='/CN=John Smith', **kwargs):
+        environ = self.make_environ({'CN': 'CA'}, subject, **kwargs)
+        environ['SSL_CLIENT_CERT'] = read_data('client.pem')
+        return environ
+
+    def test_by_subject(self):
+        predicate = x509_rate_limited(1, burst=2, table=self.table)
+        for _ in range(2):
+            self.assertEqual(predicate.is_met(self.make_environ_for_test()),
+                             True)
+        self.eval_unmet_predicate(
+            predicate, self.make_environ_for_test(),
+            'SSL client certificate rate limit exceeded.'
+        )
+        self.assertEqual(
+            predicate.is_met(self.make_environ_for_test('/CN=Jane Doe')),
+            True
+        )
+        self.now += 1
+        self.assertEqual(predicate.is_met(self.make_environ_for_test()), True)
+
+    def test_by_fingerprint(self):
+        predicate = x509_rate_limited(1, by='fingerprint', table=self.table)
+        self.assertEqual(predicate.is_met(self.make_environ_for_test()), True)
+        # The same certificate, whatever the subject says.
+        self.assertEqual(
+            predicate.is_met(self.make_environ_for_test('/CN=Jane Doe')),
+            False
+        )
+
+    def test_one_token_per_request(self):
+        predicate = x509_rate_limited(1, burst=2, table=self.table)
+        environ = self.make_environ_for_test()
+        for _ in range(3):
+            self.assertEqual(predicate.is_met(environ), True)
+        # Other predicates with the same buckets do not take another token.
+        self.assertEqual(
+            x509_rate_limited(1, burst=2, table=self.table).is_met(environ),
+            True
+        )
+        self.assertEqual(predicate.is_met(self.make_environ_for_test()), True)
+        environ = self.make_environ_for_test()
+        for _ in range(2):
+            self.assertEqual(predicate.is_met(environ), False)
+        self.now += 1
+        self.assertEqual(predicate.is_met(self.make_environ_for_test()), True)
+
+    def test_without_identity(self):
+        predicate = x509_rate_limited(1, table=self.table)
+        environ = self.make_environ_for_test()
+        del environ['SSL_CLIENT_S_DN']
+        self.assertEqual(predicate.is_met(environ), False)
+        predicate = x509_rate_limited(1, by='fingerprint', table=self.table)
+        environ = self.make_environ_for_test()
+        environ['SSL_CLIENT_CERT'] = 'invalid'
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_invalid_certificate(self):
+        predicate = x509_rate_limited(1, table=self.table)
+        environ = self.make_environ_for_test(verified=False)
+        self.assertEqual(predicate.is_met(environ), False)
+        # No token was taken.
+        self.assertEqual(len(self.table), 0)
+
+    def test_namespaces(self):
+        first = x509_rate_limited(1, table=self.table)
+        second = x509_rate_limited(1, table=self.table, namespace='other')
+        self.assertEqual(first.is_met(self.make_environ_for_test()), True)
+        self.assertEqual(second.is_met(self.make_environ_for_test()), True)
+        self.assertEqual(x509_rate_limited(1, table=self.table).is_met(
+            self.make_environ_for_test()), False)
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, x509_rate_limited, 0)
+        self.assertRaises(ValueError, x509_rate_limited, 1, by='issuer')
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from unittest import TestCase
+
+from repoze.what.plugins.x509 import Schedule
+from repoze.what.plugins.x509.schedule import MINUTES_PER_WEEK
+
+
+# Monday, January 2nd 2012 at 00:00 UTC.
+MONDAY = 1325462400
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+class TestSchedule(TestCase):
+
+    def test_minute_of_week(self):
+        schedule = Schedule([])
+        self.assertEqual(schedule.minute_of_week(MONDAY), 0)
+        self.assertEqual(schedule.minute_of_week(MONDAY + 59), 0)
+        self.assertEqual(schedule.minute_of_week(MONDAY + DAY + 90), 1441)
+        self.assertEqual(schedule.minute_of_week(MONDAY - 60),
+                         MINUTES_PER_WEEK - 1)
+
+    def test_business_hours(self):
+        schedule = Schedule('Mon-Fri 09:00-17:00')
+        self.assertEqual(len(schedule), 5 * 8 * 60)
+        assert schedule.allows(MONDAY + 9 * HOUR)
+        assert schedule.allows(MONDAY + 4 * DAY + 17 * HOUR - 1)
+        assert not schedule.allows(MONDAY + 17 * HOUR)
+        assert not schedule.allows(MONDAY + 9 * HOUR - 1)
+        assert not schedule.allows(MONDAY + 5 * DAY + 10 * HOUR)
+
+    def test_several_windows(self):
+        schedule = Schedule(['Mon,Wed 02:00-03:00', 'Sat-Sun 10:00-11:00'])
+        assert schedule.allows(MONDAY + 2 * HOUR)
+        assert not schedule.allows(MONDAY + DAY + 2 * HOUR)
+        assert schedule.allows(MONDAY + 2 * DAY + 2 * HOUR)
+        assert schedule.allows(MONDAY + 6 * DAY + 10 * HOUR)
+
+    def test_every_day(self):
+        schedule = Schedule('* 00:00-24:00')
+        self.assertEqual(len(schedule), MINUTES_PER_WEEK)
+
+    def test_overnight_window(self):
+        # From Sunday night to Monday morning, wrapping around the week.
+        schedule = Schedule('Sun 22:00-06:00')
+        assert schedule.allows(MONDAY - HOUR)
+        assert schedule.allows(MONDAY + 5 * HOUR)
+        assert not schedule.allows(MONDAY + 6 * HOUR)
+        assert not schedule.allows(MONDAY - 3 * HOUR)
+
+    def test_timezone(self):
+        # Mexico City is UTC-6 in January.
+        schedule = Schedule('Mon 09:00-10:00', tz='America/Mexico_City')
+        assert schedule.allows(MONDAY + 15 * HOUR)
+        assert not schedule.allows(MONDAY + 9 * HOUR)
+
+    def test_daylight_saving_time(self):
+        schedule = Schedule('Mon 09:00-10:00', tz='America/New_York')
+        # Monday, July 2nd 2012, at 13:00 UTC is 09:00 EDT.
+        assert schedule.allows(1341234000)
+        # Monday, January 2nd 2012, at 13:00 UTC is 08:00 EST.
+        assert not schedule.allows(MONDAY + 13 * HOUR)
+        assert schedule.allows(MONDAY + 14 * HOUR)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, Schedule, 'Mon')
+        self.assertRaises(ValueError, Schedule, 'Someday 09:00-10:00')
+        self.assertRaises(ValueError, Schedule, 'Mon 09:00-25:00')
+        self.assertRaises(ValueError, Schedule, 'Mon 09:60-10:00')
+        self.assertRaises(ValueError, Schedule, 'Mon 09:00-10:00',
+                          tz='Nowhere/Nothing')
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+
+from tests import TestX509Base
+from repoze.what.plugins.x509 import is_serial_in, SerialRanges, \
+     write_serial_file, HeaderSource
+from repoze.what.plugins.x509.serials import parse_serial
+
+
+class TestParseSerial(TestX509Base):
+
+    def test_parse(self):
+        self.assertEqual(parse_serial('1A2B3C4D5E'), 0x1A2B3C4D5E)
+        self.assertEqual(parse_serial('1a:2b:3c'), 0x1A2B3C)
+        self.assertEqual(parse_serial('0x10'), 16)
+        self.assertEqual(parse_serial(16), 16)
+        self.assertEqual(parse_serial('%040X' % (2 ** 159)), 2 ** 159)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_serial, 'XYZ')
+        self.assertRaises(ValueError, parse_serial, '')
+        self.assertRaises(ValueError, parse_serial, -1)
+
+
+class TestSerialRanges(TestX509Base):
+
+    def test_contains(self):
+        ranges = SerialRanges(['100-1FF', (0x400, 0x4FF), 0x1000])
+        for serial in (0x100, 0x150, 0x1FF, 0x400, 0x4FF, 0x1000):
+            assert serial in ranges
+        for serial in (0, 0xFF, 0x200, 0x3FF, 0x500, 0xFFF, 0x1001):
+            assert serial not in ranges
+
+    def test_merged(self):
+        ranges = SerialRanges(['10-20', '15-30', '31-40', '50-60', '52-55'])
+        self.assertEqual(list(ranges), [(0x10, 0x40), (0x50, 0x60)])
+        self.assertEqual(len(ranges), 2)
+
+    def test_empty(self):
+        assert 1 not in SerialRanges()
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, SerialRanges, ['20-10'])
+        self.assertRaises(ValueError, SerialRanges, ['XYZ'])
+
+
+class TestSerialFile(TestX509Base):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'serials.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        large = 2 ** 150
+        count = write_serial_file(self.path, ['100-1FF', '180-2FF',
+                                              (large, large + 10)])
+        self.assertEqual(count, 2)
+        ranges = SerialRanges.load(self.path)
+        self.assertEqual(list(ranges), [(0x100, 0x2FF), (large, large + 10)])
+        assert large + 5 in ranges
+        assert 0x300 not in ranges
+
+    def test_compact(self):
+        write_serial_file(self.path, ['%X-%X' % (n * 100, n * 100 + 50)
+                                      for n in range(2000)])
+        # 2000 ranges of 3 bytes per bound.
+        self.assertEqual(os.path.getsize(self.path), 20 + 2000 * 2 * 3)
+
+    def test_empty(self):
+        self.assertEqual(write_serial_file(self.path, []), 0)
+        self.assertEqual(len(SerialRanges.load(self.path)), 0)
+
+    def test_invalid(self):
+        with open(self.path, 'wb') as f:
+            f.write('X509PIN1')
+        self.assertRaises(ValueError, SerialRanges.load, self.path)
+        write_serial_file(self.path, ['100-1FF'])
+        with open(self.path, 'ab') as f:
+            f.write('\x00')
+        self.assertRaises(ValueError, SerialRanges.load, self.path)
+
+
+class TestIsSerialIn(TestX509Base):
+
+    def make_environ_for_test(self, serial, **kwargs):
+        environ = self.make_environ({'CN': 'CA'}, {'CN': 'Name'}, **kwargs)
+        if serial is not None:
+            environ['SSL_CLIENT_M_SERIAL'] = serial
+        return environ
+
+    def test_met(self):
+        predicate = is_serial_in(['1A2B3C0000-1A2B3CFFFF'])
+        self.eval_met_predicate(predicate,
+                                self.make_environ_for_test('1A2B3C4D5E'))
+
+    def test_unmet(self):
+        predicate = is_serial_in(['1A2B3C0000-1A2B3CFFFF'])
+        self.eval_unmet_predicate(
+            predicate, self.make_environ_for_test('1A2B3D0000'),
+            'Invalid SSL client certificate serial number.'
+        )
+
+    def test_without_serial(self):
+        predicate = is_serial_in(['0-FF'])
+        self.assertEqual(predicate.is_met(self.make_environ_for_test(None)),
+                         False)
+        self.assertEqual(
+            predicate.is_met(self.make_environ_for_test('invalid')),
+            False
+        )
+
+    def test_not_verified(self):
+        predicate = is_serial_in(['0-FF'])
+        environ = self.make_environ_for_test('10', verified=False)
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_converted_once(self):
+        environ = self.make_environ_for_test('10')
+        self.eval_met_predicate(is_serial_in(['0-FF']), environ)
+        environ['SSL_CLIENT_M_SERIAL'] = '1000'
+        self.eval_met_predicate(is_serial_in(['0-FF']), environ)
+
+    def test_converted_by_source(self):
+        environ = self.make_environ_for_test('10')
+        for key, value in environ.items():
+            if key.startswith('SSL_CLIENT_'):
+                environ['HTTP_' + key] = value
+        environ['HTTP_SSL_CLIENT_M_SERIAL'] = '20'
+        self.eval_met_predicate(is_serial_in(['10']), environ)
+        self.eval_met_predicate(is_serial_in(['20'], source=HeaderSource()),
+                                environ)
+        self.assertEqual(
+            is_serial_in(['10'], source=HeaderSource()).is_met(environ),
+            False
+        )
+
+    def test_from_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'serials.bin')
+            write_serial_file(path, ['0-FF'])
+            predicate = is_serial_in(SerialRanges.load(path))
+        finally:
+            shutil.rmtree(directory)
+        self.eval_met_predicate(predicate, self.make_environ_for_test('10'))
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from urllib import quote
+import base64
+
+from tests import TestX509Base, read_data
+from repoze.what.plugins.x509 import is_subject, HeaderSource, EnvironSource
+from repoze.what.plugins.x509.sources import decode_certificate, \
+     ENVIRON_DECODED_KEY
+
+
+DER = ''.join([chr(n % 256) for n in range(150)])
+BODY = base64.b64encode(DER)
+PEM = '-----BEGIN CERTIFICATE-----\n%s\n-----END CERTIFICATE-----\n' % \
+      '\n'.join([BODY[i:i + 64] for i in range(0, len(BODY), 64)])
+
+
+class TestDecodeCertificate(TestX509Base):
+
+    def test_plain(self):
+        self.assertEqual(decode_certificate(PEM, 'plain'), PEM)
+
+    def test_url(self):
+        self.assertEqual(decode_certificate(quote(PEM), 'url'), PEM)
+        self.assertEqual(decode_certificate(quote(PEM)), PEM)
+
+    def test_base64_der(self):
+        self.assertEqual(decode_certificate(BODY, 'base64'), PEM)
+        self.assertEqual(decode_certificate(BODY), PEM)
+
+    def test_tab_joined(self):
+        self.assertEqual(decode_certificate(PEM.replace('\n', '\t'), 'tab'),
+                         PEM)
+        self.assertEqual(decode_certificate(PEM.replace('\n', ' ')), PEM)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, decode_certificate, BODY, 'plain')
+        self.assertRaises(ValueError, decode_certificate,
+                          PEM[:PEM.index('-----END')])
+        self.assertRaises(ValueError, decode_certificate, '')
+
+
+class TestEnvironSource(TestX509Base):
+
+    def test_get(self):
+        source = EnvironSource()
+        environ = {'SSL_CLIENT_S_DN': '/CN=Name'}
+        self.assertEqual(source.get(environ, 'SSL_CLIENT_S_DN'), '/CN=Name')
+        self.assertEqual(source.get(environ, 'SSL_CLIENT_I_DN'), None)
+
+    def test_get_der(self):
+        source = EnvironSource()
+        environ = {'SSL_CLIENT_CERT': PEM}
+        self.assertEqual(source.get_der(environ), DER)
+        self.assertEqual(source.get_pem(environ), PEM)
+        self.assertEqual(source.get_der({}), None)
+
+
+class TestHeaderSource(TestX509Base):
+
+    def test_unknown_encoding(self):
+        self.assertRaises(ValueError, HeaderSource, encoding='unknown')
+
+    def test_get_without_decoding(self):
+        source = HeaderSource()
+        environ = {'HTTP_SSL_CLIENT_S_DN': '/CN=Name'}
+        self.assertEqual(source.get(environ, 'SSL_CLIENT_S_DN'), '/CN=Name')
+        # Nothing had to be decoded
+        assert ENVIRON_DECODED_KEY not in environ
+
+    def test_get_url_decoded(self):
+        source = HeaderSource()
+        environ = {'HTTP_SSL_CLIENT_S_DN': '/CN=John%20Smith',
+                   'HTTP_SSL_CLIENT_I_DN': '/CN=CA%20Root'}
+        self.assertEqual(source.get(environ, 'SSL_CLIENT_S_DN'),
+                         '/CN=John Smith')
+        # Only the touched header is decoded
+        self.assertEqual([name[-1] for name in environ[ENVIRON_DECODED_KEY]],
+                         [('header', 'SSL_CLIENT_S_DN')])
+
+    def test_decoded_by_source(self):
+        # Sources of the same request do not share their decoded values.
+        environ = {'SSL_CLIENT_CERT': read_data('client.pem'),
+                   'HTTP_SSL_CLIENT_CERT': read_data('other.pem'),
+                   'HTTP_X_SSL_CLIENT_CERT': read_data('root.pem')}
+        fingerprints = [
+            source.get_fingerprint(environ)
+            for source in (EnvironSource(), HeaderSource(),
+                           HeaderSource(prefix='HTTP_X_'))
+        ]
+        self.assertEqual(len(set(fingerprints)), 3)
+        self.assertEqual(EnvironSource().get_fingerprint(environ),
+                         fingerprints[0])
+
+    def test_get_plain(self):
+        source = HeaderSource(encoding='plain')
+        environ = {'HTTP_SSL_CLIENT_S_DN': '/CN=100%25'}
+        self.assertEqual(source.get(environ, 'SSL_CLIENT_S_DN'), '/CN=100%25')
+
+    def test_get_der(self):
+        source = HeaderSource(prefix='HTTP_X_')
+        environ = {'HTTP_X_SSL_CLIENT_CERT': BODY}
+        self.assertEqual(source.get_der(environ), DER)
+
+    def test_predicate(self):
+        predicate = is_subject(common_name='John Smith', source=HeaderSource())
+        environ = self.make_environ({'CN': 'CA'}, '/CN=John%20Smith/C=US',
+                                    prefix='HTTP_')
+        environ['HTTP_SSL_CLIENT_VERIFY'] = environ.pop('SSL_CLIENT_VERIFY')
+        self.eval_met_predicate(predicate, environ)
+
+    def test_predicate_server_variable(self):
+        predicate = is_subject(common_name='John Smith', source=HeaderSource())
+        environ = {'HTTP_SSL_CLIENT_VERIFY': 'SUCCESS',
+                   'HTTP_SSL_CLIENT_S_DN': '/CN=Fail',
+                   'HTTP_SSL_CLIENT_S_DN_CN': 'John%20Smith'}
+        self.eval_met_predicate(predicate, environ)
+
+    def test_fail_predicate_without_headers(self):
+        predicate = is_subject(common_name='Name', source=HeaderSource())
+        environ = self.make_environ({'CN': 'CA'}, {'CN': 'Name'})
+        self.eval_unmet_predicate(predicate, environ, is_subject.message)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+
+from tests import TestX509Base
+from repoze.what.plugins.x509 import is_subject_in, SubjectTable, \
+     write_subject_table
+from repoze.what.plugins.x509.subjects import canonical_dn
+
+
+class TestCanonicalDN(TestX509Base):
+
+    def test_order_independent(self):
+        self.assertEqual(canonical_dn('/C=US/O=Example/CN=John Smith'),
+                         canonical_dn('/CN=John Smith/C=US/O=Example'))
+        self.assertEqual(canonical_dn('/C=US/CN=John Smith'),
+                         canonical_dn({'CN': 'John Smith', 'C': ['US']}))
+
+    def test_normalize(self):
+        self.assertNotEqual(canonical_dn('/CN=John  SMITH'),
+                            canonical_dn('/CN=john smith'))
+        self.assertEqual(canonical_dn('/CN=John  SMITH', normalize=True),
+                         canonical_dn('/CN=john smith', normalize=True))
+
+    def test_several_values(self):
+        self.assertEqual(canonical_dn('/OU=B/OU=A/CN=Name'),
+                         canonical_dn({'CN': 'Name', 'OU': ['A', 'B']}))
+
+
+class TestSubjectTable(TestX509Base):
+
+    def test_contains(self):
+        subjects = ['/C=US/O=Example/CN=User %d' % n for n in range(1000)]
+        table = SubjectTable(subjects)
+        self.assertEqual(len(table), 1000)
+        for subject in subjects:
+            assert subject in table
+        for n in range(1000):
+            assert '/C=US/O=Example/CN=Other %d' % n not in table
+        assert '/C=US/O=Example' not in table
+        assert '/C=US/O=Example/CN=User 1/OU=Sales' not in table
+
+    def test_every_size(self):
+        # Including the tables with a single bucket.
+        for size in range(10):
+            table = SubjectTable(['/CN=%d' % n for n in range(size)])
+            self.assertEqual(len(table), size)
+            for n in range(size):
+                assert '/CN=%d' % n in table
+            assert '/CN=x' not in table
+
+    def test_duplicates(self):
+        table = SubjectTable(['/C=US/CN=Name', '/CN=Name/C=US'])
+        self.assertEqual(len(table), 1)
+
+    def test_normalize(self):
+        table = SubjectTable(['/CN=John Smith'], normalize=True)
+        assert '/CN=JOHN  smith' in table
+        assert '/CN=John Smith' not in SubjectTable(['/CN=john smith'])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, SubjectTable, ['no DN'])
+        assert 'no DN' not in SubjectTable(['/CN=Name'])
+
+
+class TestSubjectTableFile(TestX509Base):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'subjects.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        subjects = ['/O=Example/CN=User %d' % n for n in range(500)]
+        self.assertEqual(write_subject_table(self.path, subjects), 500)
+        table = SubjectTable.load(self.path)
+        try:
+            for subject in subjects:
+                assert subject in table
+            assert '/O=Example/CN=Other' not in table
+        finally:
+            table.close()
+
+    def test_compact(self):
+        write_subject_table(self.path, ['/CN=%d' % n for n in range(1000)])
+        # A displacement per two names and a fingerprint per name.
+        self.assertEqual(os.path.getsize(self.path),
+                         32 + 500 * 8 + 1000 * 8)
+
+    def test_normalize_kept(self):
+        write_subject_table(self.path, ['/CN=John Smith'], normalize=True)
+        table = SubjectTable.load(self.path)
+        self.assertEqual(table.normalize, True)
+        assert '/CN=JOHN SMITH' in table
+        table.close()
+
+    def test_empty(self):
+        self.assertEqual(write_subject_table(self.path, []), 0)
+        table = SubjectTable.load(self.path)
+        self.assertEqual(len(table), 0)
+        assert '/CN=Name' not in table
+        table.close()
+
+    def test_invalid(self):
+        with open(self.path, 'wb') as f:
+            f.write('X509SER1')
+        self.assertRaises(ValueError, SubjectTable.load, self.path)
+        write_subject_table(self.path, ['/CN=Name'])
+        with open(self.path, 'ab') as f:
+            f.write('\x00')
+        self.assertRaises(ValueError, SubjectTable.load, self.path)
+
+
+class TestIsSubjectIn(TestX509Base):
+
+    def setUp(self):
+        self.table = SubjectTable(['/C=US/O=Example/CN=John Smith',
+                                   '/C=MX/O=Other/CN=Jane Doe'])
+
+    def make_environ_for_test(self, subject, **kwargs):
+        return self.make_environ({'CN': 'CA'}, subject, **kwargs)
+
+    def test_met(self):
+        predicate = is_subject_in(self.table)
+        self.eval_met_predicate(predicate, self.make_environ_for_test(
+            {'C': 'US', 'O': 'Example', 'CN': 'John Smith'}
+        ))
+
+    def test_unmet(self):
+        predicate = is_subject_in(self.table)
+        self.eval_unmet_predicate(
+            predicate,
+            self.make_environ_for_test({'C': 'US', 'CN': 'John Smith'}),
+            'Invalid SSL client subject.'
+        )
+
+    def test_not_verified(self):
+        predicate = is_subject_in(self.table)
+        environ = self.make_environ_for_test(
+            {'C': 'US', 'O': 'Example', 'CN': 'John Smith'}, verified=False
+        )
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_without_subject(self):
+        predicate = is_subject_in(self.table)
+        environ = self.make_environ_for_test({'CN': 'Jane Doe'})
+        del environ['SSL_CLIENT_S_DN']
+        self.assertEqual(predicate.is_met(environ), False)
+        environ['SSL_CLIENT_S_DN'] = 'no DN'
+        self.assertEqual(predicate.is_met(environ), False)
+
+    def test_normalize_from_table(self):
+        predicate = is_subject_in(['/CN=Jane Doe'], normalize=True)
+        self.eval_met_predicate(predicate,
+                                self.make_environ_for_test({'CN': 'JANE DOE'}))
+
+    def test_from_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'subjects.bin')
+            write_subject_table(path, ['/CN=Jane Doe'])
+            predicate = is_subject_in(SubjectTable.load(path))
+        finally:
+            shutil.rmtree(directory)
+        self.eval_met_predicate(predicate,
+                                self.make_environ_for_test({'CN': 'Jane Doe'}))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from tests import TestX509Base
+from repoze.what.plugins.x509 import in_tenant, TenantIndex, HeaderSource
+from repoze.what.plugins.x509.tenants import ENVIRON_TENANT_KEY
+
+
+SUBJECT = ('/C=US/ST=California/L=San Diego/O=Example/OU=Engineering/'
+           'OU=Operations/CN=John Smith')
+
+
+class TestTenantIndex(TestX509Base):
+
+    def test_lookup(self):
+        index = TenantIndex({('Example', 'Engineering'): 'example-eng',
+                             ('Other', 'Sales'): 'other'})
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.lookup([set(['Example']),
+                                       set(['Engineering', 'Legal'])]),
+                         'example-eng')
+        self.assertEqual(index.lookup([set(['Example']), set(['Sales'])]),
+                         None)
+        self.assertEqual(index.lookup([set(), set(['Sales'])]), None)
+
+    def test_ambiguous(self):
+        index = TenantIndex({('Example', 'Engineering'): 'eng',
+                             ('Example', 'Operations'): 'ops'})
+        self.assertEqual(index.lookup([set(['Example']),
+                                       set(['Engineering', 'Operations'])]),
+                         None)
+
+    def test_single_attribute(self):
+        index = TenantIndex({'Example': 'example'}, attributes=('O',))
+        self.assertEqual(index.lookup([set(['Example'])]), 'example')
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, TenantIndex, {}, attributes=())
+        self.assertRaises(ValueError, TenantIndex, {('Example',): 'example'})
+
+    def test_normalize(self):
+        index = TenantIndex({(u'EXAMPLE ', 'Engineering'): 'example'},
+                            normalize=True)
+        self.assertEqual(index.lookup([set([u'example']),
+                                       set([u'engineering'])]), 'example')
+
+
+class TestInTenant(TestX509Base):
+
+    def setUp(self):
+        self.index = TenantIndex({('Example', 'Engineering'): 'example-eng',
+                                  ('Other', 'Sales'): 'other'})
+
+    def test_any_tenant(self):
+        predicate = in_tenant(self.index)
+        environ = self.make_environ({'CN': 'Issuer'}, SUBJECT)
+        self.eval_met_predicate(predicate, environ)
+        self.assertEqual(environ[ENVIRON_TENANT_KEY], 'example-eng')
+
+    def test_allowed_tenants(self):
+        environ = self.make_environ({'CN': 'Issuer'}, SUBJECT)
+        self.eval_met_predicate(in_tenant(self.index, ['example-eng']),
+                                environ)
+        self.eval_unmet_predicate(in_tenant(self.index, ['other']), environ,
+                                  'Invalid SSL client tenant.')
+
+    def test_unknown_tenant(self):
+        environ = self.make_environ({'CN': 'Issuer'},
+                                    {'O': 'Example', 'OU': 'Sales'})
+        self.eval_unmet_predicate(in_tenant(self.index), environ,
+                                  'Invalid SSL client tenant.')
+        self.assertEqual(environ[ENVIRON_TENANT_KEY], None)
+
+    def test_without_dn(self):
+        environ = self.make_environ({'CN': 'Issuer'}, SUBJECT)
+        del environ['SSL_CLIENT_S_DN']
+        self.eval_unmet_predicate(in_tenant(self.index), environ,
+                                  'Invalid SSL client tenant.')
+
+    def test_invalid_dn(self):
+        environ = self.make_environ({'CN': 'Issuer'}, 'invalid')
+        self.eval_unmet_predicate(in_tenant(self.index), environ,
+                                  'Invalid SSL client tenant.')
+
+    def test_server_variables(self):
+        environ = self.make_environ({'CN': 'Issuer'}, 'invalid')
+        environ['SSL_CLIENT_S_DN_O'] = 'Other'
+        environ['SSL_CLIENT_S_DN_OU_0'] = 'Sales'
+        environ['SSL_CLIENT_S_DN_OU_1'] = 'Marketing'
+        self.eval_met_predicate(in_tenant(self.index, ['other']), environ)
+
+    def test_resolved_once(self):
+        environ = self.make_environ({'CN': 'Issuer'}, SUBJECT)
+        predicate = in_tenant(self.index, ['example-eng'])
+        self.assertEqual(predicate.resolve(environ), 'example-eng')
+        # The index is not consulted again during the request.
+        self.index.add(('Example', 'Engineering'), 'changed')
+        self.assertEqual(in_tenant(self.index).resolve(environ),
+                         'example-eng')
+        self.assertEqual(in_tenant(self.index).resolve(dict(environ)),
+                         'example-eng')
+        self.assertEqual(in_tenant(self.index).resolve(
+            self.make_environ({'CN': 'Issuer'}, SUBJECT)), 'changed')
+
+    def test_resolved_by_source(self):
+        environ = self.make_environ({'CN': 'Issuer'}, SUBJECT)
+        for key, value in environ.items():
+            if key.startswith('SSL_CLIENT_'):
+                environ['HTTP_' + key] = value
+        environ['HTTP_SSL_CLIENT_S_DN'] = '/O=Other/OU=Sales/CN=John Smith'
+        self.eval_met_predicate(in_tenant(self.index, ['example-eng']),
+                                environ)
+        self.assertEqual(environ[ENVIRON_TENANT_KEY], 'example-eng')
+        predicate = in_tenant(self.index, ['other'], source=HeaderSource())
+        self.eval_met_predicate(predicate, environ)
+        self.assertEqual(environ[ENVIRON_TENANT_KEY], 'other')
+        self.eval_unmet_predicate(
+            in_tenant(self.index, ['example-eng'], source=HeaderSource()),
+            environ, 'Invalid SSL client tenant.'
+        )
+        # The tenant is the one of the last predicate evaluated.
+        self.eval_met_predicate(in_tenant(self.index), environ)
+        self.assertEqual(environ[ENVIRON_TENANT_KEY], 'example-eng')
+
+    def test_normalize(self):
+        index = TenantIndex({('example', 'engineering'): 'example'},
+                            normalize=True)
+        environ = self.make_environ({'CN': 'Issuer'}, SUBJECT)
+        self.eval_met_predicate(in_tenant(index), environ)
+
+    def test_not_verified(self):
+        environ = self.make_environ({'CN': 'Issuer'}, SUBJECT, verified=False)
+        self.eval_unmet_predicate(in_tenant(self.index), environ,
+                                  'Invalid SSL client tenant.')
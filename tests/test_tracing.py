@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+import shutil
+import tempfile
+
+from tests import TestX509Base
+from repoze.what.plugins.x509 import is_subject, Tracer, RingBufferSink, \
+     JSONLinesSink
+
+
+class TestTracer(TestX509Base):
+
+    def setUp(self):
+        self.sink = RingBufferSink()
+        self.tracer = Tracer(self.sink)
+
+    def make_environ_for_test(self, subject):
+        return self.make_environ({'CN': 'CA'}, subject)
+
+    def test_invalid_sample_rate(self):
+        self.assertRaises(ValueError, Tracer, self.sink, sample_rate=2)
+
+    def test_server_variable_path(self):
+        predicate = is_subject(common_name='Name', tracer=self.tracer)
+        environ = self.make_environ_for_test({'CN': 'Fail'})
+        environ['SSL_CLIENT_S_DN_CN'] = 'Name'
+        self.eval_met_predicate(predicate, environ)
+        span = self.sink.spans()[0]
+        self.assertEqual(span.predicate, 'is_subject')
+        self.assertEqual(span.path, 'server')
+        self.assertEqual(span.met, True)
+        assert 'SSL_CLIENT_S_DN_CN' in span.keys
+        assert 'SSL_CLIENT_S_DN' not in span.keys
+        self.assertEqual(sorted(span.timings.keys()), ['match', 'verify'])
+
+    def test_parse_path(self):
+        predicate = is_subject(common_name='Name', tracer=self.tracer)
+        environ = self.make_environ_for_test({'CN': 'Name'})
+        self.eval_met_predicate(predicate, environ)
+        span = self.sink.spans()[0]
+        self.assertEqual(span.path, 'parse')
+        assert 'SSL_CLIENT_S_DN' in span.keys
+        self.assertEqual(sorted(span.timings.keys()),
+                         ['match', 'parse', 'verify'])
+        assert span.duration >= 0
+
+    def test_unmet(self):
+        predicate = is_subject(common_name='Name', tracer=self.tracer)
+        environ = self.make_environ_for_test({'CN': 'Fail'})
+        self.eval_unmet_predicate(predicate, environ, is_subject.message)
+        self.assertEqual(self.sink.spans()[0].met, False)
+
+    def test_sampling(self):
+        predicate = is_subject(common_name='Name',
+                               tracer=Tracer(self.sink, sample_rate=0))
+        self.eval_met_predicate(predicate,
+                                self.make_environ_for_test({'CN': 'Name'}))
+        self.assertEqual(self.sink.spans(), [])
+
+    def test_ring_buffer_size(self):
+        sink = RingBufferSink(size=2)
+        predicate = is_subject(common_name='Name', tracer=Tracer(sink))
+        for n in range(3):
+            predicate.is_met(self.make_environ_for_test({'CN': 'Name'}))
+        self.assertEqual(len(sink.spans()), 2)
+
+    def test_untraced_predicate(self):
+        is_subject(common_name='Name', tracer=self.tracer)
+        predicate = is_subject(common_name='Name')
+        self.eval_met_predicate(predicate,
+                                self.make_environ_for_test({'CN': 'Name'}))
+        self.assertEqual(self.sink.spans(), [])
+
+    def test_json_lines_sink(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'traces.jsonl')
+            predicate = is_subject(common_name='Name',
+                                   tracer=Tracer(JSONLinesSink(path)))
+            for n in range(2):
+                predicate.is_met(self.make_environ_for_test({'CN': 'Name'}))
+            lines = open(path).read().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertEqual(json.loads(lines[0])['path'], 'parse')
+        finally:
+            shutil.rmtree(directory)
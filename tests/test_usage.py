@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Ckluster Technologies
+# All Rights Reserved.
+#
+# This software is subject to the provision stipulated in
+# http://www.ckluster.com/OPEN_LICENSE.txt.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from tests import TestX509Base, read_data
+from repoze.what.plugins.x509 import has_extended_key_usage, has_key_usage, \
+     has_policy, HeaderSource
+from repoze.what.plugins.x509.predicates import ENVIRON_PARSED_KEY
+from repoze.what.plugins.x509.usage import oid_bit
+
+
+POLICY = '1.3.6.1.4.1.99999.1.1'
+
+
+class _TestUsageBase(TestX509Base):
+
+    def make_environ_for_test(self, name='client.pem', **kwargs):
+        environ = self.make_environ({'CN': 'CA'}, {'CN': 'Name'}, **kwargs)
+        environ['SSL_CLIENT_CERT'] = read_data(name)
+        return environ
+
+
+class TestOIDBit(TestX509Base):
+
+    def test_interned(self):
+        bit = oid_bit('1.2.3.4.5.6.7')
+        self.assertEqual(oid_bit('1.2.3.4.5.6.7'), bit)
+        assert oid_bit('1.2.3.4.5.6.8') != bit
+        self.assertEqual(bin(bit).count('1'), 1)
+
+
+class TestHasExtendedKeyUsage(_TestUsageBase):
+
+    def test_met(self):
+        self.eval_met_predicate(has_extended_key_usage('clientAuth'),
+                                self.make_environ_for_test())
+        self.eval_met_predicate(
+            has_extended_key_usage('clientAuth', '1.3.6.1.5.5.7.3.4'),
+            self.make_environ_for_test()
+        )
+
+    def test_unmet(self):
+        self.eval_unmet_predicate(has_extended_key_usage('clientAuth'),
+                                  self.make_environ_for_test('other.pem'),
+                                  'Invalid SSL client certificate usage.')
+        self.assertEqual(
+            has_extended_key_usage('clientAuth', 'codeSigning').is_met(
+                self.make_environ_for_test()),
+            False
+        )
+
+    def test_any(self):
+        predicate = has_extended_key_usage('codeSigning', 'clientAuth',
+                                           require_all=False)
+        self.eval_met_predicate(predicate, self.make_environ_for_test())
+
+    def test_without_extension(self):
+        environ = self.make_environ_for_test('root.pem')
+        self.eval_met_predicate(has_extended_key_usage('clientAuth'),
+                                environ)
+        self.assertEqual(
+            has_extended_key_usage('clientAuth', strict=True).is_met(environ),
+            False
+        )
+
+    def test_without_certificate(self):
+        environ = self.make_environ_for_test()
+        del environ['SSL_CLIENT_CERT']
+        self.assertEqual(has_extended_key_usage('clientAuth').is_met(environ),
+                         False)
+        environ['SSL_CLIENT_CERT'] = 'invalid'
+        environ.pop(ENVIRON_PARSED_KEY)
+        self.assertEqual(has_extended_key_usage('clientAuth').is_met(environ),
+                         False)
+
+    def test_not_verified(self):
+        environ = self.make_environ_for_test(verified=False)
+        self.assertEqual(has_extended_key_usage('clientAuth').is_met(environ),
+                         False)
+
+    def test_decoded_once(self):
+        environ = self.make_environ_for_test()
+        self.eval_met_predicate(has_extended_key_usage('clientAuth'), environ)
+        # The certificate is not decoded again for the other predicates.
+        environ['SSL_CLIENT_CERT'] = read_data('other.pem')
+        self.eval_met_predicate(has_extended_key_usage('emailProtection'),
+                                environ)
+        self.eval_met_predicate(has_key_usage('digitalSignature'), environ)
+
+    def test_decoded_by_source(self):
+        environ = self.make_environ_for_test()
+        for key, value in environ.items():
+            if key.startswith('SSL_CLIENT_'):
+                environ['HTTP_' + key] = value
+        environ['HTTP_SSL_CLIENT_CERT'] = read_data('other.pem')
+        self.eval_met_predicate(has_extended_key_usage('clientAuth'), environ)
+        self.eval_unmet_predicate(
+            has_extended_key_usage('clientAuth', source=HeaderSource()),
+            environ, 'Invalid SSL client certificate usage.'
+        )
+        self.eval_met_predicate(
+            has_extended_key_usage('serverAuth', source=HeaderSource()),
+            environ
+        )
+
+    def test_without_usages(self):
+        self.assertRaises(ValueError, has_extended_key_usage)
+
+
+class TestHasKeyUsage(_TestUsageBase):
+
+    def test_met(self):
+        self.eval_met_predicate(
+            has_key_usage('digitalSignature', 'keyEncipherment'),
+            self.make_environ_for_test()
+        )
+
+    def test_unmet(self):
+        self.eval_unmet_predicate(has_key_usage('keyCertSign'),
+                                  self.make_environ_for_test(),
+                                  'Invalid SSL client certificate usage.')
+
+    def test_any(self):
+        self.eval_met_predicate(
+            has_key_usage('keyCertSign', 'digitalSignature',
+                          require_all=False),
+            self.make_environ_for_test()
+        )
+
+    def test_without_extension(self):
+        environ = self.make_environ_for_test('other.pem')
+        self.eval_met_predicate(has_key_usage('digitalSignature'), environ)
+        self.assertEqual(
+            has_key_usage('digitalSignature', strict=True).is_met(environ),
+            False
+        )
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, has_key_usage, 'everything')
+
+
+class TestHasPolicy(_TestUsageBase):
+
+    def test_met(self):
+        self.eval_met_predicate(has_policy(POLICY),
+                                self.make_environ_for_test())
+        self.eval_met_predicate(has_policy('1.2.3', POLICY),
+                                self.make_environ_for_test())
+
+    def test_all(self):
+        self.eval_met_predicate(
+            has_policy(POLICY, '2.23.140.1.2.1', require_all=True),
+            self.make_environ_for_test()
+        )
+        self.assertEqual(
+            has_policy(POLICY, '1.2.3', require_all=True).is_met(
+                self.make_environ_for_test()),
+            False
+        )
+
+    def test_unmet(self):
+        self.eval_unmet_predicate(has_policy(POLICY),
+                                  self.make_environ_for_test('other.pem'),
+                                  'Invalid SSL client certificate policy.')